@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1.endpoints import auth, students, attendance, face_recognition, sync, grades
+from app.api.v1.endpoints import auth, students, attendance, face_recognition, sync, grades, metrics
 
 api_router = APIRouter()
 
@@ -10,3 +10,4 @@ api_router.include_router(attendance.router, prefix="/attendance", tags=["attend
 api_router.include_router(face_recognition.router, prefix="/face-recognition", tags=["face recognition"])
 api_router.include_router(sync.router, prefix="/sync", tags=["synchronization"])
 api_router.include_router(grades.router, prefix="/grades", tags=["grades"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
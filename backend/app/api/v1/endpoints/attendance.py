@@ -1,12 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, date
 
-from app.core.database import get_db
+from app.core.database import get_db, get_read_uow, read_uow, UnitOfWork
+from app.core.export import export_response
+from app.core.pagination import InvalidCursor
+from app.core.config import settings
+from app.core.responses import list_response
 from app.core.security import verify_token
 from app.services.student_service import StudentService
-from app.models.attendance import AttendanceCreate, AttendanceResponse, AttendanceStats
+from app.services.attendance_service import AttendanceService
+from app.services.attendance_buffer import attendance_buffer
+from app.services.attendance_feed import attendance_feed
+from app.services.attendance_stats_service import AttendanceStatsService
+from app.services.attendance_bitmap_service import AttendanceBitmapService
+from app.services.attendance_report_service import AttendanceReportService
+from app.models.attendance import (
+    AttendanceCreate, AttendanceResponse, AttendanceStats, AttendanceListAdapter, AttendanceType,
+    StudentAttendanceHistory, TermAttendanceRates, AttendanceReport
+)
 
 router = APIRouter()
 
@@ -17,73 +31,119 @@ async def get_attendance_records(
     date_to: Optional[date] = Query(None),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(None),
+    uow: UnitOfWork = Depends(get_read_uow),
     current_user: dict = Depends(verify_token)
 ):
-    """Lấy danh sách điểm danh"""
+    """Lấy danh sách điểm danh (mới nhất trước).
+    
+    Header `X-Next-Cursor` chứa cursor của trang sau (keyset pagination).
+    """
     try:
-        # TODO: Implement attendance service
-        # attendance_service = AttendanceService(db)
-        # records = attendance_service.get_attendance_records(
-        #     student_id=student_id,
-        #     date_from=date_from,
-        #     date_to=date_to,
-        #     skip=skip,
-        #     limit=limit
-        # )
-        
-        # Placeholder response
-        return []
+        attendance_service = AttendanceService(uow)
+        records, next_cursor = await attendance_service.get_attendance_records_page(
+            student_id=student_id,
+            date_from=date_from,
+            date_to=date_to,
+            limit=limit,
+            cursor=cursor,
+            skip=skip
+        )
+        return list_response(AttendanceListAdapter, records, next_cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to fetch attendance records: {str(e)}"
         )
 
-@router.post("/check-in")
+@router.get("/export", summary="Stream attendance records as CSV or NDJSON")
+async def export_attendance_records(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    student_id: Optional[int] = Query(None),
+    date_from: Optional[date] = Query(None),
+    date_to: Optional[date] = Query(None),
+    gzip: bool = Query(False),
+    current_user: dict = Depends(verify_token)
+):
+    """Export điểm danh (theo ngày tăng dần) không phân trang.
+    
+    Dữ liệu đọc qua server-side cursor và gửi dần từng batch nên bộ nhớ
+    không tăng theo số dòng; `gzip=true` trả file `.gz`.
+    """
+    async def batches():
+        async with read_uow() as uow:
+            async for batch in AttendanceService(uow).stream_attendance_records(
+                student_id=student_id, date_from=date_from, date_to=date_to
+            ):
+                yield batch
+
+    return export_response(batches(), AttendanceService.EXPORT_FIELDS, format, "attendance", compress=gzip)
+
+async def _record_event(
+    student_id: int,
+    event: AttendanceType,
+    location: Optional[str],
+    device_id: Optional[str],
+    uow: UnitOfWork
+) -> dict:
+    """Kiểm tra học sinh rồi đưa event vào write-behind buffer"""
+    student = await StudentService(uow).get_student(student_id)
+    if not student:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
+    recorded = await attendance_buffer.record(student_id, event, location=location, device_id=device_id)
+    action = "Check-in" if event == AttendanceType.CHECK_IN else "Check-out"
+    return {
+        "message": f"{action} already recorded" if recorded.duplicate else f"{action} recorded successfully",
+        "student_id": student_id,
+        "event": event.value,
+        "date": recorded.day.isoformat(),
+        "recorded_at": recorded.at.isoformat(),
+        "duplicate": recorded.duplicate,
+    }
+
+@router.post("/check-in", status_code=status.HTTP_202_ACCEPTED)
 async def check_in(
     student_id: int,
     location: Optional[str] = None,
     device_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    uow: UnitOfWork = Depends(get_read_uow),
     current_user: dict = Depends(verify_token)
 ):
-    """Điểm danh vào"""
+    """Điểm danh vào.
+    
+    Event được ghi vào buffer và trả về ngay; bản ghi xuất hiện trong
+    `attendance_records` sau lần flush kế tiếp (mặc định tối đa ~1 giây).
+    Các lần check-in sau lần đầu trong ngày trả `duplicate=true` và không được ghi.
+    """
     try:
-        # TODO: Implement check-in logic
-        # attendance_service = AttendanceService(db)
-        # result = attendance_service.check_in(
-        #     student_id=student_id,
-        #     location=location,
-        #     device_id=device_id
-        # )
-        
-        return {"message": "Check-in recorded successfully", "student_id": student_id}
+        return await _record_event(student_id, AttendanceType.CHECK_IN, location, device_id, uow)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to record check-in: {str(e)}"
         )
 
-@router.post("/check-out")
+@router.post("/check-out", status_code=status.HTTP_202_ACCEPTED)
 async def check_out(
     student_id: int,
     location: Optional[str] = None,
     device_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    uow: UnitOfWork = Depends(get_read_uow),
     current_user: dict = Depends(verify_token)
 ):
-    """Điểm danh ra"""
+    """Điểm danh ra (ghi qua buffer như check-in).
+    
+    Check-out lặp trong `ATTENDANCE_CHECKOUT_DEBOUNCE_SECONDS` bị bỏ qua
+    (`duplicate=true`); bản ghi giữ lần check-out muộn nhất được ghi.
+    """
     try:
-        # TODO: Implement check-out logic
-        # attendance_service = AttendanceService(db)
-        # result = attendance_service.check_out(
-        #     student_id=student_id,
-        #     location=location,
-        #     device_id=device_id
-        # )
-        
-        return {"message": "Check-out recorded successfully", "student_id": student_id}
+        return await _record_event(student_id, AttendanceType.CHECK_OUT, location, device_id, uow)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -94,27 +154,20 @@ async def check_out(
 async def get_attendance_stats(
     date_from: Optional[date] = Query(None),
     date_to: Optional[date] = Query(None),
-    class_name: Optional[str] = Query(None),
-    db: Session = Depends(get_db),
+    class_name: Optional[str] = Query(None, description="Grade; bỏ trống để lấy toàn trường"),
+    uow: UnitOfWork = Depends(get_read_uow),
     current_user: dict = Depends(verify_token)
 ):
-    """Lấy thống kê điểm danh"""
+    """Lấy thống kê điểm danh (mặc định hôm nay).
+    
+    Đọc từ bảng tổng hợp attendance_daily_stats (theo ngày, grade) nên chi
+    phí không phụ thuộc số bản ghi điểm danh.
+    """
     try:
-        # TODO: Implement attendance statistics
-        # attendance_service = AttendanceService(db)
-        # stats = attendance_service.get_attendance_stats(
-        #     date_from=date_from,
-        #     date_to=date_to,
-        #     class_name=class_name
-        # )
-        
-        # Placeholder response
-        return AttendanceStats(
-            total_students=0,
-            present_today=0,
-            absent_today=0,
-            late_today=0,
-            attendance_rate=0.0
+        return await AttendanceStatsService(uow).get_stats(
+            date_from=date_from,
+            date_to=date_to,
+            grade=class_name
         )
     except Exception as e:
         raise HTTPException(
@@ -122,25 +175,115 @@ async def get_attendance_stats(
             detail=f"Failed to get attendance stats: {str(e)}"
         )
 
-@router.get("/student/{student_id}")
+@router.get("/reports", response_model=AttendanceReport)
+async def get_attendance_report(
+    date_from: Optional[date] = Query(None, description="Mặc định ngày đầu tháng của date_to"),
+    date_to: Optional[date] = Query(None, description="Mặc định hôm nay"),
+    class_name: Optional[str] = Query(None, description="Grade; bỏ trống để lấy toàn trường"),
+    format: str = Query("json", pattern="^(json|csv|ndjson)$"),
+    view: str = Query("grades", pattern="^(grades|students)$", description="Bảng xuất ra khi format=csv|ndjson"),
+    gzip: bool = Query(False),
+    uow: UnitOfWork = Depends(get_read_uow),
+    current_user: dict = Depends(verify_token)
+):
+    """Báo cáo điểm danh: ma trận grade x ngày và tổng hợp, xếp hạng theo học sinh.
+    
+    JSON trả cả hai phần; CSV/NDJSON trả một bảng theo `view` (`grades`: một
+    dòng mỗi grade mỗi ngày, `students`: một dòng mỗi học sinh). Kết quả được
+    cache theo (khoảng ngày, grade) và tự xoá khi có điểm danh mới trong khoảng.
+    """
+    date_to = date_to or date.today()
+    date_from = date_from or date_to.replace(day=1)
+    if date_from > date_to:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="date_from must not be after date_to")
+    if (date_to - date_from).days + 1 > settings.ATTENDANCE_REPORT_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Date range is limited to {settings.ATTENDANCE_REPORT_MAX_DAYS} days"
+        )
+    try:
+        report = await AttendanceReportService(uow).get_report(date_from, date_to, grade=class_name)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to build attendance report: {str(e)}"
+        )
+    if format == "json":
+        return Response(content=report.model_dump_json(), media_type="application/json")
+
+    if view == "grades":
+        rows, fields = AttendanceReportService.grade_day_rows(report), AttendanceReportService.GRADE_DAY_FIELDS
+    else:
+        rows, fields = AttendanceReportService.student_rows(report), AttendanceReportService.STUDENT_FIELDS
+
+    async def batches():
+        for start in range(0, len(rows), settings.EXPORT_BATCH_SIZE):
+            yield rows[start:start + settings.EXPORT_BATCH_SIZE]
+
+    filename = f"attendance_{view}_{date_from.isoformat()}_{date_to.isoformat()}"
+    return export_response(batches(), fields, format, filename, compress=gzip)
+
+@router.get("/live", summary="Live attendance feed (Server-Sent Events)")
+async def attendance_live_feed(
+    overflow: Optional[str] = Query(
+        None, pattern="^(resync|drop_oldest|close)$",
+        description="Xử lý khi client đọc chậm; mặc định ATTENDANCE_FEED_OVERFLOW"
+    ),
+    current_user: dict = Depends(verify_token)
+):
+    """Stream SSE cho dashboard thay cho việc poll `/stats`.
+    
+    Message đầu tiên (`event: snapshot`) là số đếm theo grade của hôm nay;
+    sau đó mỗi lần ghi điểm danh gửi một `event: delta` gồm các bản ghi mới
+    hoặc đổi status và số thay đổi theo (ngày, grade). `id` là số thứ tự,
+    client cộng các delta có seq lớn hơn snapshot.
+    """
+    return StreamingResponse(
+        attendance_feed.stream(overflow),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/rates", response_model=TermAttendanceRates)
+async def get_term_attendance_rates(
+    class_name: str = Query(..., description="Grade"),
+    day: Optional[date] = Query(None, description="Ngày bất kỳ trong học kỳ; mặc định hôm nay"),
+    uow: UnitOfWork = Depends(get_read_uow),
+    current_user: dict = Depends(verify_token)
+):
+    """Tỷ lệ chuyên cần theo học kỳ của từng học sinh trong một grade (cho sổ điểm/học bạ)"""
+    try:
+        return await AttendanceBitmapService(uow).get_grade_rates(grade=class_name, day=day)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get attendance rates: {str(e)}"
+        )
+
+@router.get("/student/{student_id}", response_model=StudentAttendanceHistory)
 async def get_student_attendance(
     student_id: int,
-    date_from: Optional[date] = Query(None),
-    date_to: Optional[date] = Query(None),
-    db: Session = Depends(get_db),
+    date_from: Optional[date] = Query(None, description="Mặc định đầu học kỳ hiện tại"),
+    date_to: Optional[date] = Query(None, description="Mặc định hôm nay"),
+    uow: UnitOfWork = Depends(get_read_uow),
     current_user: dict = Depends(verify_token)
 ):
-    """Lấy lịch sử điểm danh của học sinh"""
+    """Lấy lịch sử điểm danh của học sinh trong học kỳ chứa `date_from`.
+    
+    Đọc bitmap học kỳ của học sinh (attendance_term_bitmaps): trạng thái
+    từng ngày học, chuỗi ngày đi học liên tiếp và tỷ lệ chuyên cần.
+    """
     try:
-        # TODO: Implement student attendance history
-        # attendance_service = AttendanceService(db)
-        # history = attendance_service.get_student_attendance(
-        #     student_id=student_id,
-        #     date_from=date_from,
-        #     date_to=date_to
-        # )
-        
-        return {"message": "Student attendance history", "student_id": student_id}
+        history = await AttendanceBitmapService(uow).get_student_history(
+            student_id=student_id,
+            date_from=date_from,
+            date_to=date_to
+        )
+        if history is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
+        return history
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
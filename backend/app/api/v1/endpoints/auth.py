@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
-from typing import Optional
+from typing import List, Optional
 
-from app.core.database import get_db
+from app.core.database import get_async_db
 from app.core.security import (
     verify_password, 
     create_access_token, 
@@ -12,7 +12,9 @@ from app.core.security import (
     verify_token
 )
 from app.core.config import settings
-from app.models.user import UserCreate, UserResponse, TokenResponse, UserLogin
+from app.core.pagination import InvalidCursor
+from app.core.responses import list_response
+from app.models.user import UserCreate, UserResponse, TokenResponse, UserLogin, UserListAdapter
 from app.services.user_service import UserService
 
 router = APIRouter()
@@ -20,12 +22,12 @@ router = APIRouter()
 @router.post("/login", response_model=TokenResponse)
 async def login(
     user_data: UserLogin,  # Sử dụng UserLogin model thay vì OAuth2PasswordRequestForm
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Đăng nhập user"""
     try:
         user_service = UserService(db)
-        user = user_service.authenticate_user(user_data.username, user_data.password)
+        user = await user_service.authenticate_user(user_data.username, user_data.password)
         
         if not user:
             raise HTTPException(
@@ -63,27 +65,27 @@ async def login(
 @router.post("/register", response_model=UserResponse)
 async def register(
     user_data: UserCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Đăng ký user mới (chỉ admin mới có quyền)"""
     try:
         user_service = UserService(db)
         
         # Kiểm tra username và email đã tồn tại chưa
-        if user_service.get_user_by_username(user_data.username):
+        if await user_service.get_user_by_username(user_data.username):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already registered"
             )
         
-        if user_service.get_user_by_email(user_data.email):
+        if await user_service.get_user_by_email(user_data.email):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
         
         # Tạo user mới
-        user = user_service.create_user(user_data)
+        user = await user_service.create_user(user_data)
         
         return UserResponse(
             id=user.id,
@@ -106,7 +108,7 @@ async def register(
 @router.post("/refresh", response_model=TokenResponse)
 async def refresh_token(
     refresh_token: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Làm mới access token từ refresh token"""
     try:
@@ -140,12 +142,12 @@ async def logout():
 @router.get("/me", response_model=UserResponse)
 async def get_current_user_info(
     current_user: dict = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Lấy thông tin user hiện tại"""
     try:
         user_service = UserService(db)
-        user = user_service.get_user_by_username(current_user["sub"])
+        user = await user_service.get_user_by_username(current_user["sub"])
         
         if not user:
             raise HTTPException(
@@ -170,3 +172,30 @@ async def get_current_user_info(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to get user info: {str(e)}"
         )
+
+@router.get("/users", response_model=List[UserResponse])
+async def get_users(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    sort: str = Query("id", pattern="^(id|username|full_name)$"),
+    current_user: dict = Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Danh sách users (chỉ admin); header `X-Next-Cursor` chứa cursor của trang sau"""
+    if current_user.get("role") != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    try:
+        user_service = UserService(db)
+        users, next_cursor = await user_service.get_users_page(limit=limit, cursor=cursor, skip=skip, sort=sort)
+        return list_response(UserListAdapter, users, next_cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get users: {str(e)}"
+        )
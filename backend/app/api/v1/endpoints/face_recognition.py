@@ -1,27 +1,49 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 import numpy as np
 import cv2
 import os
+import json
+import hashlib
+import hmac
 from datetime import datetime
 
-from app.core.database import get_db
+from app.core.database import get_db, Student
 from app.core.security import verify_token
 from app.services.face_recognition_service import FaceRecognitionService
-from app.services.student_service import StudentService
 from app.models.face_recognition import (
     FaceRegistrationRequest,
     FaceRegistrationResponse,
     FaceRecognitionRequest,
     FaceRecognitionResponse,
-    FaceEmbeddingResponse
+    FaceEmbeddingResponse,
+    FaceSimilarityMatrixResponse,
+    GalleryDedupeReport,
+    RecognitionCheckIn
 )
+from app.models.attendance import AttendanceType
+from app.services.attendance_buffer import attendance_buffer
 from app.core.config import settings
+from app.core.admission import admit, PRIORITY_KIOSK, PRIORITY_ADMIN, PRIORITY_BULK
 
 router = APIRouter()
 
-@router.post("/register-face", response_model=FaceRegistrationResponse)
+def _parse_id_list(value: Optional[str], field: str) -> List[int]:
+    """Parse danh sách id dạng "1,2,3" từ form field"""
+    if not value:
+        return []
+    try:
+        return [int(item) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{field} must be a comma-separated list of integers"
+        )
+
+@router.post("/register-face", response_model=FaceRegistrationResponse, dependencies=[Depends(admit("register-face", PRIORITY_ADMIN, auth=verify_token))])
 async def register_face(
     student_id: int = Form(...),
     images: List[UploadFile] = File(...),
@@ -38,8 +60,8 @@ async def register_face(
             )
         
         # Kiểm tra student có tồn tại không
-        student_service = StudentService(db)
-        student = student_service.get_student_by_id(student_id)
+        # Dùng chung session với enroll_faces (một connection mỗi request)
+        student = await run_in_threadpool(db.get, Student, student_id)
         if not student:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -53,16 +75,20 @@ async def register_face(
                 detail="Please provide 3-5 images for face registration"
             )
         
-        # Xử lý đăng ký khuôn mặt
+        # Xử lý đăng ký khuôn mặt (bỏ qua ảnh gần trùng lặp)
         face_service = FaceRecognitionService(db)
-        result = await face_service.register_face(student_id, images)
+        uploads = [(img.filename or str(i), await img.read()) for i, img in enumerate(images)]
+        result = await run_in_threadpool(
+            face_service.enroll_faces, student_id, uploads, os.path.join(settings.UPLOAD_DIR, "faces")
+        )
         
         return FaceRegistrationResponse(
             student_id=student_id,
             student_name=student.full_name,
             embeddings_count=len(result["embeddings"]),
             confidence_scores=result["confidence_scores"],
-            message="Face registration completed successfully"
+            message="Face registration completed successfully",
+            skipped_images=result["skipped"]
         )
         
     except HTTPException:
@@ -73,14 +99,57 @@ async def register_face(
             detail=f"Face registration failed: {str(e)}"
         )
 
-@router.post("/recognize-face", response_model=FaceRecognitionResponse)
+def _verify_device(device_id: Optional[str], device_key: Optional[str]) -> bool:
+    """True nếu device_id đã đăng ký; 403 nếu device key không khớp với device_id"""
+    expected = settings.FACE_AUTO_CHECK_IN_DEVICES.get(device_id) if device_id else None
+    if expected is None:
+        return False
+    digest = hashlib.sha256((device_key or "").encode()).hexdigest()
+    if not device_key or not hmac.compare_digest(digest, expected.lower()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Invalid device key"
+        )
+    return True
+
+async def _auto_check_in(result: dict, location: Optional[str], device_id: Optional[str], registered: bool) -> RecognitionCheckIn:
+    """Đưa check-in của học sinh vừa nhận diện vào write-behind buffer nếu đủ điều kiện"""
+    threshold = settings.FACE_AUTO_CHECK_IN_THRESHOLD
+    if not registered:
+        return RecognitionCheckIn(status="unregistered_device", threshold=threshold)
+    if not result["student_found"]:
+        return RecognitionCheckIn(status="not_recognized", threshold=threshold)
+    if result["confidence_score"] < threshold:
+        return RecognitionCheckIn(status="below_threshold", threshold=threshold)
+    # Dedupe của buffer bỏ các check-in sau lần đầu trong ngày
+    recorded = await attendance_buffer.record(
+        result["student_id"], AttendanceType.CHECK_IN, location=location, device_id=device_id
+    )
+    return RecognitionCheckIn(
+        status="duplicate" if recorded.duplicate else "recorded",
+        threshold=threshold,
+        attendance_date=recorded.day,
+        recorded_at=recorded.at,
+    )
+
+@router.post("/recognize-face", response_model=FaceRecognitionResponse, dependencies=[Depends(admit("recognize-face", PRIORITY_KIOSK))])
 async def recognize_face(
     image: UploadFile = File(...),
     location: Optional[str] = Form(None),
     device_id: Optional[str] = Form(None),
+    check_in: bool = Form(False),
+    token: Optional[str] = None,
+    x_device_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Nhận diện khuôn mặt từ ảnh"""
+    """Nhận diện khuôn mặt từ ảnh.
+    
+    - **check_in**: Ghi luôn check-in cho học sinh được nhận diện (cần `token`),
+      thay cho lời gọi `/attendance/check-in` thứ hai. Chỉ ghi khi `device_id`
+      nằm trong `FACE_AUTO_CHECK_IN_DEVICES`, header `X-Device-Key` khớp với
+      key của thiết bị đó (sai key trả 403) và độ tương đồng đạt
+      `FACE_AUTO_CHECK_IN_THRESHOLD`; kết quả nằm trong trường `attendance`.
+    """
     try:
         # Kiểm tra file ảnh
         if not image.content_type.startswith("image/"):
@@ -88,10 +157,25 @@ async def recognize_face(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="File must be an image"
             )
+        # Điểm danh cần đăng nhập như /attendance/check-in
+        if check_in:
+            try:
+                verify_token(token or "")
+            except Exception:
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail="Invalid authentication credentials"
+                )
+            # device_id do client gửi lên: chỉ tin khi kèm đúng device key
+            registered = _verify_device(device_id, x_device_key)
         
         # Xử lý nhận diện khuôn mặt
         face_service = FaceRecognitionService(db)
-        result = await face_service.recognize_face(image, location, device_id)
+        try:
+            result = await run_in_threadpool(face_service.identify, await image.read())
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        attendance = await _auto_check_in(result, location, device_id, registered) if check_in else None
         
         if result["student_found"]:
             return FaceRecognitionResponse(
@@ -101,7 +185,8 @@ async def recognize_face(
                 recognition_time=datetime.now(),
                 location=location,
                 device_id=device_id,
-                status="recognized"
+                status="recognized",
+                attendance=attendance
             )
         else:
             return FaceRecognitionResponse(
@@ -111,7 +196,8 @@ async def recognize_face(
                 recognition_time=datetime.now(),
                 location=location,
                 device_id=device_id,
-                status="unknown"
+                status="unknown",
+                attendance=attendance
             )
         
     except HTTPException:
@@ -122,7 +208,7 @@ async def recognize_face(
             detail=f"Face recognition failed: {str(e)}"
         )
 
-@router.post("/compare-faces")
+@router.post("/compare-faces", dependencies=[Depends(admit("compare-faces", PRIORITY_ADMIN))])
 async def compare_faces(
     image1: UploadFile = File(...),
     image2: UploadFile = File(...),
@@ -138,9 +224,18 @@ async def compare_faces(
                     detail="Files must be images"
                 )
         
-        # So sánh khuôn mặt
+        # So sánh khuôn mặt (trường hợp 1x1 của /similarity)
         face_service = FaceRecognitionService(db)
-        similarity_score = await face_service.compare_faces(image1, image2)
+        uploads = [("image1", await image1.read()), ("image2", await image2.read())]
+        rows, row_vectors, _, _, skipped = await run_in_threadpool(
+            face_service.build_similarity_inputs, uploads, []
+        )
+        if skipped:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"No face detected in one or both images: {skipped}"
+            )
+        similarity_score = float(face_service.similarity_matrix(row_vectors[:1], row_vectors[1:])[0, 0])
         
         return {
             "similarity_score": similarity_score,
@@ -156,6 +251,89 @@ async def compare_faces(
             detail=f"Face comparison failed: {str(e)}"
         )
 
+@router.post("/similarity", response_model=FaceSimilarityMatrixResponse, dependencies=[Depends(admit("similarity", PRIORITY_BULK, auth=verify_token))])
+async def face_similarity(
+    images: List[UploadFile] = File([]),
+    student_ids: Optional[str] = Form(None),
+    target_student_ids: Optional[str] = Form(None),
+    stream: bool = Form(False),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """
+    Ma trận độ tương đồng 1:N / N:M giữa ảnh upload và học sinh.
+    
+    - **images**: Ảnh khuôn mặt cần so sánh (tùy chọn)
+    - **student_ids**: Danh sách id học sinh dạng "1,2,3", dùng embedding đã lưu
+    - **target_student_ids**: Tập cột; bỏ trống để so sánh N:N trong tập query
+    - **stream**: Trả về NDJSON từng hàng thay vì một ma trận JSON
+    """
+    try:
+        # Kiểm tra quyền
+        if current_user.get("role") not in ["admin", "teacher"]:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        
+        query_ids = _parse_id_list(student_ids, "student_ids")
+        target_ids = _parse_id_list(target_student_ids, "target_student_ids") if target_student_ids else None
+        
+        if not images and not query_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Provide at least one image or student id"
+            )
+        if len(images) + len(query_ids) + len(target_ids or []) > settings.FACE_SIMILARITY_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Maximum {settings.FACE_SIMILARITY_MAX_ITEMS} images and students per request"
+            )
+        for img in images:
+            if not img.content_type.startswith("image/"):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="All files must be images"
+                )
+        
+        uploads = [(img.filename or str(i), await img.read()) for i, img in enumerate(images)]
+        face_service = FaceRecognitionService(db)
+        row_labels, rows, column_labels, columns, skipped = await run_in_threadpool(
+            face_service.build_similarity_inputs, uploads, query_ids, target_ids
+        )
+        threshold = settings.FACE_RECOGNITION_THRESHOLD
+        
+        if stream:
+            def ndjson_rows():
+                yield json.dumps({"columns": column_labels, "threshold": threshold, "skipped": skipped}) + "\n"
+                if not row_labels or not column_labels:
+                    return
+                for label, scores in zip(row_labels, face_service.iter_similarity_rows(rows, columns)):
+                    yield json.dumps({"row": label, "scores": np.round(scores, 6).tolist()}) + "\n"
+            
+            return StreamingResponse(ndjson_rows(), media_type="application/x-ndjson")
+        
+        if row_labels and column_labels:
+            matrix = face_service.similarity_matrix(rows, columns)
+        else:
+            matrix = np.zeros((len(row_labels), len(column_labels)), dtype=np.float32)
+        
+        return FaceSimilarityMatrixResponse(
+            rows=row_labels,
+            columns=column_labels,
+            matrix=np.round(matrix, 6).tolist(),
+            threshold=threshold,
+            skipped=skipped
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Face similarity failed: {str(e)}"
+        )
+
 @router.get("/student-embeddings/{student_id}", response_model=List[FaceEmbeddingResponse])
 async def get_student_embeddings(
     student_id: int,
@@ -229,7 +407,35 @@ async def delete_student_embedding(
             detail=f"Failed to delete embedding: {str(e)}"
         )
 
-@router.post("/bulk-recognition")
+@router.post("/dedupe-gallery", response_model=GalleryDedupeReport, dependencies=[Depends(admit("dedupe-gallery", PRIORITY_BULK, auth=verify_token))])
+async def dedupe_gallery(
+    student_id: Optional[int] = None,
+    apply: bool = False,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(verify_token)
+):
+    """Báo cáo embedding gần trùng trong gallery; apply=true để xóa chúng"""
+    try:
+        # Chỉ admin mới được dọn dẹp dữ liệu
+        if current_user.get("role") != "admin":
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Insufficient permissions"
+            )
+        
+        face_service = FaceRecognitionService(db)
+        report = await run_in_threadpool(face_service.dedupe_gallery, student_id, apply)
+        return GalleryDedupeReport(**report)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Gallery dedupe failed: {str(e)}"
+        )
+
+@router.post("/bulk-recognition", dependencies=[Depends(admit("bulk-recognition", PRIORITY_BULK))])
 async def bulk_face_recognition(
     images: List[UploadFile] = File(...),
     location: Optional[str] = Form(None),
@@ -1,15 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import List
-from app.models.grade import GradeCreate, GradeUpdate, GradeResponse, GradeListResponse
+from typing import List, Optional
+from app.models.grade import GradeCreate, GradeUpdate, GradeResponse, GradeListResponse, GradeListAdapter
 from app.services.grade_service import GradeService
 from app.core.security import get_current_user
+from app.core.database import get_uow, get_read_uow, UnitOfWork
+from app.core.pagination import InvalidCursor
+from app.core.responses import list_response
 
 router = APIRouter()
-grade_service = GradeService()
+
+def get_grade_service(uow: UnitOfWork = Depends(get_uow)) -> GradeService:
+    """GradeService dùng unit of work của request (có ghi)"""
+    return GradeService(uow)
+
+def get_read_grade_service(uow: UnitOfWork = Depends(get_read_uow)) -> GradeService:
+    """GradeService dùng session chỉ đọc"""
+    return GradeService(uow)
 
 @router.post("/", response_model=GradeResponse, summary="Create new grade")
 async def create_grade(
     grade_data: GradeCreate,
+    grade_service: GradeService = Depends(get_grade_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """
@@ -21,6 +32,7 @@ async def create_grade(
     """
     try:
         grade = await grade_service.create_grade(grade_data)
+        await grade_service.uow.commit()
         return grade
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -31,7 +43,10 @@ async def create_grade(
 async def get_grades(
     skip: int = Query(0, ge=0, description="Number of records to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Number of records to return"),
-    active_only: bool = Query(True, description="Return only active grades")
+    active_only: bool = Query(True, description="Return only active grades"),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    sort: str = Query("name", pattern="^(name|id)$", description="Sort key"),
+    grade_service: GradeService = Depends(get_read_grade_service)
 ):
     """
     Get list of grades with pagination.
@@ -39,16 +54,24 @@ async def get_grades(
     - **skip**: Number of records to skip (for pagination)
     - **limit**: Number of records to return (max 1000)
     - **active_only**: Whether to return only active grades
+    - **cursor**: Keyset pagination cursor (use instead of skip)
+    
+    The `X-Next-Cursor` response header is set when there are more records.
     """
     try:
-        grades = await grade_service.get_grades(skip=skip, limit=limit, active_only=active_only)
-        return grades
+        grades, next_cursor = await grade_service.get_grades_page(
+            limit=limit, cursor=cursor, skip=skip, active_only=active_only, sort=sort
+        )
+        return list_response(GradeListAdapter, grades, next_cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @router.get("/{grade_id}", response_model=GradeResponse, summary="Get grade by ID")
 async def get_grade(
     grade_id: int,
+    grade_service: GradeService = Depends(get_read_grade_service),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -70,6 +93,7 @@ async def get_grade(
 async def update_grade(
     grade_id: int,
     grade_data: GradeUpdate,
+    grade_service: GradeService = Depends(get_grade_service),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -82,6 +106,7 @@ async def update_grade(
         grade = await grade_service.update_grade(grade_id, grade_data)
         if not grade:
             raise HTTPException(status_code=404, detail="Grade not found")
+        await grade_service.uow.commit()
         return grade
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -93,6 +118,7 @@ async def update_grade(
 @router.delete("/{grade_id}", summary="Delete grade")
 async def delete_grade(
     grade_id: int,
+    grade_service: GradeService = Depends(get_grade_service),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -106,6 +132,7 @@ async def delete_grade(
         success = await grade_service.delete_grade(grade_id)
         if not success:
             raise HTTPException(status_code=404, detail="Grade not found")
+        await grade_service.uow.commit()
         return {"message": "Grade deleted successfully"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -117,6 +144,7 @@ async def delete_grade(
 @router.get("/name/{grade_name}", response_model=GradeResponse, summary="Get grade by name")
 async def get_grade_by_name(
     grade_name: str,
+    grade_service: GradeService = Depends(get_read_grade_service),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -136,6 +164,7 @@ async def get_grade_by_name(
 
 @router.get("/stats/count", summary="Get grade statistics")
 async def get_grade_stats(
+    grade_service: GradeService = Depends(get_read_grade_service),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -0,0 +1,52 @@
+from fastapi import APIRouter
+
+from app.core.admission import admission_controller
+from app.core.cache import cache
+from app.services.grade_service import grade_cache
+from app.services.attendance_report_service import report_cache
+from app.core.db_metrics import checkout_stats, pool_monitor
+from app.services.face_recognition_service import face_gallery, face_model_pool
+from app.services.attendance_buffer import attendance_buffer
+from app.services.attendance_feed import attendance_feed
+
+router = APIRouter()
+
+@router.get("/face-models")
+async def get_face_model_pool_metrics():
+    """Thống kê pool detector/embedder (số instance đang dùng, thời gian chờ checkout)"""
+    return face_model_pool.stats()
+
+@router.get("/face-gallery")
+async def get_face_gallery_metrics():
+    """Ma trận template dùng cho nhận diện: số học sinh, số lần xây lại/invalidate, tuổi"""
+    return face_gallery.stats()
+
+@router.get("/admission")
+async def get_admission_metrics():
+    """Queue depth, request ML đang chạy và số lần từ chối (429) theo endpoint"""
+    return admission_controller.stats()
+
+@router.get("/db-checkouts")
+async def get_db_checkout_metrics():
+    """Số lần checkout connection DB trên mỗi request, theo route"""
+    return checkout_stats.snapshot()
+
+@router.get("/db-pool")
+async def get_db_pool_metrics():
+    """Trạng thái pool (in-use, overflow), thời gian chờ checkout và connection bị giữ lâu theo route"""
+    return pool_monitor.snapshot()
+
+@router.get("/cache")
+async def get_cache_metrics():
+    """Backend cache, TTL và hit/miss/hit ratio theo namespace (kèm cache grades, báo cáo trong process)"""
+    return {**cache.snapshot(), "grades": grade_cache.snapshot(), "attendance_reports": report_cache.snapshot()}
+
+@router.get("/attendance-buffer")
+async def get_attendance_buffer_metrics():
+    """Số dòng điểm danh đang chờ flush, số lần flush/lỗi và thời gian flush gần nhất"""
+    return attendance_buffer.stats()
+
+@router.get("/attendance-feed")
+async def get_attendance_feed_metrics():
+    """Số dashboard đang nghe live feed, message đang chờ và số lần bỏ/resync/đóng do client chậm"""
+    return attendance_feed.stats()
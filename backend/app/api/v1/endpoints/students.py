@@ -1,23 +1,39 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
 from typing import List, Optional
 import os
-import shutil
 from datetime import datetime
-import uuid
 import time
 import logging
 
-from app.models.student import StudentCreate, StudentUpdate, StudentResponse
+from app.models.student import (
+    StudentCreate, StudentUpdate, StudentResponse, StudentListAdapter, StudentImportResult,
+    StudentSearchHit, StudentSearchAdapter
+)
 from app.models.face_recognition import FaceRegistrationRequest, FaceRegistrationResponse
+from app.core.admission import admit, PRIORITY_ADMIN
+from app.core.cache import cache
+from app.core.database import get_db, get_uow, get_read_uow, read_uow, UnitOfWork, Student
+from app.core.export import export_response
 from app.core.security import get_current_user
-from app.services.student_service import StudentService
+from app.core.config import settings
+from app.core.responses import list_response
+from app.services.student_service import StudentService, iter_import_rows
 from app.services.face_recognition_service import FaceRecognitionService
 
 router = APIRouter()
-student_service = StudentService()
 face_recognition_service = FaceRecognitionService()
 
+def get_student_service(uow: UnitOfWork = Depends(get_uow)) -> StudentService:
+    """StudentService dùng unit of work của request (có ghi)"""
+    return StudentService(uow)
+
+def get_read_student_service(uow: UnitOfWork = Depends(get_read_uow)) -> StudentService:
+    """StudentService dùng session chỉ đọc"""
+    return StudentService(uow)
+
 # Cấu hình upload
 UPLOAD_DIR = "uploads/students"
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp"}
@@ -33,11 +49,13 @@ logger = logging.getLogger(__name__)
 @router.post("/", response_model=StudentResponse)
 async def create_student(
     student_data: StudentCreate,
+    student_service: StudentService = Depends(get_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """Tạo student mới"""
     try:
         student = await student_service.create_student(student_data)
+        await student_service.uow.commit()
         return student
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -55,6 +73,7 @@ async def create_student_with_photos(
     parent_phone: Optional[str] = Form(None),
     parent_email: Optional[str] = Form(None),
     photos: List[UploadFile] = File(...),
+    student_service: StudentService = Depends(get_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """
@@ -130,8 +149,10 @@ async def create_student_with_photos(
         
         # Update student with first photo path
         if photo_paths:
-            await student_service.update_student_photo(student.id, photo_paths[0])
+            student = await student_service.update_student_photo(student.id, photo_paths[0])
         
+        # Student và photo path được ghi trong cùng một transaction
+        await student_service.uow.commit()
         return student
         
     except ValueError as e:
@@ -140,23 +161,111 @@ async def create_student_with_photos(
         logger.error(f"Error creating student with photos: {e}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@router.post("/import", response_model=StudentImportResult, summary="Bulk import students from CSV or NDJSON")
+async def import_students(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$"),
+    dry_run: bool = Query(False),
+    student_service: StudentService = Depends(get_student_service),
+    # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
+):
+    """
+    Import many students in one request.
+    
+    - **file**: CSV with a header row (`full_name`, `grade` required, other StudentCreate
+      fields optional) or NDJSON (one JSON object per line)
+    - **format**: `csv` or `ndjson`; guessed from the file extension when omitted
+    - **dry_run**: validate and allocate codes without inserting
+    
+    Invalid rows are skipped and reported with their line number; valid rows
+    are inserted in one transaction.
+    """
+    fmt = format or ("ndjson" if (file.filename or "").lower().endswith((".ndjson", ".jsonl")) else "csv")
+    try:
+        result = await student_service.import_students(
+            iter_import_rows(file.file, fmt),
+            batch_size=settings.BATCH_SIZE,
+            dry_run=dry_run
+        )
+        if not dry_run:
+            await student_service.uow.commit()
+        return result
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing students: {e}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @router.get("/", response_model=List[StudentResponse])
 async def get_students(
     skip: int = 0,
     limit: int = 100,
     grade: Optional[str] = None,
+    cursor: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|full_name|student_code)$"),
+    student_service: StudentService = Depends(get_read_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
-    """Lấy danh sách students với filter"""
+    """Lấy danh sách students với filter.
+    
+    Truyền `cursor` (từ header `X-Next-Cursor` của trang trước) để phân trang
+    keyset; không có header này nghĩa là đã tới trang cuối.
+    """
     try:
-        students = await student_service.get_students(skip=skip, limit=limit, grade=grade)
-        return students
+        students, next_cursor = await student_service.get_students_page(
+            limit=limit, cursor=cursor, skip=skip, grade=grade, sort=sort
+        )
+        return list_response(StudentListAdapter, students, next_cursor)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/export", summary="Stream all students as CSV or NDJSON")
+async def export_students(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    grade: Optional[str] = None,
+    gzip: bool = Query(False),
+    # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
+):
+    """
+    Export students without paging.
+    
+    Rows are read through a server-side cursor and written to the response
+    batch by batch (`EXPORT_BATCH_SIZE`), so memory use does not grow with
+    the number of students. `gzip=true` returns a `.gz` file.
+    """
+    async def batches():
+        # Session thuộc về stream (mở khi bắt đầu gửi, đóng khi gửi xong)
+        async with read_uow() as uow:
+            async for batch in StudentService(uow).stream_students(grade=grade):
+                yield batch
+
+    return export_response(batches(), StudentService.EXPORT_FIELDS, format, "students", compress=gzip)
+
+@router.get("/search", response_model=List[StudentSearchHit], summary="Search students by name or code")
+async def search_students(
+    q: str = Query(..., min_length=2, max_length=100),
+    grade: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    student_service: StudentService = Depends(get_read_student_service),
+    # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
+):
+    """Tìm học sinh theo tên hoặc mã.
+    
+    Không phân biệt hoa thường và dấu ("nguyen van a" khớp "Nguyễn Văn A"),
+    chấp nhận gõ sai nhẹ. Kết quả xếp theo độ khớp (`score`). Cần chạy
+    migration 003 (pg_trgm, unaccent).
+    """
+    try:
+        students = await student_service.search_students(q, grade=grade, skip=skip, limit=limit)
+        return list_response(StudentSearchAdapter, students)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{student_id}", response_model=StudentResponse)
 async def get_student(
     student_id: int,
+    student_service: StudentService = Depends(get_read_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """Lấy thông tin student theo ID"""
@@ -171,6 +280,7 @@ async def get_student(
 @router.get("/code/{student_code}", response_model=StudentResponse)
 async def get_student_by_code(
     student_code: str,
+    student_service: StudentService = Depends(get_read_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """Lấy thông tin student theo mã student"""
@@ -186,6 +296,7 @@ async def get_student_by_code(
 async def update_student(
     student_id: int,
     student_data: StudentUpdate,
+    student_service: StudentService = Depends(get_student_service),
     current_user: dict = Depends(get_current_user)
 ):
     """Cập nhật thông tin student"""
@@ -193,6 +304,7 @@ async def update_student(
         student = await student_service.update_student(student_id, student_data)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
+        await student_service.uow.commit()
         return student
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -200,6 +312,7 @@ async def update_student(
 @router.delete("/{student_id}")
 async def delete_student(
     student_id: int,
+    student_service: StudentService = Depends(get_student_service),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
     """Xóa student"""
@@ -207,6 +320,7 @@ async def delete_student(
         success = await student_service.delete_student(student_id)
         if not success:
             raise HTTPException(status_code=404, detail="Student not found")
+        await student_service.uow.commit()
         return {"message": "Student deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -219,13 +333,18 @@ async def get_student_photo(filename: str):
         raise HTTPException(status_code=404, detail="Photo not found")
     return FileResponse(file_path)
 
-@router.post("/{student_id}/upload-photos")
+@router.post("/{student_id}/upload-photos", dependencies=[Depends(admit("register-face", PRIORITY_ADMIN))])
 async def upload_student_photos(
     student_id: int,
     photos: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
     # current_user: dict = Depends(get_current_user)  # Temporarily disabled for testing
 ):
-    """Upload nhiều ảnh cho student"""
+    """Upload nhiều ảnh cho student.
+
+    Tra cứu học sinh, đăng ký khuôn mặt và cập nhật ảnh chính dùng chung
+    session sync của enroll_faces (một connection mỗi request).
+    """
     try:
         # Validate photos
         if not photos or len(photos) < 1:
@@ -240,9 +359,9 @@ async def upload_student_photos(
                 detail="Maximum 5 photos allowed"
             )
         
-        saved_image_paths = []
+        uploads = []
         
-        # Process each photo
+        # Validate each photo
         for i, photo in enumerate(photos):
             if not photo.filename:
                 raise HTTPException(status_code=400, detail=f"No filename for photo {i+1}")
@@ -254,41 +373,32 @@ async def upload_student_photos(
                     detail=f"Invalid file type for photo {i+1}. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
                 )
             
-            # Generate unique filename
-            file_id = str(uuid.uuid4())
-            filename = f"{file_id}{file_ext}"
-            file_path = os.path.join(UPLOAD_DIR, filename)
-            
-            # Save file
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(photo.file, buffer)
-            
-            saved_image_paths.append(file_path)
+            uploads.append((photo.filename, await photo.read()))
         
-        # Update student photo path (primary photo)
-        student = await student_service.update_student_photo(student_id, saved_image_paths[0])
+        student = await run_in_threadpool(db.get, Student, student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
+        student_code = student.student_code  # enroll_faces commit làm expire object
         
-        # Register faces for ML
-        try:
-            face_request = FaceRegistrationRequest(
-                student_id=student_id,
-                images_count=len(saved_image_paths)
-            )
-            
-            for image_path in saved_image_paths:
-                await face_recognition_service.register_face(face_request, image_path)
-            
-            print(f"ML: Registered {len(saved_image_paths)} new faces for student {student_id}")
-            
-        except Exception as e:
-            print(f"Face registration failed: {e}")
+        # Register faces for ML; near-duplicate photos are skipped before embedding
+        face_service = FaceRecognitionService(db)
+        result = await run_in_threadpool(face_service.enroll_faces, student_id, uploads, UPLOAD_DIR)
+        saved_image_paths = result["image_paths"]
+        logger.info(f"ML: Registered {len(saved_image_paths)} new faces for student {student_id}")
+        
+        # Update student photo path (primary photo)
+        if saved_image_paths:
+            student.photo_path = saved_image_paths[0]
+            await run_in_threadpool(db.commit)
+            await cache.delete(*StudentService._cache_keys(student_id, student_code))
         
         return {
             "message": f"{len(saved_image_paths)} photos uploaded successfully", 
-            "photo_paths": saved_image_paths
+            "photo_paths": saved_image_paths,
+            "skipped_photos": result["skipped"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,197 @@
+import asyncio
+import itertools
+import math
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional
+
+from fastapi import Depends, HTTPException, status
+
+from app.core.config import settings
+from app.core.model_pool import resolve_pool_size
+
+logger = logging.getLogger(__name__)
+
+# Priority classes (số nhỏ hơn = ưu tiên cao hơn)
+PRIORITY_KIOSK = 0  # Nhận diện tại cổng/kiosk
+PRIORITY_ADMIN = 1  # Đăng ký khuôn mặt, thao tác của admin/giáo viên
+PRIORITY_BULK = 2  # Job hàng loạt
+
+class AdmissionRejected(Exception):
+    """Request bị từ chối vì hàng đợi đầy, chờ quá lâu hoặc bị request ưu tiên hơn chiếm chỗ"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Waiter:
+    def __init__(self, endpoint: str, priority: int, seq: int, future: asyncio.Future):
+        self.endpoint = endpoint
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+
+class AdmissionController:
+    """Giới hạn số request ML chạy đồng thời, với hàng đợi có giới hạn và priority.
+
+    - `capacity`: tổng số request ML chạy cùng lúc trong process
+    - `limits`: giới hạn riêng cho từng endpoint (0 = chỉ bị giới hạn bởi capacity)
+    - Khi có slot trống, waiter ưu tiên cao nhất (rồi tới cũ nhất) có endpoint
+      còn dưới giới hạn được chạy trước
+    - Khi hàng đợi đầy, request mới chỉ được vào nếu ưu tiên cao hơn waiter
+      kém nhất, waiter đó bị đẩy ra (shed) thay cho request mới
+    """
+
+    def __init__(self, capacity: int, queue_size: int, limits: Dict[str, int], max_wait: float, retry_after: int):
+        self.capacity = capacity
+        self.queue_size = queue_size
+        self.limits = limits
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self._in_flight: Dict[str, int] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._avg_service_time = 0.0
+
+        # Metrics
+        self._admitted: Dict[str, int] = {}
+        self._rejected: Dict[str, Dict[str, int]] = {}
+
+    def _total_in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+    def _has_slot(self, endpoint: str) -> bool:
+        limit = self.limits.get(endpoint, 0)
+        if limit > 0 and self._in_flight.get(endpoint, 0) >= limit:
+            return False
+        return self._total_in_flight() < self.capacity
+
+    def _grant(self, endpoint: str):
+        self._in_flight[endpoint] = self._in_flight.get(endpoint, 0) + 1
+        self._admitted[endpoint] = self._admitted.get(endpoint, 0) + 1
+
+    def _reject(self, endpoint: str, reason: str) -> AdmissionRejected:
+        counters = self._rejected.setdefault(endpoint, {})
+        counters[reason] = counters.get(reason, 0) + 1
+        # Ước lượng thời gian để hàng đợi hiện tại được xử lý xong
+        estimate = len(self._waiters) * self._avg_service_time / max(self.capacity, 1)
+        return AdmissionRejected(reason, max(self.retry_after, math.ceil(estimate)))
+
+    async def acquire(self, endpoint: str, priority: int) -> float:
+        """Chờ tới khi được chạy; trả về thời điểm bắt đầu để truyền lại cho release()"""
+        if self._has_slot(endpoint):
+            self._grant(endpoint)
+            return time.monotonic()
+
+        if len(self._waiters) >= self.queue_size:
+            worst = max(self._waiters, key=lambda w: (w.priority, -w.seq), default=None)
+            if worst is None or worst.priority <= priority:
+                raise self._reject(endpoint, "queue_full")
+            self._waiters.remove(worst)
+            worst.future.set_exception(self._reject(worst.endpoint, "preempted"))
+
+        waiter = _Waiter(endpoint, priority, next(self._seq), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                raise self._reject(endpoint, "timeout")
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.future.done() and not waiter.future.exception():
+                self.release(endpoint)
+            raise
+        # Future đã được grant (hoặc bị preempt -> raise AdmissionRejected)
+        waiter.future.result()
+        return time.monotonic()
+
+    def release(self, endpoint: str, started: Optional[float] = None):
+        """Trả slot và chuyển cho waiter phù hợp tiếp theo"""
+        self._in_flight[endpoint] = max(0, self._in_flight.get(endpoint, 0) - 1)
+        if started is not None:
+            elapsed = time.monotonic() - started
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * elapsed if self._avg_service_time else elapsed
+
+        for waiter in sorted(self._waiters, key=lambda w: (w.priority, w.seq)):
+            if not self._has_slot(waiter.endpoint):
+                continue
+            self._waiters.remove(waiter)
+            self._grant(waiter.endpoint)
+            waiter.future.set_result(None)
+            if self._total_in_flight() >= self.capacity:
+                break
+
+    def stats(self) -> dict:
+        """Queue depth, số request đang chạy và số lần từ chối theo endpoint"""
+        queued: Dict[str, int] = {}
+        for waiter in self._waiters:
+            queued[waiter.endpoint] = queued.get(waiter.endpoint, 0) + 1
+        endpoints = set(self.limits) | set(self._in_flight) | set(self._admitted) | set(self._rejected)
+        return {
+            "capacity": self.capacity,
+            "queue_size": self.queue_size,
+            "queue_depth": len(self._waiters),
+            "in_flight": self._total_in_flight(),
+            "avg_service_time_ms": round(self._avg_service_time * 1000, 3),
+            "endpoints": {
+                endpoint: {
+                    "limit": self.limits.get(endpoint, 0),
+                    "in_flight": self._in_flight.get(endpoint, 0),
+                    "queued": queued.get(endpoint, 0),
+                    "admitted": self._admitted.get(endpoint, 0),
+                    "rejected": self._rejected.get(endpoint, {}),
+                }
+                for endpoint in sorted(endpoints)
+            },
+        }
+
+admission_controller = AdmissionController(
+    capacity=resolve_pool_size(settings.ML_ADMISSION_CAPACITY),
+    queue_size=settings.ML_ADMISSION_QUEUE_SIZE,
+    limits=settings.ML_ENDPOINT_CONCURRENCY,
+    max_wait=settings.ML_ADMISSION_MAX_WAIT_SECONDS,
+    retry_after=settings.ML_ADMISSION_RETRY_AFTER_SECONDS
+)
+
+@asynccontextmanager
+async def _admission(endpoint: str, priority: int):
+    """Giữ một slot ML; trả 429 + Retry-After nếu bị từ chối"""
+    try:
+        started = await admission_controller.acquire(endpoint, priority)
+    except AdmissionRejected as e:
+        logger.warning(f"Admission rejected for {endpoint}: {e.reason}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Server busy ({e.reason}), please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    try:
+        yield
+    finally:
+        admission_controller.release(endpoint, started)
+
+def admit(endpoint: str, priority: int, auth: Optional[Callable] = None):
+    """Dependency giữ một slot ML trong suốt request.
+
+    Admission không quyết định ai được gọi endpoint: handler vẫn khai báo
+    `Depends(verify_token)` của mình. Endpoint có xác thực truyền cùng
+    dependency đó vào `auth` để nó được resolve trước khi xin slot, nên
+    request chưa xác thực bị từ chối mà không chiếm chỗ hay đẩy waiter khác
+    ra khỏi hàng đợi (FastAPI cache dependency trong một request, token chỉ
+    được kiểm tra một lần).
+    """
+    if auth is None:
+        async def dependency():
+            async with _admission(endpoint, priority):
+                yield
+        return dependency
+
+    async def authenticated_dependency(current_user: dict = Depends(auth)):
+        async with _admission(endpoint, priority):
+            yield
+    return authenticated_dependency
@@ -0,0 +1,251 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # redis chưa được cài: dùng cache trong process
+    aioredis = None
+    RedisError = OSError
+
+class CacheStats:
+    """Đếm hit/miss/invalidation theo namespace"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def incr(self, namespace: str, name: str, amount: int = 1):
+        counters = self._counters.setdefault(
+            namespace, {"hits": 0, "misses": 0, "sets": 0, "invalidations": 0, "errors": 0, "coalesced": 0}
+        )
+        counters[name] += amount
+
+    def snapshot(self) -> dict:
+        result = {}
+        for namespace, counters in sorted(self._counters.items()):
+            lookups = counters["hits"] + counters["misses"]
+            result[namespace] = dict(counters, hit_ratio=round(counters["hits"] / lookups, 4) if lookups else 0.0)
+        return result
+
+class MemoryCache:
+    """Cache key-value trong process với TTL và giới hạn số key (LRU)"""
+
+    backend = "memory"
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def close(self):
+        self._data.clear()
+
+class RedisCache:
+    """Cache dùng Redis (dùng chung giữa các worker)"""
+
+    backend = "redis"
+
+    def __init__(self, url: str):
+        self._client = aioredis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self._client.set(key, value, ex=ttl)
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._client.delete(*keys)
+
+    async def close(self):
+        await self._client.aclose()
+
+class Cache:
+    """Read-through cache có TTL; lỗi Redis được coi như miss để không chặn request.
+
+    Sau một lỗi, cache bị bỏ qua trong `retry_after` giây để request không
+    phải chờ timeout của Redis mỗi lần.
+    """
+
+    def __init__(self, store, ttl: int, retry_after: float = 30.0):
+        self.store = store
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.stats = CacheStats()
+        self._disabled_until = 0.0
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._disabled_until
+
+    def _failed(self, namespace: str, action: str, error: Exception):
+        logger.warning(f"Cache {action} failed, bypassing cache for {self.retry_after}s: {error}")
+        self.stats.incr(namespace, "errors")
+        self._disabled_until = time.monotonic() + self.retry_after
+
+    @staticmethod
+    def _namespace(key: str) -> str:
+        return key.split(":", 2)[0] if ":" in key else key
+
+    async def get(self, key: str) -> Optional[bytes]:
+        namespace = self._namespace(key)
+        value = None
+        if self._available():
+            try:
+                value = await self.store.get(key)
+            except RedisError as e:
+                self._failed(namespace, "get", e)
+        self.stats.incr(namespace, "hits" if value is not None else "misses")
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        if not self._available():
+            return
+        try:
+            await self.store.set(key, value, ttl or self.ttl)
+            self.stats.incr(self._namespace(key), "sets")
+        except RedisError as e:
+            self._failed(self._namespace(key), "set", e)
+
+    async def delete(self, *keys: str):
+        if not keys:
+            return
+        # Invalidation luôn được thử, kể cả khi đang bỏ qua cache
+        try:
+            await self.store.delete(*keys)
+            self.stats.incr(self._namespace(keys[0]), "invalidations", len(keys))
+        except RedisError as e:
+            self._failed(self._namespace(keys[0]), "delete", e)
+
+    async def close(self):
+        await self.store.close()
+
+    def snapshot(self) -> dict:
+        return {"backend": self.store.backend, "ttl_seconds": self.ttl, "namespaces": self.stats.snapshot()}
+
+class LocalCache:
+    """Cache object Python trong process, có TTL và single-flight.
+
+    Khi nhiều request cùng miss một key, chỉ request đầu tiên chạy loader;
+    các request còn lại chờ kết quả đó. invalidate() xoá toàn bộ cache và
+    bỏ kết quả của các loader đang chạy dở (có thể đã đọc dữ liệu cũ).
+    Giá trị được dùng chung giữa các request nên không được sửa.
+    """
+
+    def __init__(self, name: str, ttl: float, max_entries: int = 1000):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._generation = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        while True:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.monotonic():
+                self._data.move_to_end(key)
+                self.stats.incr(self.name, "hits")
+                return item[0]
+
+            future = self._inflight.get(key)
+            if future is None:
+                break
+            self.stats.incr(self.name, "coalesced")
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    continue  # Request đang load bị huỷ: thử lại
+                raise
+
+        self.stats.incr(self.name, "misses")
+        future = asyncio.get_running_loop().create_future()
+        # Tránh cảnh báo "exception was never retrieved" khi không có ai chờ
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await loader()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        if generation == self._generation:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            self.stats.incr(self.name, "sets")
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        future.set_result(value)
+        return value
+
+    async def invalidate(self):
+        self.stats.incr(self.name, "invalidations", len(self._data))
+        self._data.clear()
+        self._inflight.clear()
+        self._generation += 1
+
+    async def invalidate_matching(self, predicate: Callable[[Hashable], bool]):
+        """Chỉ xoá các key thoả `predicate`; loader đang chạy dở của mọi key vẫn bị bỏ kết quả"""
+        keys = [key for key in self._data if predicate(key)]
+        for key in keys:
+            del self._data[key]
+        self.stats.incr(self.name, "invalidations", len(keys))
+        for key in [key for key in self._inflight if predicate(key)]:
+            del self._inflight[key]
+        self._generation += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "backend": "local",
+            "ttl_seconds": self.ttl,
+            "entries": len(self._data),
+            "namespaces": self.stats.snapshot(),
+        }
+
+def create_cache() -> Cache:
+    """Redis nếu CACHE_BACKEND=redis và thư viện có sẵn, ngược lại cache trong process"""
+    if settings.CACHE_BACKEND == "redis" and aioredis is not None:
+        store = RedisCache(settings.REDIS_URL)
+    else:
+        if settings.CACHE_BACKEND == "redis":
+            logger.warning("redis package not installed, using in-process cache")
+        store = MemoryCache(settings.CACHE_MAX_ENTRIES)
+    return Cache(store, ttl=settings.CACHE_TTL_SECONDS)
+
+cache = create_cache()
@@ -1,30 +1,68 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey, JSON, Date
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, Boolean, Text, Float, ForeignKey, JSON, Date, Index, LargeBinary, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.sql import func
 from sqlalchemy.dialects.postgresql import ARRAY
-from typing import List
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Callable, Awaitable
 import os
 
 from app.core.config import settings
+from app.core.db_metrics import pool_monitor, TimedQueuePool, TimedAsyncAdaptedQueuePool
 
-# Tạo engine
+_pool_options = dict(
+    pool_timeout=settings.DATABASE_POOL_TIMEOUT,
+    pool_pre_ping=settings.DATABASE_POOL_PRE_PING,
+    pool_recycle=settings.DATABASE_POOL_RECYCLE,
+)
+
+# Tạo engine (sync, psycopg2) - dùng cho scripts và code chạy trong worker thread.
+# Pool riêng, nhỏ hơn: mỗi worker mở tối đa (DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW)
+# + (DATABASE_SYNC_POOL_SIZE + DATABASE_SYNC_MAX_OVERFLOW) connection
 engine = create_engine(
     settings.DATABASE_URL,
-    pool_size=settings.DATABASE_POOL_SIZE,
-    max_overflow=settings.DATABASE_MAX_OVERFLOW,
-    echo=settings.DEBUG
+    poolclass=TimedQueuePool,
+    echo=settings.DEBUG,
+    pool_size=settings.DATABASE_SYNC_POOL_SIZE,
+    max_overflow=settings.DATABASE_SYNC_MAX_OVERFLOW,
+    **_pool_options
 )
+pool_monitor.instrument(engine, "sync")
 
 # Tạo session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def _async_database_url(url: str) -> str:
+    """Chuyển DATABASE_URL sang driver asyncpg"""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+# Async engine (asyncpg) - dùng cho các service trong request handlers
+async_engine = create_async_engine(
+    _async_database_url(settings.DATABASE_URL),
+    poolclass=TimedAsyncAdaptedQueuePool,
+    echo=settings.DEBUG,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    **_pool_options
+)
+pool_monitor.instrument(async_engine.sync_engine, "async")
+
+# expire_on_commit=False: tránh lazy load (I/O ngầm) khi đọc attribute sau commit
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 # Base class cho models
 Base = declarative_base()
 
 class User(Base):
     """Model cho user (admin, giáo viên)"""
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_full_name_id", "full_name", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     username = Column(String(50), unique=True, index=True, nullable=False)
@@ -49,6 +87,14 @@ class Grade(Base):
 class Student(Base):
     """Model cho học sinh"""
     __tablename__ = "students"
+    __table_args__ = (
+        # Keyset pagination: (sort key, id), có và không có filter grade
+        Index("ix_students_full_name_id", "full_name", "id"),
+        Index("ix_students_grade_id", "grade", "id"),
+        Index("ix_students_grade_full_name_id", "grade", "full_name", "id"),
+        # Học sinh đang học theo grade (danh sách theo lớp, đếm sĩ số)
+        Index("ix_students_grade_active", "grade", "id", postgresql_where=text("is_active")),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     student_code = Column(String(20), unique=True, nullable=False, index=True)  # Mã student tự động
@@ -73,6 +119,40 @@ class Student(Base):
     face_embeddings = relationship("FaceEmbedding", back_populates="student")
     attendance_records = relationship("AttendanceRecord", back_populates="student")
 
+class StudentCodeCounter(Base):
+    """Số thứ tự student_code đã cấp gần nhất của mỗi grade"""
+    __tablename__ = "student_code_counters"
+    
+    grade = Column(String, primary_key=True)
+    last_number = Column(Integer, nullable=False, default=0)
+
+class AttendanceDailyStats(Base):
+    """Số bản ghi điểm danh theo trạng thái của mỗi ngày, mỗi grade (cập nhật khi ghi attendance_records)"""
+    __tablename__ = "attendance_daily_stats"
+    
+    date = Column(Date, primary_key=True)
+    grade = Column(String, primary_key=True)
+    present = Column(Integer, nullable=False, default=0, server_default="0")
+    late = Column(Integer, nullable=False, default=0, server_default="0")
+    absent = Column(Integer, nullable=False, default=0, server_default="0")
+    excused = Column(Integer, nullable=False, default=0, server_default="0")
+    early_leave = Column(Integer, nullable=False, default=0, server_default="0")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class AttendanceTermBitmap(Base):
+    """Bitmap điểm danh của một học sinh trong một học kỳ.
+
+    Bit i (thứ tự bit little-endian trong từng byte) ứng với ngày term_start + i:
+    `present` = có đi học (present/late/early_leave), `late` = đi muộn.
+    """
+    __tablename__ = "attendance_term_bitmaps"
+    
+    student_id = Column(Integer, ForeignKey("students.id", ondelete="CASCADE"), primary_key=True)
+    term_start = Column(Date, primary_key=True)
+    present = Column(LargeBinary, nullable=False)
+    late = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class FaceEmbedding(Base):
     """Model cho face embedding vectors"""
     __tablename__ = "face_embeddings"
@@ -81,6 +161,7 @@ class FaceEmbedding(Base):
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
     embedding_vector = Column(ARRAY(Float), nullable=False)  # PostgreSQL array
     image_path = Column(String(255), nullable=True)
+    image_hash = Column(BigInteger, nullable=True)  # dHash 64 bit của ảnh (signed), dùng cho dedupe
     confidence_score = Column(Float, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -90,12 +171,26 @@ class FaceEmbedding(Base):
 class AttendanceRecord(Base):
     """Model cho bản ghi điểm danh"""
     __tablename__ = "attendance_records"
+    __table_args__ = (
+        # Keyset pagination theo (date, id) giảm dần, có và không có filter student
+        Index("ix_attendance_records_date_id", "date", "id"),
+        Index("ix_attendance_records_student_id_date_id", "student_id", "date", "id"),
+        # Một dòng mỗi học sinh mỗi ngày (date lưu nửa đêm); khoá của upsert check-in/out
+        Index("uq_attendance_records_student_id_date", "student_id", "date", unique=True),
+        # Dữ liệu của một thiết bị từ một ngày (sync download)
+        Index("ix_attendance_records_device_id_date", "device_id", "date", postgresql_where=text("device_id IS NOT NULL")),
+        # Hàng đợi bản ghi chưa đồng bộ (chỉ chứa dòng pending nên rất nhỏ)
+        Index("ix_attendance_records_sync_pending", "id", postgresql_where=text("sync_status = 'pending'")),
+        # Partition theo tháng (app/services/attendance_partitions.py tạo partition)
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
     
-    id = Column(Integer, primary_key=True, index=True)
+    # Primary key phải chứa cột partition
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
     check_in_time = Column(DateTime(timezone=True), nullable=True)
     check_out_time = Column(DateTime(timezone=True), nullable=True)
-    date = Column(DateTime, nullable=False)
+    date = Column(DateTime, primary_key=True, nullable=False)
     status = Column(String(20), default="present")  # present, absent, late, early_leave
     confidence_score = Column(Float, nullable=True)
     image_path = Column(String(255), nullable=True)
@@ -142,3 +237,57 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Dependency để lấy async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+class UnitOfWork:
+    """Session dùng chung cho cả request.
+
+    Các service chỉ flush; handler gọi commit() một lần khi mọi bước đã xong,
+    nên một request nhiều bước chạy trong một transaction và một lần
+    checkout connection. Callback after_commit chạy sau khi commit thành công.
+    """
+    
+    def __init__(self, session: AsyncSession, read_only: bool = False):
+        self.session = session
+        self.read_only = read_only
+        self._after_commit: List[Callable[[], Awaitable[None]]] = []
+    
+    def after_commit(self, callback: Callable[[], Awaitable[None]]):
+        """Đăng ký callback chạy sau khi transaction được commit"""
+        self._after_commit.append(callback)
+    
+    async def commit(self):
+        if self.read_only:
+            raise RuntimeError("Cannot commit a read-only unit of work")
+        await self.session.commit()
+        callbacks, self._after_commit = self._after_commit, []
+        for callback in callbacks:
+            await callback()
+    
+    async def rollback(self):
+        self._after_commit = []
+        await self.session.rollback()
+
+# Dependency: unit of work cho request có ghi dữ liệu
+async def get_uow():
+    async with AsyncSessionLocal() as session:
+        yield UnitOfWork(session)
+
+# Engine dùng chung pool, mở transaction READ ONLY
+_read_only_engine = async_engine.execution_options(postgresql_readonly=True)
+
+@asynccontextmanager
+async def read_uow() -> AsyncIterator[UnitOfWork]:
+    """Unit of work chỉ đọc dùng ngoài dependency (vd. trong generator của StreamingResponse)"""
+    async with AsyncSessionLocal(bind=_read_only_engine) as session:
+        yield UnitOfWork(session, read_only=True)
+
+# Dependency: unit of work chỉ đọc (không bao giờ commit). Connection chỉ được
+# checkout khi có query, nên request được phục vụ hoàn toàn từ cache không tốn connection
+async def get_read_uow():
+    async with read_uow() as uow:
+        yield uow
@@ -0,0 +1,219 @@
+import threading
+import time
+import logging
+from contextvars import ContextVar
+from typing import Dict, List, MutableMapping, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class RequestContext:
+    """Thông tin request hiện tại cho các event của pool"""
+
+    __slots__ = ("method", "scope", "checkouts")
+
+    def __init__(self, method: str, scope: MutableMapping):
+        self.method = method
+        # Router gán scope["route"] sau khi match, nên đọc lazy khi cần
+        self.scope = scope
+        self.checkouts = 0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return f"{self.method} {getattr(route, 'path', 'unmatched')}"
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar("db_request_context", default=None)
+
+def start_request_tracking(method: str, scope: MutableMapping) -> RequestContext:
+    """Bắt đầu theo dõi việc dùng connection DB của request hiện tại"""
+    context = RequestContext(method, scope)
+    _request_context.set(context)
+    return context
+
+def current_route() -> str:
+    """Route của request hiện tại, hoặc 'background' nếu ngoài request"""
+    context = _request_context.get()
+    return context.route if context is not None else "background"
+
+class CheckoutStats:
+    """Thống kê số lần checkout connection từ pool theo route"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, int]] = {}
+
+    def record(self, route: str, checkouts: int):
+        with self._lock:
+            stats = self._routes.setdefault(route, {"requests": 0, "checkouts": 0, "max_checkouts": 0})
+            stats["requests"] += 1
+            stats["checkouts"] += checkouts
+            stats["max_checkouts"] = max(stats["max_checkouts"], checkouts)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                route: dict(stats, avg_checkouts=round(stats["checkouts"] / stats["requests"], 3))
+                for route, stats in sorted(self._routes.items())
+            }
+
+checkout_stats = CheckoutStats()
+
+class CheckoutTiming:
+    """Thời gian chờ lấy connection từ pool (kể cả pre-ping và tạo connection mới)"""
+
+    # Biên (ms) của histogram thời gian chờ
+    BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.timeouts = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.BUCKETS_MS) + 1)
+
+    def record(self, elapsed: float, timed_out: bool = False):
+        elapsed_ms = elapsed * 1000
+        index = next((i for i, bound in enumerate(self.BUCKETS_MS) if elapsed_ms <= bound), len(self.BUCKETS_MS))
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.count += 1
+                self.total += elapsed
+                self.max = max(self.max, elapsed)
+            self.buckets[index] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={bound}ms" for bound in self.BUCKETS_MS] + [f">{self.BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.count,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                "max_wait_ms": round(self.max * 1000, 3),
+                "histogram": dict(zip(labels, self.buckets)),
+            }
+
+class _TimedCheckoutMixin:
+    """Đo thời gian Pool.connect() (chờ slot trống, pre-ping, mở connection)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_timing = CheckoutTiming()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkout_timing = self.checkout_timing
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except sa_exc.TimeoutError:
+            self.checkout_timing.record(time.perf_counter() - started, timed_out=True)
+            logger.warning(f"DB pool exhausted (route: {current_route()})")
+            raise
+        self.checkout_timing.record(time.perf_counter() - started)
+        return connection
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    """QueuePool có đo thời gian checkout (engine sync)"""
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool có đo thời gian checkout (engine async)"""
+
+class PoolMonitor:
+    """Theo dõi pool của các engine: in-use/overflow, thời gian chờ checkout
+    và các connection bị giữ lâu cùng route đang giữ chúng.
+    """
+
+    def __init__(self, long_held_seconds: float):
+        self.long_held_seconds = long_held_seconds
+        self._lock = threading.Lock()
+        self._engines: Dict[str, Engine] = {}
+        # id(connection_record) -> (engine, route, thời điểm checkout)
+        self._held: Dict[int, Tuple[str, str, float]] = {}
+        # route -> số lần giữ connection quá ngưỡng, thời gian giữ lâu nhất
+        self._long_held: Dict[str, Dict[str, float]] = {}
+
+    def instrument(self, engine: Engine, name: str):
+        """Gắn event hooks vào pool của engine"""
+        self._engines[name] = engine
+
+        @event.listens_for(engine, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            context = _request_context.get()
+            if context is not None:
+                context.checkouts += 1
+            route = context.route if context is not None else "background"
+            with self._lock:
+                self._held[id(connection_record)] = (name, route, time.monotonic())
+
+        @event.listens_for(engine, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            with self._lock:
+                held = self._held.pop(id(connection_record), None)
+            if held is None:
+                return
+            _, route, since = held
+            duration = time.monotonic() - since
+            if duration >= self.long_held_seconds:
+                self._record_long_held(route, duration)
+
+    def _record_long_held(self, route: str, duration: float):
+        logger.warning(f"DB connection held for {duration:.2f}s by {route}")
+        with self._lock:
+            stats = self._long_held.setdefault(route, {"count": 0, "max_held_ms": 0.0})
+            stats["count"] += 1
+            stats["max_held_ms"] = max(stats["max_held_ms"], round(duration * 1000, 3))
+
+    def held_connections(self, min_seconds: float = 0.0) -> List[dict]:
+        """Các connection đang được checkout, giữ lâu nhất trước"""
+        now = time.monotonic()
+        with self._lock:
+            held = list(self._held.values())
+        return [
+            {"engine": name, "route": route, "held_ms": round((now - since) * 1000, 3)}
+            for name, route, since in sorted(held, key=lambda item: item[2])
+            if now - since >= min_seconds
+        ]
+
+    def pool_status(self, name: str) -> dict:
+        pool = self._engines[name].pool
+        status = {
+            "class": type(pool).__name__,
+            "size": pool.size(),
+            "max_overflow": getattr(pool, "_max_overflow", None),
+            "timeout_seconds": pool.timeout(),
+            "recycle_seconds": getattr(pool, "_recycle", None),
+            "pre_ping": getattr(pool, "_pre_ping", None),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            # overflow() âm khi pool chưa tạo đủ pool_size connection
+            "overflow": max(pool.overflow(), 0),
+        }
+        timing = getattr(pool, "checkout_timing", None)
+        if timing is not None:
+            status["checkout"] = timing.snapshot()
+        return status
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            long_held = {route: dict(stats) for route, stats in sorted(self._long_held.items())}
+        return {
+            "long_held_threshold_seconds": self.long_held_seconds,
+            "pools": {name: self.pool_status(name) for name in self._engines},
+            "long_held_by_route": long_held,
+            "currently_long_held": self.held_connections(self.long_held_seconds),
+        }
+
+pool_monitor = PoolMonitor(long_held_seconds=settings.DATABASE_LONG_HELD_SECONDS)
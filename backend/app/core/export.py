@@ -0,0 +1,84 @@
+import csv
+import io
+import logging
+import zlib
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, List, Sequence
+
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+
+logger = logging.getLogger(__name__)
+
+# Một batch là danh sách dict (tên cột -> giá trị), lấy từ một lần fetch của cursor
+Batch = List[Dict[str, Any]]
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+async def iter_csv(fieldnames: Sequence[str], batches: AsyncIterator[Batch]) -> AsyncIterator[bytes]:
+    """Encode từng batch thành CSV (có header); mỗi batch là một chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fieldnames)
+    async for batch in batches:
+        writer.writerows([_csv_value(row[name]) for name in fieldnames] for row in batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # export rỗng: chỉ có header
+        yield buffer.getvalue().encode("utf-8")
+
+async def iter_ndjson(batches: AsyncIterator[Batch]) -> AsyncIterator[bytes]:
+    """Encode mỗi dòng thành một object JSON trên một dòng"""
+    async for batch in batches:
+        if batch:
+            yield b"".join(to_json(row) + b"\n" for row in batch)
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Nén stream theo định dạng gzip mà không giữ toàn bộ dữ liệu trong bộ nhớ"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def _log_errors(chunks: AsyncIterator[bytes], filename: str) -> AsyncIterator[bytes]:
+    # Header đã gửi đi nên không thể trả mã lỗi; ghi log và cắt stream
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        logger.error(f"Export {filename} aborted: {e}")
+        raise
+
+def export_response(
+    batches: AsyncIterator[Batch],
+    fieldnames: Sequence[str],
+    fmt: str,
+    filename: str,
+    compress: bool = False
+) -> StreamingResponse:
+    """StreamingResponse tải file CSV/NDJSON (tuỳ chọn .gz) từ các batch dòng"""
+    media_type, extension = EXPORT_FORMATS[fmt]
+    chunks = iter_csv(fieldnames, batches) if fmt == "csv" else iter_ndjson(batches)
+    filename = f"{filename}.{extension}"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        _log_errors(chunks, filename),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,101 @@
+import os
+import queue
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Callable, Generic, Iterator, Optional, TypeVar
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+def resolve_pool_size(configured: int) -> int:
+    """Kích thước pool: giá trị cấu hình, hoặc số CPU nếu cấu hình <= 0"""
+    return configured if configured > 0 else (os.cpu_count() or 1)
+
+class ModelPool(Generic[T]):
+    """Pool giới hạn các instance model (không thread-safe) cho xử lý song song.
+
+    Mỗi task checkout một instance riêng; instance được tạo lazy tới tối đa
+    `size`. Số thread nội bộ của OpenCV được chia theo kích thước pool để
+    tổng số thread không vượt quá số CPU.
+    """
+
+    def __init__(self, factory: Callable[[], T], size: int, timeout: Optional[float] = None):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[T]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+        cv2.setNumThreads(max(1, (os.cpu_count() or 1) // size))
+
+    @contextmanager
+    def checkout(self) -> Iterator[T]:
+        """Mượn một instance trong suốt khối `with`"""
+        started = time.perf_counter()
+        instance = self._acquire()
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def _acquire(self) -> T:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+            else:
+                self._waits += 1
+        if create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"No model instance available after {self.timeout}s")
+
+    def stats(self) -> dict:
+        """Thống kê sử dụng pool"""
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._created - idle,
+                "idle": idle,
+                "checkouts": self._checkouts,
+                "waited_checkouts": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._total_wait / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3),
+                "opencv_threads": cv2.getNumThreads(),
+            }
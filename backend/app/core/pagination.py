@@ -0,0 +1,80 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+class InvalidCursor(ValueError):
+    """Cursor không giải mã được hoặc không khớp với sort hiện tại"""
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def _from_json(value: Any, column: InstrumentedAttribute) -> Any:
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    """Mã hoá key (sort value, id) của dòng cuối trang thành token opaque"""
+    payload = json.dumps({"s": sort, "k": [_to_json(v) for v in values]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str, columns: Sequence[InstrumentedAttribute]) -> List[Any]:
+    """Giải mã cursor thành các giá trị key, đúng kiểu của từng cột"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload["k"]
+        if payload["s"] != sort or len(values) != len(columns):
+            raise InvalidCursor("Cursor does not match the requested sort order")
+        return [_from_json(value, column) for value, column in zip(values, columns)]
+    except InvalidCursor:
+        raise
+    except Exception:
+        raise InvalidCursor("Invalid cursor")
+
+def paginate(
+    query: Select,
+    sort: str,
+    columns: Sequence[InstrumentedAttribute],
+    limit: int,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    descending: bool = False
+) -> Select:
+    """Sắp xếp theo `columns` (sort key rồi id) và lấy trang kế tiếp.
+
+    Có cursor thì dùng điều kiện keyset `(sort key, id) > cursor` nên trang sâu
+    tốn như trang đầu (dùng index trên các cột này); không có cursor thì dùng
+    offset như cũ. Lấy dư 1 dòng để biết còn trang sau hay không.
+    """
+    if cursor and skip:
+        raise InvalidCursor("Use either cursor or skip, not both")
+
+    query = query.order_by(*[column.desc() if descending else column for column in columns])
+    if cursor:
+        values = decode_cursor(cursor, sort, columns)
+        key = tuple_(*columns) if len(columns) > 1 else columns[0]
+        last = tuple_(*values) if len(columns) > 1 else values[0]
+        query = query.where(key < last if descending else key > last)
+    elif skip:
+        query = query.offset(skip)
+    return query.limit(limit + 1)
+
+def split_page(rows: Sequence[Any], sort: str, fields: Sequence[str], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """Cắt dòng dư và tạo next_cursor từ dòng cuối (None nếu là trang cuối)"""
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, [getattr(rows[-1], field) for field in fields])
@@ -0,0 +1,13 @@
+from typing import Any, Optional, Sequence
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+def list_response(adapter: TypeAdapter, items: Sequence[Any], next_cursor: Optional[str] = None) -> Response:
+    """Trả danh sách đã encode JSON bằng pydantic-core.
+
+    Bỏ qua bước validate lại + jsonable_encoder của FastAPI cho response_model;
+    `response_model` trên route vẫn được giữ để sinh OpenAPI schema.
+    """
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return Response(content=adapter.dump_json(items), media_type="application/json", headers=headers)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, TypeAdapter
+from typing import List, Optional
 from datetime import datetime, date
 from enum import Enum
 
@@ -12,6 +12,7 @@ class AttendanceStatus(str, Enum):
     ABSENT = "absent"
     LATE = "late"
     EXCUSED = "excused"
+    EARLY_LEAVE = "early_leave"
 
 class AttendanceBase(BaseModel):
     student_id: int
@@ -36,14 +37,83 @@ class AttendanceUpdate(BaseModel):
 class AttendanceResponse(AttendanceBase):
     id: int
     created_at: datetime
-    updated_at: datetime
+    updated_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+# Serializer dựng sẵn cho response danh sách
+AttendanceListAdapter = TypeAdapter(List[AttendanceResponse])
+
 class AttendanceStats(BaseModel):
     total_students: int
     present_today: int
     absent_today: int
     late_today: int
     attendance_rate: float
+
+class AttendanceDay(BaseModel):
+    date: date
+    status: AttendanceStatus  # present | late | absent
+
+class StudentAttendanceHistory(BaseModel):
+    student_id: int
+    term_start: date
+    term_end: date
+    school_days: int
+    present_days: int
+    late_days: int
+    absent_days: int
+    attendance_rate: float
+    current_streak: int  # Số ngày học liên tiếp có đi học tính tới ngày gần nhất
+    longest_streak: int
+    days: List[AttendanceDay]
+
+class StudentTermRate(BaseModel):
+    student_id: int
+    present_days: int
+    late_days: int
+    absent_days: int
+    attendance_rate: float
+    current_streak: int
+
+class TermAttendanceRates(BaseModel):
+    grade: str
+    term_start: date
+    term_end: date
+    school_days: int
+    average_rate: float
+    students: List[StudentTermRate]
+
+class GradeDayReport(BaseModel):
+    grade: str
+    # Mỗi list có một phần tử cho mỗi ngày trong AttendanceReport.days
+    present: List[int]
+    late: List[int]
+    absent: List[int]
+    excused: List[int]
+    early_leave: List[int]
+    attendance_rate: List[Optional[float]]  # None khi ngày đó không có dữ liệu
+    overall_rate: Optional[float] = None
+
+class StudentReportRow(BaseModel):
+    student_id: int
+    student_code: Optional[str] = None
+    full_name: Optional[str] = None
+    grade: str
+    days: int
+    present: int
+    late: int
+    absent: int
+    excused: int
+    early_leave: int
+    attendance_rate: float
+    rank: int  # Thứ hạng theo tỷ lệ chuyên cần trong grade (bằng nhau cùng hạng)
+
+class AttendanceReport(BaseModel):
+    date_from: date
+    date_to: date
+    grade: Optional[str] = None
+    days: List[date]
+    grades: List[GradeDayReport]
+    students: List[StudentReportRow]
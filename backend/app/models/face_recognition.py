@@ -1,6 +1,6 @@
 from pydantic import BaseModel, validator
-from typing import List, Optional
-from datetime import datetime
+from typing import List, Optional, Dict
+from datetime import date, datetime
 
 class FaceRegistrationRequest(BaseModel):
     """Request model cho đăng ký khuôn mặt"""
@@ -20,12 +20,20 @@ class FaceRegistrationResponse(BaseModel):
     embeddings_count: int
     confidence_scores: List[float]
     message: str
+    skipped_images: Dict[str, str] = {}  # tên ảnh -> lý do bị bỏ qua (trùng lặp, không có mặt...)
 
 class FaceRecognitionRequest(BaseModel):
     """Request model cho nhận diện khuôn mặt"""
     location: Optional[str] = None
     device_id: Optional[str] = None
 
+class RecognitionCheckIn(BaseModel):
+    """Kết quả điểm danh tự động kèm theo một lần nhận diện"""
+    status: str  # "recorded" | "duplicate" | "below_threshold" | "unregistered_device" | "not_recognized"
+    threshold: float
+    attendance_date: Optional[date] = None
+    recorded_at: Optional[datetime] = None
+
 class FaceRecognitionResponse(BaseModel):
     """Response model cho nhận diện khuôn mặt"""
     student_id: Optional[int] = None
@@ -35,6 +43,7 @@ class FaceRecognitionResponse(BaseModel):
     location: Optional[str] = None
     device_id: Optional[str] = None
     status: str  # "recognized" hoặc "unknown"
+    attendance: Optional[RecognitionCheckIn] = None  # Chỉ có khi gửi check_in=true
 
 class FaceEmbeddingResponse(BaseModel):
     """Response model cho face embedding"""
@@ -55,6 +64,29 @@ class FaceComparisonResponse(BaseModel):
     is_same_person: bool
     threshold: float
 
+class FaceSimilarityMatrixResponse(BaseModel):
+    """Response model cho ma trận độ tương đồng 1:N / N:M"""
+    rows: List[str]  # "upload:<filename>" hoặc "student:<id>"
+    columns: List[str]
+    matrix: List[List[float]]
+    threshold: float
+    skipped: Dict[str, str] = {}  # label -> lý do bị loại
+
+class GalleryDuplicate(BaseModel):
+    """Một embedding bị coi là trùng lặp trong gallery"""
+    embedding_id: int
+    student_id: int
+    duplicate_of: int
+    reason: str
+    similarity: float
+
+class GalleryDedupeReport(BaseModel):
+    """Báo cáo dọn dẹp embedding trùng lặp trong gallery"""
+    students_scanned: int
+    embeddings_scanned: int
+    duplicates: List[GalleryDuplicate]
+    removed: int
+
 class BulkRecognitionRequest(BaseModel):
     """Request model cho nhận diện hàng loạt"""
     images: List[str]  # List of image paths
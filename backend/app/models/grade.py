@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from typing import Optional, List
 from datetime import datetime
 
@@ -31,3 +31,6 @@ class GradeListResponse(BaseModel):
     total: int
     skip: int
     limit: int
+
+# Serializer dựng sẵn cho response danh sách
+GradeListAdapter = TypeAdapter(List[GradeResponse])
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import Optional
+from pydantic import BaseModel, Field, EmailStr, TypeAdapter
+from typing import Dict, List, Optional
 from datetime import date, datetime
 
 class StudentBase(BaseModel):
@@ -43,3 +43,22 @@ class StudentResponse(StudentBase):
             datetime: lambda v: v.isoformat(),
             date: lambda v: v.isoformat()
         }
+
+class StudentImportError(BaseModel):
+    row: int = Field(..., description="Line number in the uploaded file")
+    error: str
+
+class StudentImportResult(BaseModel):
+    total_rows: int
+    imported: int
+    failed: int
+    dry_run: bool = False
+    code_ranges: Dict[str, List[str]] = Field(default_factory=dict, description="First and last code assigned per grade")
+    errors: List[StudentImportError] = []
+
+class StudentSearchHit(StudentResponse):
+    score: float = Field(..., description="Match score (1.0 = exact student code)")
+
+# Serializer dựng sẵn cho response danh sách (JSON do pydantic-core encode)
+StudentListAdapter = TypeAdapter(List[StudentResponse])
+StudentSearchAdapter = TypeAdapter(List[StudentSearchHit])
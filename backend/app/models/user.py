@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr, validator
-from typing import Optional
+from pydantic import BaseModel, EmailStr, TypeAdapter, validator
+from typing import List, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -42,6 +42,9 @@ class UserResponse(UserBase):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+# Serializer dựng sẵn cho response danh sách
+UserListAdapter = TypeAdapter(List[UserResponse])
+
 class TokenResponse(BaseModel):
     """Model response cho authentication token"""
     access_token: str
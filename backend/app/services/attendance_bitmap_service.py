@@ -0,0 +1,299 @@
+import numpy as np
+from bisect import bisect_right
+from sqlalchemy import and_, bindparam, delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from app.core.config import settings
+from app.core.database import UnitOfWork
+from app.core.database import AttendanceDailyStats as DailyStatsModel
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.database import AttendanceTermBitmap as BitmapModel
+from app.core.database import Student as StudentModel
+from app.models.attendance import (
+    AttendanceDay, AttendanceStatus, StudentAttendanceHistory, StudentTermRate, TermAttendanceRates
+)
+from app.services.attendance_partitions import archived_before
+from app.services.attendance_stats_service import STATUS_COLUMNS, StatusChange
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Các status tính là có đi học (bit `present`)
+ATTENDED_STATUSES = {AttendanceStatus.PRESENT.value, AttendanceStatus.LATE.value, AttendanceStatus.EARLY_LEAVE.value}
+
+def term_bounds(day: date) -> Tuple[date, date]:
+    """(ngày bắt đầu, ngày bắt đầu học kỳ sau) của học kỳ chứa `day`"""
+    month_days = sorted(tuple(int(part) for part in value.split("-")) for value in settings.ATTENDANCE_TERM_STARTS)
+    starts = [date(year, month, day_of_month) for year in (day.year - 1, day.year, day.year + 1)
+              for month, day_of_month in month_days]
+    index = bisect_right(starts, day)
+    return starts[index - 1], starts[index]
+
+def _bits(data: Optional[bytes], length: int) -> np.ndarray:
+    """bytes -> mảng bool `length` phần tử (bit thấp của byte 0 là ngày đầu học kỳ)"""
+    if not data:
+        return np.zeros(length, dtype=bool)
+    return np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=length, bitorder="little").astype(bool)
+
+def _bit_matrix(blobs: Sequence[Optional[bytes]], length: int) -> np.ndarray:
+    """Nhiều bitmap -> ma trận bool (số bitmap x `length`) bằng một lần unpackbits"""
+    width = (length + 7) // 8
+    buffer = b"".join((blob or b"").ljust(width, b"\0")[:width] for blob in blobs)
+    matrix = np.frombuffer(buffer, dtype=np.uint8).reshape(len(blobs), width)
+    return np.unpackbits(matrix, axis=1, count=length, bitorder="little").astype(bool)
+
+def _pack(bits: np.ndarray) -> bytes:
+    return np.packbits(bits, bitorder="little").tobytes()
+
+def _day_offsets(days: Iterable[date], start: date) -> np.ndarray:
+    return (np.array(list(days), dtype="datetime64[D]") - np.datetime64(start, "D")).astype(np.int64)
+
+def _bit_state(status: Optional[str]) -> Tuple[bool, bool]:
+    """(bit present, bit late) của một status; None = chưa có dòng"""
+    return status in ATTENDED_STATUSES, status == AttendanceStatus.LATE.value
+
+def _runs(values: np.ndarray) -> Tuple[int, int]:
+    """(chuỗi True dài nhất, chuỗi True ở cuối mảng)"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], values.astype(np.int8), [0]))))
+    lengths = edges[1::2] - edges[::2]
+    if not lengths.size:
+        return 0, 0
+    return int(lengths.max()), int(lengths[-1]) if edges[-1] == values.size else 0
+
+class AttendanceBitmapService:
+    """Lịch sử và tỷ lệ chuyên cần theo học kỳ từ bảng attendance_term_bitmaps.
+
+    Mỗi (học sinh, học kỳ) có hai bitmap `present`/`late`, một bit cho mỗi
+    ngày kể từ đầu học kỳ (~20 byte mỗi cột). apply_changes() bật/tắt bit
+    trong cùng transaction với lần ghi attendance_records; ngày học là các
+    ngày có dữ liệu trong attendance_daily_stats. Tỷ lệ của cả lớp được
+    tính bằng phép toán vector trên ma trận bit (học sinh x ngày).
+    """
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+
+    async def apply_changes(self, changes: Iterable[StatusChange]) -> int:
+        """Cập nhật bitmap theo các thay đổi status; trả về số bitmap bị sửa"""
+        updates: Dict[Tuple[int, date], List[Tuple[int, str]]] = {}
+        for student_id, day, old_status, new_status in changes:
+            # Bỏ qua thay đổi không đổi bit nào (vd. dòng `absent` mới: ngày chưa có dòng đã là bit 0)
+            if _bit_state(old_status) == _bit_state(new_status):
+                continue
+            start, _ = term_bounds(day)
+            updates.setdefault((student_id, start), []).append(((day - start).days, new_status))
+        if not updates:
+            return 0
+
+        keys = sorted(updates)
+        lengths = {start: (term_bounds(start)[1] - start).days for _, start in keys}
+        # Tạo bitmap rỗng cho khoá chưa có rồi khoá cả lô (theo thứ tự khoá),
+        # để hai flush đồng thời sửa cùng bitmap phải chờ nhau thay vì ghi đè
+        empty = {start: bytes((length + 7) // 8) for start, length in lengths.items()}
+        await self.db.execute(pg_insert(BitmapModel).values([
+            {"student_id": student_id, "term_start": start, "present": empty[start], "late": empty[start]}
+            for student_id, start in keys
+        ]).on_conflict_do_nothing())
+        current = {
+            (row.student_id, row.term_start): row
+            for row in await self.db.execute(
+                select(BitmapModel.student_id, BitmapModel.term_start, BitmapModel.present, BitmapModel.late)
+                .where(tuple_(BitmapModel.student_id, BitmapModel.term_start).in_(keys))
+                .order_by(BitmapModel.student_id, BitmapModel.term_start)
+                .with_for_update()
+            )
+        }
+
+        rows = []
+        for key in keys:
+            length = lengths[key[1]]
+            present = _bits(current[key].present, length)
+            late = _bits(current[key].late, length)
+            for offset, new_status in updates[key]:
+                present[offset] = new_status in ATTENDED_STATUSES
+                late[offset] = new_status == AttendanceStatus.LATE.value
+            rows.append({"b_student_id": key[0], "b_term_start": key[1], "b_present": _pack(present), "b_late": _pack(late)})
+
+        table = BitmapModel.__table__
+        await self.db.execute(
+            update(table)
+            .where(table.c.student_id == bindparam("b_student_id"), table.c.term_start == bindparam("b_term_start"))
+            .values(present=bindparam("b_present"), late=bindparam("b_late"), updated_at=func.now()),
+            rows,
+        )
+        return len(rows)
+
+    async def rebuild(self, date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+        """Tính lại bitmap của các học kỳ chứa khoảng ngày (mặc định từ bản ghi đầu tiên tới hôm nay).
+
+        Mỗi học kỳ được tính lại toàn bộ, nên học kỳ có tháng đã lưu trữ bị bỏ qua
+        khi không truyền date_from và báo lỗi nếu date_from rơi vào học kỳ đó.
+        """
+        archived = await archived_before(self.db)
+        explicit = date_from is not None
+        if date_from is None:
+            first = (await self.db.execute(select(func.min(AttendanceModel.date)))).scalar()
+            date_from = first.date() if first else date.today()
+        date_to = date_to or date.today()
+
+        written = 0
+        start, end = term_bounds(date_from)
+        if archived and start < archived:
+            if explicit:
+                raise ValueError(
+                    f"Term starting {start} includes months archived before {archived}; its bitmaps cannot be rebuilt"
+                )
+            logger.warning(f"Skipping term starting {start}: months before {archived} are archived")
+            start, end = end, term_bounds(end)[1]
+        while start <= date_to:
+            written += await self._rebuild_term(start, end)
+            start, end = end, term_bounds(end)[1]
+        return written
+
+    async def _rebuild_term(self, start: date, end: date) -> int:
+        length = (end - start).days
+        day = func.date(AttendanceModel.date)
+        result = await self.db.execute(
+            select(
+                AttendanceModel.student_id,
+                func.array_agg(day).filter(AttendanceModel.status.in_(ATTENDED_STATUSES)),
+                func.array_agg(day).filter(AttendanceModel.status == AttendanceStatus.LATE.value),
+            )
+            .where(
+                AttendanceModel.date >= datetime.combine(start, time.min),
+                AttendanceModel.date < datetime.combine(end, time.min),
+            )
+            .group_by(AttendanceModel.student_id)
+        )
+        rows = []
+        for student_id, attended_days, late_days in result:
+            present = np.zeros(length, dtype=bool)
+            late = np.zeros(length, dtype=bool)
+            present[_day_offsets(attended_days or [], start)] = True
+            late[_day_offsets(late_days or [], start)] = True
+            rows.append({"student_id": student_id, "term_start": start, "present": _pack(present), "late": _pack(late)})
+
+        await self.db.execute(delete(BitmapModel).where(BitmapModel.term_start == start))
+        for index in range(0, len(rows), 1000):
+            await self.db.execute(pg_insert(BitmapModel).values(rows[index:index + 1000]))
+        return len(rows)
+
+    async def _school_days(self, start: date, end: date, grade: Optional[str]) -> np.ndarray:
+        """Mask các ngày trong học kỳ có dữ liệu điểm danh (của grade nếu có)"""
+        query = select(DailyStatsModel.date).distinct().where(
+            DailyStatsModel.date >= start,
+            DailyStatsModel.date < end,
+            sum(DailyStatsModel.__table__.c[column] for column in STATUS_COLUMNS) > 0,
+        )
+        if grade:
+            query = query.where(DailyStatsModel.grade == grade)
+        mask = np.zeros((end - start).days, dtype=bool)
+        mask[_day_offsets((await self.db.execute(query)).scalars(), start)] = True
+        return mask
+
+    @staticmethod
+    def _window(start: date, end: date, date_from: Optional[date], date_to: Optional[date]) -> np.ndarray:
+        """Mask các ngày trong [date_from, date_to] của học kỳ, không quá hôm nay"""
+        date_to = min(date_to or date.today(), date.today())
+        window = np.zeros((end - start).days, dtype=bool)
+        first = max((date_from - start).days, 0) if date_from else 0
+        window[first:max((date_to - start).days + 1, 0)] = True
+        return window
+
+    async def get_student_history(
+        self,
+        student_id: int,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+    ) -> Optional[StudentAttendanceHistory]:
+        """Lịch sử theo ngày học, chuỗi ngày đi học và tỷ lệ chuyên cần trong học kỳ chứa date_from (mặc định hôm nay)"""
+        grade = (await self.db.execute(select(StudentModel.grade).where(StudentModel.id == student_id))).scalar()
+        if grade is None:
+            return None
+        start, end = term_bounds(date_from or date.today())
+        length = (end - start).days
+        row = (await self.db.execute(
+            select(BitmapModel.present, BitmapModel.late)
+            .where(BitmapModel.student_id == student_id, BitmapModel.term_start == start)
+        )).first()
+        present = _bits(row.present if row else None, length)
+        late = _bits(row.late if row else None, length)
+
+        window = self._window(start, end, date_from, date_to)
+        # Ngày học sinh có đi học luôn là ngày học, kể cả khi thiếu dòng tổng hợp
+        offsets = np.flatnonzero(window & (await self._school_days(start, end, grade) | present))
+        attended = present[offsets]
+        is_late = late[offsets] & attended
+        statuses = np.where(is_late, AttendanceStatus.LATE.value,
+                            np.where(attended, AttendanceStatus.PRESENT.value, AttendanceStatus.ABSENT.value))
+        longest, current = _runs(attended)
+        school_days = int(offsets.size)
+        attended_days = int(attended.sum())
+        late_days = int(is_late.sum())
+        return StudentAttendanceHistory(
+            student_id=student_id,
+            term_start=start,
+            term_end=end - timedelta(days=1),
+            school_days=school_days,
+            present_days=attended_days - late_days,
+            late_days=late_days,
+            absent_days=school_days - attended_days,
+            attendance_rate=round(attended_days / school_days, 4) if school_days else 0.0,
+            current_streak=current,
+            longest_streak=longest,
+            days=[
+                AttendanceDay(date=start + timedelta(days=int(offset)), status=day_status)
+                for offset, day_status in zip(offsets.tolist(), statuses.tolist())
+            ],
+        )
+
+    async def get_grade_rates(self, grade: str, day: Optional[date] = None) -> TermAttendanceRates:
+        """Tỷ lệ chuyên cần của mọi học sinh đang học trong grade, cho học kỳ chứa `day` (mặc định hôm nay)"""
+        start, end = term_bounds(day or date.today())
+        length = (end - start).days
+        rows = (await self.db.execute(
+            select(StudentModel.id, BitmapModel.present, BitmapModel.late)
+            .outerjoin(BitmapModel, and_(BitmapModel.student_id == StudentModel.id, BitmapModel.term_start == start))
+            .where(StudentModel.grade == grade, StudentModel.is_active == True)
+            .order_by(StudentModel.id)
+        )).all()
+        student_ids = [row[0] for row in rows]
+        present = _bit_matrix([row[1] for row in rows], length)
+        late = _bit_matrix([row[2] for row in rows], length)
+
+        window = self._window(start, end, None, None)
+        columns = np.flatnonzero(window & (await self._school_days(start, end, grade) | present.any(axis=0)))
+        attended = present[:, columns]
+        school_days = int(columns.size)
+        attended_days = attended.sum(axis=1)
+        late_days = (late[:, columns] & attended).sum(axis=1)
+        rates = np.round(attended_days / school_days, 4) if school_days else np.zeros(len(rows))
+        if school_days:
+            # Số ngày đi học liên tiếp ở cuối = vị trí ngày vắng đầu tiên khi đọc ngược
+            reverse = attended[:, ::-1]
+            current = np.where(reverse.all(axis=1), school_days, np.argmin(reverse, axis=1))
+        else:
+            current = np.zeros(len(rows), dtype=np.int64)
+
+        return TermAttendanceRates(
+            grade=grade,
+            term_start=start,
+            term_end=end - timedelta(days=1),
+            school_days=school_days,
+            average_rate=round(float(rates.mean()), 4) if rows else 0.0,
+            students=[
+                StudentTermRate(
+                    student_id=student_id,
+                    present_days=attended_count - late_count,
+                    late_days=late_count,
+                    absent_days=school_days - attended_count,
+                    attendance_rate=rate,
+                    current_streak=streak,
+                )
+                for student_id, attended_count, late_count, rate, streak in zip(
+                    student_ids, attended_days.tolist(), late_days.tolist(), rates.tolist(), current.tolist()
+                )
+            ],
+        )
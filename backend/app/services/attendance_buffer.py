@@ -0,0 +1,598 @@
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, UnitOfWork
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.models.attendance import AttendanceStatus, AttendanceType
+from app.services.attendance_bitmap_service import AttendanceBitmapService
+from app.services.attendance_feed import attendance_feed
+from app.services.attendance_report_service import invalidate_report_dates
+from app.services.attendance_stats_service import AttendanceStatsService
+
+logger = logging.getLogger(__name__)
+
+def attendance_day(at: datetime) -> date:
+    """Ngày điểm danh theo giờ địa phương của server"""
+    return at.astimezone().date()
+
+def late_cutoff(day: date) -> datetime:
+    """Giờ chốt đi muộn (ATTENDANCE_LATE_CUTOFF) của `day` theo giờ địa phương của server"""
+    return datetime.combine(day, dt_time.fromisoformat(settings.ATTENDANCE_LATE_CUTOFF)).astimezone()
+
+class AttendanceEvent:
+    """Một lần check-in/check-out đã được nhận (chưa chắc đã ghi xuống DB)"""
+
+    __slots__ = ("student_id", "event", "at", "location", "device_id", "duplicate")
+
+    def __init__(
+        self,
+        student_id: int,
+        event: AttendanceType,
+        at: datetime,
+        location: Optional[str] = None,
+        device_id: Optional[str] = None
+    ):
+        self.student_id = student_id
+        self.event = event
+        self.at = at
+        self.location = location
+        self.device_id = device_id
+        self.duplicate = False  # True nếu bị bộ dedupe bỏ qua (không ghi xuống DB)
+
+    @property
+    def day(self) -> date:
+        return attendance_day(self.at)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "student_id": self.student_id,
+            "event": self.event.value,
+            "at": self.at.isoformat(),
+            "location": self.location,
+            "device_id": self.device_id,
+        }, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, line: str) -> "AttendanceEvent":
+        data = json.loads(line)
+        return cls(
+            student_id=data["student_id"],
+            event=AttendanceType(data["event"]),
+            at=datetime.fromisoformat(data["at"]),
+            location=data.get("location"),
+            device_id=data.get("device_id"),
+        )
+
+class _PendingRecord:
+    """Các event của một học sinh trong một ngày đã gộp lại, chờ flush"""
+
+    __slots__ = ("student_id", "day", "check_in_time", "check_out_time", "location", "device_id")
+
+    def __init__(self, student_id: int, day: date):
+        self.student_id = student_id
+        self.day = day
+        self.check_in_time: Optional[datetime] = None
+        self.check_out_time: Optional[datetime] = None
+        self.location: Optional[str] = None
+        self.device_id: Optional[str] = None
+
+    def add(self, event: AttendanceEvent):
+        # Check-in sớm nhất và check-out muộn nhất trong ngày (giống câu upsert)
+        if event.event == AttendanceType.CHECK_IN:
+            if self.check_in_time is None or event.at < self.check_in_time:
+                self.check_in_time = event.at
+        elif self.check_out_time is None or event.at > self.check_out_time:
+            self.check_out_time = event.at
+        self.location = event.location or self.location
+        self.device_id = event.device_id or self.device_id
+
+    def merge(self, other: "_PendingRecord"):
+        if other.check_in_time is not None and (self.check_in_time is None or other.check_in_time < self.check_in_time):
+            self.check_in_time = other.check_in_time
+        if other.check_out_time is not None and (self.check_out_time is None or other.check_out_time > self.check_out_time):
+            self.check_out_time = other.check_out_time
+        self.location = self.location or other.location
+        self.device_id = self.device_id or other.device_id
+
+    def values(self) -> dict:
+        late = self.check_in_time is not None and self.check_in_time.astimezone() > late_cutoff(self.day)
+        return {
+            "student_id": self.student_id,
+            "date": datetime.combine(self.day, dt_time.min),
+            "check_in_time": self.check_in_time,
+            "check_out_time": self.check_out_time,
+            "status": (AttendanceStatus.LATE if late else AttendanceStatus.PRESENT).value,
+            "location": self.location,
+            "device_id": self.device_id,
+        }
+
+class AttendanceJournal:
+    """Journal append-only cho các event chưa flush.
+
+    Mỗi process ghi vào slot riêng `<path>-<k>`, giữ bằng file lock
+    (`<path>-<k>.lock`) suốt vòng đời, nên rotate()/discard() của một worker
+    không bao giờ đụng tới event của worker khác. File đang ghi được đổi tên
+    thành segment (`<path>-<k>.<n>`) mỗi lần flush; segment chỉ bị xoá sau
+    khi một lần flush chứa toàn bộ event của nó thành công. Sau crash, mọi
+    segment và file đang ghi được replay (upsert idempotent nên replay trùng
+    không sao); slot không còn process nào giữ được process khởi động sau
+    nhận lại.
+
+    Các hàm đều là I/O chặn, buffer gọi chúng qua asyncio.to_thread().
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.base_path = path
+        self.path: Optional[str] = None  # Slot của process này, có sau claim()
+        self.fsync = fsync
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = None
+        self._lock_file = None
+        self._io_lock = threading.Lock()  # append() từ nhiều thread và rotate() dùng chung file
+
+    @staticmethod
+    def _try_lock(path: str):
+        """Mở và khoá `<path>.lock` (không chờ); None nếu process khác đang giữ"""
+        lock_file = open(f"{path}.lock", "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _slot_paths(self) -> List[str]:
+        prefix = f"{self.base_path}-"
+        paths = [p[:-len(".lock")] for p in glob.glob(f"{glob.escape(prefix)}*.lock")]
+        return sorted(p for p in paths if p[len(prefix):].isdigit())
+
+    def claim(self):
+        """Giữ slot trống có số nhỏ nhất"""
+        slot = 0
+        while True:
+            lock_file = self._try_lock(f"{self.base_path}-{slot}")
+            if lock_file is not None:
+                break
+            slot += 1
+        self._lock_file = lock_file
+        self.path = f"{self.base_path}-{slot}"
+
+    def adopt_orphans(self) -> int:
+        """Chuyển event của các slot không ai giữ (worker đã dừng) vào slot này.
+
+        Event được ghi vào file của process này trước khi xoá segment cũ, nên
+        crash ở giữa chỉ làm replay trùng. Journal trước khi có slot (ghi thẳng
+        vào `<path>`) cũng được nhận theo cách này. Trả về số event đã nhận.
+        """
+        adopted = 0
+        for path in [self.base_path] + self._slot_paths():
+            if path == self.path:
+                continue
+            lock_file = self._try_lock(path)
+            if lock_file is None:
+                continue
+            orphan = AttendanceJournal(self.base_path, self.fsync)
+            orphan.path, orphan._lock_file = path, lock_file
+            try:
+                segments = orphan.rotate()
+                events = orphan._read(segments)
+                for event in events:
+                    self.append(event)
+                orphan.discard(segments)
+                adopted += len(events)
+            finally:
+                orphan.close()
+        return adopted
+
+    def _segments(self) -> List[str]:
+        segments = [p for p in glob.glob(f"{glob.escape(self.path)}.*") if p.rsplit(".", 1)[1].isdigit()]
+        return sorted(segments, key=lambda p: int(p.rsplit(".", 1)[1]))
+
+    def append(self, event: AttendanceEvent):
+        with self._io_lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(event.to_json() + "\n")
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def rotate(self) -> List[str]:
+        """Đóng file đang ghi thành segment mới; trả về mọi segment chưa xoá"""
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                segments = self._segments()
+                number = int(segments[-1].rsplit(".", 1)[1]) + 1 if segments else 1
+                os.replace(self.path, f"{self.path}.{number}")
+            return self._segments()
+
+    def discard(self, segments: Iterable[str]):
+        for segment in segments:
+            try:
+                os.remove(segment)
+            except FileNotFoundError:
+                pass
+
+    def _read(self, segments: Iterable[str]) -> List[AttendanceEvent]:
+        events = []
+        for path in segments:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        events.append(AttendanceEvent.from_json(line))
+                    except (ValueError, KeyError) as e:  # dòng cuối ghi dở khi crash
+                        logger.warning(f"Skipping unreadable journal line in {path}: {e}")
+        return events
+
+    def replay(self) -> List[AttendanceEvent]:
+        return self._read(self.rotate())
+
+    def close(self):
+        """Đóng file đang ghi và nhả slot"""
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+class AttendanceDeduplicator:
+    """Bỏ các event lặp theo khoá (student_id, ngày, loại event) trước khi vào buffer.
+
+    - Check-in: chỉ lần đầu trong ngày được ghi (trừ khi event đến muộn nhưng
+      có thời điểm sớm hơn, vd. thiết bị offline đồng bộ lại)
+    - Check-out: debounce, chỉ ghi khi cách lần đã ghi ít nhất `checkout_window`
+      giây nên giờ check-out cuối ngày sai lệch tối đa `checkout_window`
+
+    Mỗi khoá chỉ lưu một timestamp; khoá của các ngày trước bị xoá khi sang
+    ngày mới. Trạng thái nằm trong từng process, unique index
+    (student_id, date) của attendance_records là lớp chặn cuối.
+    """
+
+    def __init__(self, checkout_window: float):
+        self.checkout_window = checkout_window
+        self._seen: Dict[Tuple[int, int, bool], float] = {}
+        self._day = 0
+        self._accepted = {event.value: 0 for event in AttendanceType}
+        self._suppressed = {event.value: 0 for event in AttendanceType}
+
+    def _expire(self, day: int):
+        if day > self._day:
+            self._seen = {key: value for key, value in self._seen.items() if key[1] >= day}
+            self._day = day
+
+    def accept(self, event: AttendanceEvent) -> bool:
+        """True nếu event cần được ghi, False nếu là bản lặp"""
+        day = event.day.toordinal()
+        self._expire(day)
+        key = (event.student_id, day, event.event == AttendanceType.CHECK_OUT)
+        at = event.at.timestamp()
+        last = self._seen.get(key)
+
+        if last is None:
+            accepted = True
+        elif event.event == AttendanceType.CHECK_IN:
+            accepted = at < last
+        else:
+            accepted = at - last >= self.checkout_window
+
+        if accepted:
+            self._seen[key] = at
+            self._accepted[event.event.value] += 1
+        else:
+            self._suppressed[event.event.value] += 1
+        return accepted
+
+    def stats(self) -> dict:
+        return {"keys": len(self._seen), "accepted": dict(self._accepted), "suppressed": dict(self._suppressed)}
+
+class AttendanceBuffer:
+    """Write-behind buffer cho check-in/check-out.
+
+    record() chỉ gộp event vào bộ nhớ (và journal nếu bật) rồi trả về ngay.
+    Các event cùng (student_id, ngày) được gộp thành một dòng; buffer được
+    flush xuống `attendance_records` bằng multi-row upsert (cùng transaction
+    với cập nhật attendance_daily_stats) khi đủ `max_pending` dòng hoặc sau
+    mỗi `flush_interval` giây. Flush lỗi thì các dòng được gộp lại vào
+    buffer để thử lại ở lần sau. Nếu có `dedupe`,
+    event lặp bị bỏ trước khi vào journal và buffer.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float,
+        max_pending: int,
+        batch_size: int,
+        journal: Optional[AttendanceJournal] = None,
+        dedupe: Optional[AttendanceDeduplicator] = None
+    ):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.journal = journal
+        self.dedupe = dedupe
+        self._pending: Dict[Tuple[int, date], _PendingRecord] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self._events = 0
+        self._flushes = 0
+        self._flushed_rows = 0
+        self._failed_flushes = 0
+        self._dropped_rows = 0
+        self._last_flush_seconds = 0.0
+
+    async def start(self):
+        """Replay journal (nếu có) và chạy task flush nền"""
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        if self.journal is not None:
+            await asyncio.to_thread(self.journal.claim)
+            adopted = await asyncio.to_thread(self.journal.adopt_orphans)
+            if adopted:
+                logger.info(f"Adopted {adopted} attendance events from journals of stopped workers")
+            events = await asyncio.to_thread(self.journal.replay)
+            if events:
+                logger.info(f"Replaying {len(events)} attendance events from journal")
+                for event in events:
+                    self._add(event)
+                await self.flush()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Dừng task nền và flush hết dữ liệu còn lại"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            pass  # flush() đã log; journal (nếu có) giữ các event để replay
+        if self._pending:
+            logger.error(f"{len(self._pending)} attendance records could not be flushed on shutdown")
+        if self.journal is not None:
+            await asyncio.to_thread(self.journal.close)
+
+    def _add(self, event: AttendanceEvent):
+        key = (event.student_id, event.day)
+        record = self._pending.get(key)
+        if record is None:
+            record = self._pending[key] = _PendingRecord(*key)
+        record.add(event)
+
+    async def record(
+        self,
+        student_id: int,
+        event: AttendanceType,
+        location: Optional[str] = None,
+        device_id: Optional[str] = None,
+        at: Optional[datetime] = None
+    ) -> AttendanceEvent:
+        """Nhận một event check-in/check-out; ghi xuống DB ở lần flush kế tiếp.
+
+        Event bị dedupe bỏ qua được trả về với `duplicate=True`.
+        """
+        attendance_event = AttendanceEvent(student_id, event, at or datetime.now(timezone.utc), location, device_id)
+        if self.dedupe is not None and not self.dedupe.accept(attendance_event):
+            attendance_event.duplicate = True
+            return attendance_event
+        self._add(attendance_event)
+        self._events += 1
+        if self.journal is not None:
+            # Ghi journal trong thread, không chặn event loop. Event đã nằm trong buffer nên
+            # một lần flush chạy xen vào chỉ làm nó có ở cả DB và journal (replay idempotent)
+            await asyncio.to_thread(self.journal.append, attendance_event)
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+        return attendance_event
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:  # flush() đã log; task nền không được chết
+                logger.error(f"Attendance flush loop error: {e}")
+
+    async def flush(self) -> int:
+        """Ghi mọi dòng đang chờ; trả về số dòng đã ghi"""
+        async with self._flush_lock:
+            segments = await asyncio.to_thread(self.journal.rotate) if self.journal is not None else []
+            if not self._pending:
+                if self.journal is not None:
+                    await asyncio.to_thread(self.journal.discard, segments)
+                return 0
+
+            records, self._pending = list(self._pending.values()), {}
+            started = time.perf_counter()
+            try:
+                written = await self._write(records)
+            except Exception as e:
+                self._failed_flushes += 1
+                logger.error(f"Attendance flush of {len(records)} records failed, will retry: {e}")
+                # Gộp lại với các event mới đến trong lúc flush; segment journal được giữ lại
+                for record in records:
+                    key = (record.student_id, record.day)
+                    pending = self._pending.get(key)
+                    if pending is None:
+                        self._pending[key] = record
+                    else:
+                        pending.merge(record)
+                raise
+
+            self._flushes += 1
+            self._flushed_rows += written
+            self._last_flush_seconds = time.perf_counter() - started
+            if self.journal is not None:
+                await asyncio.to_thread(self.journal.discard, segments)
+            return written
+
+    @staticmethod
+    def _upsert(rows: List[dict]):
+        stmt = pg_insert(AttendanceModel).values(rows)
+        existing = AttendanceModel.__table__.c
+        return stmt.on_conflict_do_update(
+            index_elements=[AttendanceModel.student_id, AttendanceModel.date],
+            set_={
+                # LEAST/GREATEST bỏ qua NULL: giữ check-in sớm nhất, check-out muộn nhất
+                "check_in_time": func.least(existing.check_in_time, stmt.excluded.check_in_time),
+                "check_out_time": func.greatest(existing.check_out_time, stmt.excluded.check_out_time),
+                # Dòng đã đánh vắng (chốt ngày) mà học sinh check-in sau đó thì thành có mặt,
+                # hoặc đi muộn nếu check-in sau giờ chốt (status của dòng mới, xem values())
+                "status": case(
+                    (
+                        (existing.status == AttendanceStatus.ABSENT.value) & stmt.excluded.check_in_time.isnot(None),
+                        stmt.excluded.status,
+                    ),
+                    else_=existing.status,
+                ),
+                "location": func.coalesce(stmt.excluded.location, existing.location),
+                "device_id": func.coalesce(stmt.excluded.device_id, existing.device_id),
+                "updated_at": func.now(),
+            },
+        )
+
+    async def _write_rows(self, uow: UnitOfWork, rows: List[dict]):
+        """Upsert một lô và cập nhật attendance_daily_stats, bitmap học kỳ trong cùng transaction.
+
+        Delta được gửi cho live feed sau khi transaction commit.
+        """
+        session = uow.session
+        keys = [(row["student_id"], row["date"]) for row in rows]
+        previous = {
+            (row.student_id, row.date): row.status
+            for row in (await session.execute(
+                select(AttendanceModel.student_id, AttendanceModel.date, AttendanceModel.status)
+                .where(tuple_(AttendanceModel.student_id, AttendanceModel.date).in_(keys))
+                .with_for_update()
+            ))
+        }
+        result = await session.execute(self._upsert(rows).returning(
+            AttendanceModel.student_id,
+            AttendanceModel.date,
+            AttendanceModel.status,
+            AttendanceModel.check_in_time,
+            # created_at mặc định là now() (thời điểm bắt đầu transaction): bằng now() nghĩa là
+            # dòng do chính lệnh này chèn (xmax không đọc được trên bảng partition)
+            (AttendanceModel.created_at == func.now()).label("inserted"),
+        ))
+        changes = []
+        records = []  # Dòng mới/đổi status, gửi cho live feed sau khi commit
+        for row in result:
+            old_status = previous.get((row.student_id, row.date))
+            if old_status is None and not row.inserted:
+                # Dòng vừa được process khác chèn, status cũ không rõ: coi như không đổi
+                old_status = row.status
+            changes.append((row.student_id, row.date.date(), old_status, row.status))
+            if old_status != row.status:
+                records.append({
+                    "student_id": row.student_id,
+                    "date": row.date.date(),
+                    "status": row.status,
+                    "previous_status": old_status,
+                    "check_in_time": row.check_in_time,
+                })
+        counts = await AttendanceStatsService(uow).apply_changes(changes)
+        await AttendanceBitmapService(uow).apply_changes(changes)
+
+        async def publish():
+            attendance_feed.publish(records, counts)
+            await invalidate_report_dates(row["date"] for row in counts)
+        uow.after_commit(publish)
+
+    async def _write(self, records: List[_PendingRecord]) -> int:
+        # Thứ tự khoá cố định để các flush đồng thời (nhiều worker) không deadlock
+        rows = sorted((record.values() for record in records), key=lambda row: (row["student_id"], row["date"]))
+        async with AsyncSessionLocal() as session:
+            uow = UnitOfWork(session)
+            try:
+                for start in range(0, len(rows), self.batch_size):
+                    await self._write_rows(uow, rows[start:start + self.batch_size])
+                async with attendance_feed.publishing():
+                    await uow.commit()
+                return len(rows)
+            except IntegrityError as e:
+                # Thường là student_id không tồn tại: ghi từng dòng để chỉ bỏ dòng lỗi
+                await uow.rollback()
+                logger.warning(f"Attendance batch rejected ({e.orig}), retrying row by row")
+
+            written = 0
+            for row in rows:
+                try:
+                    await self._write_rows(uow, [row])
+                    async with attendance_feed.publishing():
+                        await uow.commit()
+                    written += 1
+                except IntegrityError as e:
+                    await uow.rollback()
+                    self._dropped_rows += 1
+                    logger.error(f"Dropping attendance row for student {row['student_id']}: {e.orig}")
+            return written
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "events": self._events,
+            "flushes": self._flushes,
+            "flushed_rows": self._flushed_rows,
+            "failed_flushes": self._failed_flushes,
+            "dropped_rows": self._dropped_rows,
+            "last_flush_seconds": round(self._last_flush_seconds, 4),
+            "journal": self.journal.path if self.journal is not None else None,
+            "dedupe": self.dedupe.stats() if self.dedupe is not None else None,
+        }
+
+attendance_buffer = AttendanceBuffer(
+    flush_interval=settings.ATTENDANCE_FLUSH_INTERVAL_SECONDS,
+    max_pending=settings.ATTENDANCE_BUFFER_MAX_PENDING,
+    batch_size=settings.ATTENDANCE_FLUSH_BATCH_SIZE,
+    journal=(
+        AttendanceJournal(settings.ATTENDANCE_JOURNAL_PATH, fsync=settings.ATTENDANCE_JOURNAL_FSYNC)
+        if settings.ATTENDANCE_JOURNAL_PATH else None
+    ),
+    dedupe=(
+        AttendanceDeduplicator(settings.ATTENDANCE_CHECKOUT_DEBOUNCE_SECONDS)
+        if settings.ATTENDANCE_DEDUPE_ENABLED else None
+    ),
+)
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, case, exists, func, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, UnitOfWork
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.database import Student as StudentModel
+from app.models.attendance import AttendanceStatus
+from app.services.attendance_bitmap_service import AttendanceBitmapService
+from app.services.attendance_buffer import attendance_buffer, late_cutoff
+from app.services.attendance_feed import attendance_feed
+from app.services.attendance_report_service import invalidate_report_dates
+from app.services.attendance_stats_service import AttendanceStatsService, StatusChange
+
+logger = logging.getLogger(__name__)
+
+# Khoá advisory để chỉ một worker chốt ngày tại một thời điểm
+_LOCK_KEY = "attendance_closeout"
+
+def parse_time_of_day(value: str) -> time:
+    """"HH:MM" -> time"""
+    return time.fromisoformat(value)
+
+class AttendanceCloseoutService:
+    """Chốt điểm danh một ngày.
+
+    Học sinh vắng không check-in nên không có dòng nào; close_day() ghi
+    dòng `absent` cho mọi học sinh đang học chưa có dòng trong ngày (một câu
+    INSERT ... SELECT với anti-join NOT EXISTS) và đổi present/late theo giờ
+    check-in so với giờ chốt đi muộn. Chạy lại bao nhiêu lần cũng cho cùng
+    kết quả: dòng đã có được bỏ qua (ON CONFLICT DO NOTHING), status chỉ
+    đổi khi lệch với giờ check-in.
+    """
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+
+    async def _has_check_ins(self, day_start: datetime) -> bool:
+        return (await self.db.execute(
+            select(exists().where(AttendanceModel.date == day_start, AttendanceModel.check_in_time.isnot(None)))
+        )).scalar()
+
+    async def _mark_late(self, day_start: datetime, cutoff: datetime, grade: Optional[str]) -> List[StatusChange]:
+        """present <-> late theo giờ check-in; trả về các dòng bị đổi"""
+        is_late = AttendanceModel.check_in_time > cutoff
+        late, present = AttendanceStatus.LATE.value, AttendanceStatus.PRESENT.value
+        stmt = (
+            update(AttendanceModel)
+            .where(
+                AttendanceModel.date == day_start,
+                AttendanceModel.check_in_time.isnot(None),
+                # Chỉ các dòng có status lệch với giờ check-in
+                ((AttendanceModel.status == present) & is_late) | ((AttendanceModel.status == late) & ~is_late),
+            )
+            .values(status=case((is_late, late), else_=present), updated_at=func.now())
+            .returning(AttendanceModel.student_id, AttendanceModel.status)
+        )
+        if grade:
+            stmt = stmt.where(AttendanceModel.student_id.in_(
+                select(StudentModel.id).where(StudentModel.grade == grade)
+            ))
+        day = day_start.date()
+        return [
+            (student_id, day, present if new_status == late else late, new_status)
+            for student_id, new_status in await self.db.execute(stmt, execution_options={"synchronize_session": False})
+        ]
+
+    async def _insert_absent(self, day_start: datetime, grade: Optional[str]) -> List[StatusChange]:
+        """Ghi `absent` cho học sinh đang học không có dòng nào trong ngày"""
+        conditions = [
+            StudentModel.is_active == True,
+            ~exists().where(AttendanceModel.student_id == StudentModel.id, AttendanceModel.date == day_start),
+        ]
+        if grade:
+            conditions.append(StudentModel.grade == grade)
+        missing = select(
+            StudentModel.id,
+            literal(day_start),
+            literal(AttendanceStatus.ABSENT.value),
+        ).where(and_(*conditions))
+        stmt = (
+            pg_insert(AttendanceModel)
+            .from_select(["student_id", "date", "status"], missing)
+            .on_conflict_do_nothing(index_elements=[AttendanceModel.student_id, AttendanceModel.date])
+            .returning(AttendanceModel.student_id)
+        )
+        day = day_start.date()
+        return [(student_id, day, None, AttendanceStatus.ABSENT.value) for student_id in (await self.db.execute(stmt)).scalars()]
+
+    async def close_day(
+        self,
+        day: date,
+        grade: Optional[str] = None,
+        force: bool = False
+    ) -> dict:
+        """Chốt một ngày (chỉ flush, handler/job commit).
+
+        Ngày không có check-in nào (nghỉ lễ) bị bỏ qua trừ khi `force`, để
+        không đánh vắng cả trường.
+        """
+        day_start = datetime.combine(day, time.min)
+        summary = {"date": day, "grade": grade, "skipped": None, "late": 0, "on_time": 0, "absent": 0, "grades": {}}
+        if not force and not await self._has_check_ins(day_start):
+            summary["skipped"] = "no check-ins recorded"
+            return summary
+
+        late_changes = await self._mark_late(day_start, late_cutoff(day), grade)
+        absent_changes = await self._insert_absent(day_start, grade)
+        changes = late_changes + absent_changes
+
+        counts = []
+        batch_size = settings.ATTENDANCE_FLUSH_BATCH_SIZE
+        for start in range(0, len(changes), batch_size):
+            batch = changes[start:start + batch_size]
+            counts += await AttendanceStatsService(self.uow).apply_changes(batch)
+            await AttendanceBitmapService(self.uow).apply_changes(batch)
+
+        records = [
+            {"student_id": student_id, "date": change_day, "status": new_status, "previous_status": old_status}
+            for student_id, change_day, old_status, new_status in changes
+        ]
+
+        async def publish():
+            attendance_feed.publish(records, counts)
+            await invalidate_report_dates(row["date"] for row in counts)
+        self.uow.after_commit(publish)
+
+        grades: Dict[str, Dict[str, int]] = {}
+        for row in counts:
+            totals = grades.setdefault(row["grade"], {"absent": 0, "late": 0})
+            totals["absent"] += row[AttendanceStatus.ABSENT.value]
+            totals["late"] += row[AttendanceStatus.LATE.value]
+        summary.update(
+            late=sum(1 for change in late_changes if change[3] == AttendanceStatus.LATE.value),
+            on_time=sum(1 for change in late_changes if change[3] == AttendanceStatus.PRESENT.value),
+            absent=len(absent_changes),
+            grades=grades,
+        )
+        return summary
+
+async def close_attendance_day(
+    day: date,
+    grade: Optional[str] = None,
+    force: bool = False,
+    flush_buffer: bool = True
+) -> dict:
+    """Chốt `day` trong một transaction.
+
+    Trong server, buffer check-in được flush trước để check-in vừa nhận
+    không bị tính là vắng. Script chạy ngoài server dùng flush_buffer=False:
+    buffer của process đó rỗng và journal (nếu có) thuộc về server.
+
+    Mọi worker uvicorn đều chạy scheduler; khoá advisory (giữ tới commit)
+    để các worker chốt lần lượt: worker đầu tiên ghi vắng/đi muộn, các worker
+    sau chỉ flush buffer của mình rồi chạy lại không thay đổi gì. Check-in
+    tới sau khi đã chốt thì upsert đổi dòng vắng thành có mặt/đi muộn.
+    """
+    if flush_buffer:
+        await attendance_buffer.flush()
+    async with AsyncSessionLocal() as session:
+        uow = UnitOfWork(session)
+        await session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _LOCK_KEY})
+        summary = await AttendanceCloseoutService(uow).close_day(day, grade=grade, force=force)
+        async with attendance_feed.publishing():
+            await uow.commit()
+    if summary["skipped"]:
+        logger.info(f"Attendance closeout for {day} skipped: {summary['skipped']}")
+    else:
+        logger.info(f"Attendance closeout for {day}: {summary['absent']} absent, {summary['late']} late")
+    return summary
+
+class AttendanceCloseoutScheduler:
+    """Chạy close_attendance_day() cho hôm nay vào `run_at` mỗi ngày học"""
+
+    def __init__(self, run_at: Optional[time], school_weekdays: List[int]):
+        self.run_at = run_at
+        self.school_weekdays = set(school_weekdays)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.run_at is not None and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _next_run(self, now: datetime) -> datetime:
+        run = datetime.combine(now.date(), self.run_at)
+        return run if run > now else run + timedelta(days=1)
+
+    async def _run(self):
+        while True:
+            now = datetime.now()
+            next_run = self._next_run(now)
+            await asyncio.sleep((next_run - now).total_seconds())
+            if next_run.weekday() not in self.school_weekdays:
+                continue
+            try:
+                await close_attendance_day(next_run.date())
+            except Exception as e:
+                logger.error(f"Attendance closeout for {next_run.date()} failed: {e}")
+
+closeout_scheduler = AttendanceCloseoutScheduler(
+    run_at=parse_time_of_day(settings.ATTENDANCE_CLOSEOUT_TIME) if settings.ATTENDANCE_CLOSEOUT_TIME else None,
+    school_weekdays=settings.ATTENDANCE_SCHOOL_WEEKDAYS,
+)
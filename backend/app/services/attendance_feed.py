@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, AsyncIterator, List, Optional, Set
+
+from pydantic_core import to_json
+
+from app.core.config import settings
+from app.core.database import read_uow
+from app.services.attendance_stats_service import AttendanceStatsService
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("resync", "drop_oldest", "close")
+
+# Marker trong queue của subscriber: gửi lại snapshot / đóng kết nối
+_RESYNC = object()
+_CLOSE = object()
+
+def sse_message(event: str, seq: int, data: Any) -> bytes:
+    """Một message Server-Sent Events (id = số thứ tự của feed)"""
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (seq, event.encode(), to_json(data))
+
+class FeedSubscriber:
+    """Một kết nối đang nghe feed, với queue giới hạn và chính sách khi queue đầy"""
+
+    __slots__ = ("queue", "overflow", "seq", "dropped", "resyncs")
+
+    def __init__(self, queue_size: int, overflow: str):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)  # (seq, message | marker)
+        self.overflow = overflow
+        self.seq = 0  # seq của snapshot gần nhất; delta có seq <= giá trị này đã nằm trong snapshot
+        self.dropped = 0
+        self.resyncs = 0
+
+    def clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+class AttendanceFeed:
+    """Phát delta điểm danh (bản ghi đổi status, số đếm theo grade) tới các dashboard.
+
+    Mỗi lần buffer flush, publish() encode một message duy nhất và đưa vào
+    queue của mọi subscriber, nên chi phí mỗi dashboard sau khi kết nối chỉ
+    là một put_nowait. Khi kết nối, subscriber nhận snapshot số đếm hôm nay
+    từ attendance_daily_stats rồi các delta có seq lớn hơn. Commit + publish
+    của writer giữ một lock; snapshot chỉ giữ lock đó để chốt snapshot DB,
+    ghi nhận seq và đăng ký, nên mỗi thay đổi nằm trong snapshot hoặc trong
+    delta, không bao giờ cả hai.
+
+    Queue đầy (client đọc chậm) xử lý theo chính sách của kết nối:
+    `resync` bỏ các delta đang chờ và gửi snapshot mới, `drop_oldest` bỏ
+    delta cũ nhất (client thấy seq bị nhảy), `close` đóng stream.
+
+    Feed chỉ thấy các lần ghi của process hiện tại.
+    """
+
+    def __init__(self, queue_size: int, heartbeat: float, overflow: str = "resync"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.overflow = overflow
+        self._subscribers: Set[FeedSubscriber] = set()
+        self._lock = asyncio.Lock()
+        self._seq = 0
+        self._published = 0
+        self._dropped = 0
+        self._resyncs = 0
+        self._closed = 0
+
+    @asynccontextmanager
+    async def publishing(self):
+        """Giữ trong lúc commit và publish (callback after_commit) một lần ghi"""
+        async with self._lock:
+            yield
+
+    def publish(self, records: List[dict], counts: List[dict]):
+        """Gửi delta của một lần ghi tới mọi subscriber (không chờ)"""
+        if not records and not counts:
+            return
+        self._seq += 1
+        if not self._subscribers:
+            return
+        message = (self._seq, sse_message("delta", self._seq, {"seq": self._seq, "records": records, "counts": counts}))
+        self._published += 1
+        for subscriber in list(self._subscribers):
+            self._offer(subscriber, message)
+
+    def _offer(self, subscriber: FeedSubscriber, message: tuple):
+        try:
+            subscriber.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            pass
+        if subscriber.overflow == "drop_oldest":
+            subscriber.queue.get_nowait()
+            subscriber.queue.put_nowait(message)
+            subscriber.dropped += 1
+            self._dropped += 1
+        elif subscriber.overflow == "resync":
+            subscriber.clear()
+            subscriber.queue.put_nowait((self._seq, _RESYNC))
+            subscriber.resyncs += 1
+            self._resyncs += 1
+        else:
+            subscriber.clear()
+            subscriber.queue.put_nowait((self._seq, _CLOSE))
+            self._subscribers.discard(subscriber)
+            self._closed += 1
+
+    async def _snapshot(self, subscriber: FeedSubscriber) -> bytes:
+        """Đọc số đếm hôm nay và (đăng ký lại) subscriber.
+
+        Connection được checkout trước khi vào lock và query đếm chạy sau khi
+        nhả lock, nên dashboard kết nối không chặn commit điểm danh và không
+        bao giờ chờ pool khi đang giữ lock. Trong lock chỉ chốt snapshot của
+        transaction REPEATABLE READ (câu lệnh đầu tiên), ghi nhận seq và đăng
+        ký: snapshot chứa đúng các lần ghi có seq <= subscriber.seq.
+        """
+        day = date.today()
+        async with read_uow() as uow:
+            connection = await uow.session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            async with self._lock:
+                await connection.exec_driver_sql("SELECT 1")
+                subscriber.clear()
+                subscriber.seq = self._seq
+                self._subscribers.add(subscriber)
+            grades = await AttendanceStatsService(uow).get_day_counts(day)
+        return sse_message("snapshot", subscriber.seq, {"seq": subscriber.seq, "date": day, "grades": grades})
+
+    async def stream(self, overflow: Optional[str] = None) -> AsyncIterator[bytes]:
+        """Stream SSE cho một kết nối: snapshot, sau đó delta và heartbeat"""
+        subscriber = FeedSubscriber(self.queue_size, overflow or self.overflow)
+        try:
+            yield b"retry: 3000\n" + await self._snapshot(subscriber)
+            while True:
+                try:
+                    seq, message = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if message is _RESYNC:
+                    yield await self._snapshot(subscriber)
+                elif message is _CLOSE:
+                    yield sse_message("overflow", self._seq, {"seq": self._seq, "reason": "client too slow"})
+                    return
+                elif seq > subscriber.seq:  # Delta cũ hơn snapshot đã được tính trong snapshot
+                    yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "seq": self._seq,
+            "published": self._published,
+            "queued": sum(subscriber.queue.qsize() for subscriber in self._subscribers),
+            "dropped": self._dropped,
+            "resyncs": self._resyncs,
+            "closed_slow_clients": self._closed,
+        }
+
+attendance_feed = AttendanceFeed(
+    queue_size=settings.ATTENDANCE_FEED_QUEUE_SIZE,
+    heartbeat=settings.ATTENDANCE_FEED_HEARTBEAT_SECONDS,
+    overflow=settings.ATTENDANCE_FEED_OVERFLOW,
+)
@@ -0,0 +1,198 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import exists, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AttendanceDailyStats as DailyStatsModel
+from app.core.database import async_engine, engine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "attendance_records"
+_PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_(\d{{4}})_(\d{{2}})$")
+
+# Khoá advisory để nhiều worker không cùng tạo/tách partition
+_LOCK_KEY = "attendance_partitions"
+_LOCK_NOT_AVAILABLE = "55P03"
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_{month:%Y_%m}"
+
+_IS_PARTITIONED = text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.oid = to_regclass(:table)
+    )
+""")
+
+_PARTITIONS = text("""
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = to_regclass(:table)
+""")
+
+def _monthly(names) -> List[Tuple[str, date]]:
+    """(tên, tháng) của các partition theo tháng, cũ nhất trước"""
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+async def ensure_partitions(months_ahead: int, today: Optional[date] = None) -> List[str]:
+    """Tạo partition cho tháng hiện tại và `months_ahead` tháng tới nếu chưa có"""
+    current = month_start(today or date.today())
+    created = []
+    async with async_engine.begin() as conn:
+        if not (await conn.execute(_IS_PARTITIONED, {"table": PARENT_TABLE})).scalar():
+            logger.warning(f"{PARENT_TABLE} is not partitioned yet; run migration 007_attendance_monthly_partitions.sql")
+            return created
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _LOCK_KEY})
+        existing = set((await conn.execute(_PARTITIONS, {"table": PARENT_TABLE})).scalars())
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            await conn.execute(text(
+                f'CREATE TABLE "{name}" PARTITION OF {PARENT_TABLE} '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+    if created:
+        logger.info(f"Created attendance partitions: {', '.join(created)}")
+    return created
+
+def _write_archive(conn, name: str, path: str):
+    """COPY partition ra CSV gzip: ghi file tạm, fsync rồi đổi tên (không bao giờ để lại file dở)"""
+    cursor = conn.connection.cursor()
+    try:
+        with open(path + ".tmp", "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH (FORMAT csv, HEADER)', f)
+            raw.flush()
+            os.fsync(raw.fileno())
+    finally:
+        cursor.close()
+    os.replace(path + ".tmp", path)
+
+def archive_partitions(
+    keep_months: int,
+    archive_dir: str,
+    today: Optional[date] = None,
+    dry_run: bool = False
+) -> List[Tuple[str, int, str]]:
+    """Tách các partition cũ hơn `keep_months` tháng, lưu ra CSV nén gzip rồi xoá.
+
+    Mỗi partition được xử lý trong một transaction, theo thứ tự để bảng cha
+    không bị khoá trong lúc ghi file:
+
+    1. LOCK partition (SHARE): chỉ chặn ghi vào đúng tháng đó (gần như không
+       có với tháng quá hạn lưu trữ), đọc và ghi bảng cha vẫn chạy bình thường
+    2. COPY partition ra file tạm rồi đổi tên; không có thay đổi nào lọt giữa
+       COPY và DROP vì khoá được giữ tới commit
+    3. DETACH + DROP: chỉ bước này cần ACCESS EXCLUSIVE trên attendance_records,
+       giữ trong vài mili giây tới commit; chờ khoá quá
+       ATTENDANCE_ARCHIVE_LOCK_TIMEOUT thì bỏ qua (file đã ghi được ghi đè ở lần chạy sau)
+
+    Lỗi ở bất kỳ bước nào thì rollback và partition vẫn còn nguyên.
+    Trả về danh sách (partition, số dòng, file). Dùng kết nối sync (psycopg2)
+    vì cần COPY ... TO STDOUT.
+    """
+    if keep_months <= 0:
+        raise ValueError("keep_months must be positive")
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with engine.connect() as conn:
+        names = conn.execute(_PARTITIONS, {"table": PARENT_TABLE}).scalars().all()
+    old = [(name, month) for name, month in _monthly(names) if month < cutoff]
+
+    archived = []
+    for name, month in old:
+        path = os.path.join(archive_dir, f"{name}.csv.gz")
+        if dry_run:
+            archived.append((name, 0, path))
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": _LOCK_KEY})
+                conn.execute(text(f'LOCK TABLE "{name}" IN SHARE MODE'))
+                rows = conn.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+                _write_archive(conn, name, path)
+                conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"),
+                             {"timeout": f"{settings.ATTENDANCE_ARCHIVE_LOCK_TIMEOUT_SECONDS * 1000:.0f}"})
+                conn.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"'))
+                conn.execute(text(f'DROP TABLE "{name}"'))
+        except OperationalError as e:
+            if getattr(e.orig, "pgcode", None) != _LOCK_NOT_AVAILABLE:
+                raise
+            logger.warning(f"Skipped partition {name}: {PARENT_TABLE} busy, will retry next run")
+            continue
+        logger.info(f"Archived partition {name} ({rows} rows) to {path}")
+        archived.append((name, rows, path))
+    return archived
+
+async def archived_before(db: AsyncSession) -> Optional[date]:
+    """Tháng đầu tiên còn bản ghi chi tiết, nếu các tháng trước đó đã bị lưu trữ.
+
+    Tháng đã lưu trữ chỉ còn trong attendance_daily_stats (và bitmap), nên
+    rebuild không được tính lại các ngày trước mốc này từ attendance_records.
+    None nếu bảng chưa partition hoặc chưa tháng nào bị lưu trữ.
+    """
+    monthly = _monthly((await db.execute(_PARTITIONS, {"table": PARENT_TABLE})).scalars().all())
+    if not monthly:
+        return None
+    first = monthly[0][1]
+    older_totals = (await db.execute(select(exists().where(DailyStatsModel.date < first)))).scalar()
+    return first if older_totals else None
+
+class AttendancePartitionMaintainer:
+    """Tạo trước partition của các tháng tới khi khởi động và định kỳ sau đó"""
+
+    def __init__(self, months_ahead: int, interval: float = 6 * 3600):
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await ensure_partitions(self.months_ahead)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await ensure_partitions(self.months_ahead)
+            except Exception as e:
+                logger.error(f"Failed to create attendance partitions: {e}")
+
+partition_maintainer = AttendancePartitionMaintainer(settings.ATTENDANCE_PARTITION_MONTHS_AHEAD)
@@ -0,0 +1,186 @@
+import numpy as np
+from sqlalchemy import Date, Integer, String, bindparam, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from app.core.cache import LocalCache
+from app.core.config import settings
+from app.core.database import UnitOfWork
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.database import Student as StudentModel
+from app.models.attendance import AttendanceReport, AttendanceStatus, GradeDayReport, StudentReportRow
+from app.services.attendance_stats_service import STATUS_COLUMNS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Báo cáo theo (date_from, date_to, grade), trong từng process. Process ghi điểm danh xoá các khoảng
+# chứa ngày được ghi, sửa tên/grade học sinh xoá hết; worker khác chỉ hết hạn theo TTL (ngắn)
+report_cache = LocalCache("attendance_reports", ttl=settings.ATTENDANCE_REPORT_CACHE_TTL_SECONDS, max_entries=200)
+
+# Chỉ số cột status trong ma trận đếm (theo STATUS_COLUMNS)
+_ATTENDED = [STATUS_COLUMNS.index(status.value) for status in
+             (AttendanceStatus.PRESENT, AttendanceStatus.LATE, AttendanceStatus.EARLY_LEAVE)]
+
+async def invalidate_report_dates(days: Iterable[date]):
+    """Xoá các báo cáo có khoảng ngày chứa một trong `days` (gọi sau khi commit ghi điểm danh)"""
+    days = set(days)
+    if days:
+        await report_cache.invalidate_matching(lambda key: any(key[0] <= day <= key[1] for day in days))
+
+def _rates(attended: np.ndarray, total: np.ndarray) -> np.ndarray:
+    """attended / total, NaN khi total = 0"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.round(np.where(total > 0, attended / total, np.nan), 4)
+
+def _optional(values: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else value for value in values.tolist()]
+
+class AttendanceReportService:
+    """Báo cáo điểm danh theo khoảng ngày: ma trận grade x ngày và tổng hợp theo học sinh.
+
+    Bản ghi của cả khoảng được đọc bằng một query trả về các cột số dạng
+    mảng (array_agg), chuyển thành mảng NumPy; grade lấy theo học sinh
+    (một query nhỏ). Pivot, tỷ lệ và xếp hạng đều là phép toán vector
+    (bincount, lexsort) thay vì lặp từng bản ghi.
+    """
+
+    GRADE_DAY_FIELDS = ["grade", "date", *STATUS_COLUMNS, "attendance_rate"]
+    STUDENT_FIELDS = list(StudentReportRow.model_fields)
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+
+    async def get_report(self, date_from: date, date_to: date, grade: Optional[str] = None) -> AttendanceReport:
+        """Báo cáo (có cache) cho [date_from, date_to], có thể lọc theo grade"""
+        return await report_cache.get_or_load(
+            (date_from, date_to, grade), lambda: self._build_report(date_from, date_to, grade)
+        )
+
+    async def _load_columns(self, date_from: date, date_to: date, grade: Optional[str]) -> Dict[str, np.ndarray]:
+        """(student_id, ngày, status) của mọi bản ghi trong khoảng, mỗi cột một mảng số"""
+        day = func.date(AttendanceModel.date) - literal(date_from, Date)
+        status = func.array_position(literal(STATUS_COLUMNS, ARRAY(String)), AttendanceModel.status)
+        query = select(
+            func.array_agg(AttendanceModel.student_id),
+            func.array_agg(day),
+            func.array_agg(status),
+        ).where(
+            AttendanceModel.date >= datetime.combine(date_from, time.min),
+            AttendanceModel.date < datetime.combine(date_to + timedelta(days=1), time.min),
+        )
+        if grade:
+            query = query.where(AttendanceModel.student_id.in_(
+                select(StudentModel.id).where(StudentModel.grade == grade)
+            ))
+        student_ids, days, statuses = (await self.db.execute(query)).one()
+        columns = {
+            "student_id": np.array(student_ids or [], dtype=np.int64),
+            "day": np.array(days or [], dtype=np.int64),
+            # array_position đánh số từ 1; status lạ (NULL) bị bỏ
+            "status": np.array([value or 0 for value in statuses or []], dtype=np.int64) - 1,
+        }
+        known = columns["status"] >= 0
+        return {name: values[known] for name, values in columns.items()}
+
+    async def _students(self, student_ids: np.ndarray) -> List[Any]:
+        """(id, student_code, full_name, grade) theo đúng thứ tự của `student_ids`"""
+        if not student_ids.size:
+            return []
+        result = await self.db.execute(
+            select(StudentModel.id, StudentModel.student_code, StudentModel.full_name, StudentModel.grade)
+            .where(StudentModel.id == func.any(bindparam("ids", student_ids.tolist(), type_=ARRAY(Integer))))
+        )
+        by_id = {row.id: row for row in result}
+        return [by_id[student_id] for student_id in student_ids.tolist()]
+
+    async def _build_report(self, date_from: date, date_to: date, grade: Optional[str]) -> AttendanceReport:
+        columns = await self._load_columns(date_from, date_to, grade)
+        day_count = (date_to - date_from).days + 1
+        status_count = len(STATUS_COLUMNS)
+
+        # Tổng hợp theo học sinh: ma trận học sinh x status
+        student_ids, student_index = np.unique(columns["student_id"], return_inverse=True)
+        counts = np.bincount(
+            student_index * status_count + columns["status"], minlength=len(student_ids) * status_count
+        ).reshape(len(student_ids), status_count)
+        totals = counts.sum(axis=1)
+        rates = _rates(counts[:, _ATTENDED].sum(axis=1), totals)
+        students = await self._students(student_ids)
+        grade_names, student_grade = np.unique(
+            np.array([student.grade for student in students], dtype=object).astype(str), return_inverse=True
+        )
+
+        # Pivot grade x ngày x status bằng một lần bincount trên chỉ số phẳng
+        grade_index = student_grade[student_index]
+        flat = (grade_index * day_count + columns["day"]) * status_count + columns["status"]
+        pivot = np.bincount(flat, minlength=len(grade_names) * day_count * status_count).reshape(
+            len(grade_names), day_count, status_count
+        )
+        day_rates = _rates(pivot[:, :, _ATTENDED].sum(axis=2), pivot.sum(axis=2))
+        overall_rates = _rates(pivot[:, :, _ATTENDED].sum(axis=(1, 2)), pivot.sum(axis=(1, 2)))
+
+        # Xếp hạng trong grade theo tỷ lệ giảm dần; tỷ lệ bằng nhau cùng hạng (1, 2, 2, 4)
+        order = np.lexsort((student_ids, -rates, student_grade))
+        sorted_grade, sorted_rate = student_grade[order], rates[order]
+        position = np.arange(len(order))
+        group_start = np.maximum.accumulate(np.where(
+            np.r_[True, sorted_grade[1:] != sorted_grade[:-1]], position, 0
+        ))
+        tie_start = np.maximum.accumulate(np.where(
+            np.r_[True, (sorted_grade[1:] != sorted_grade[:-1]) | (sorted_rate[1:] != sorted_rate[:-1])], position, 0
+        ))
+        ranks = tie_start - group_start + 1
+
+        ordered_counts = counts[order].tolist()
+        student_rows = [
+            StudentReportRow(
+                student_id=student.id,
+                student_code=student.student_code,
+                full_name=student.full_name,
+                grade=student.grade,
+                days=sum(row_counts),
+                attendance_rate=rate,
+                rank=rank,
+                **dict(zip(STATUS_COLUMNS, row_counts)),
+            )
+            for student, row_counts, rate, rank in zip(
+                (students[index] for index in order.tolist()), ordered_counts, rates[order].tolist(), ranks.tolist()
+            )
+        ]
+
+        return AttendanceReport(
+            date_from=date_from,
+            date_to=date_to,
+            grade=grade,
+            days=[date_from + timedelta(days=offset) for offset in range(day_count)],
+            grades=[
+                GradeDayReport(
+                    grade=name,
+                    attendance_rate=_optional(day_rates[index]),
+                    overall_rate=_optional(overall_rates[index:index + 1])[0],
+                    **{column: pivot[index, :, position].tolist() for position, column in enumerate(STATUS_COLUMNS)},
+                )
+                for index, name in enumerate(grade_names.tolist())
+            ],
+            students=student_rows,
+        )
+
+    @staticmethod
+    def grade_day_rows(report: AttendanceReport) -> List[dict]:
+        """Ma trận grade x ngày dạng bảng dài (một dòng mỗi grade mỗi ngày) cho CSV/NDJSON"""
+        return [
+            {
+                "grade": row.grade,
+                "date": day,
+                **{column: getattr(row, column)[index] for column in STATUS_COLUMNS},
+                "attendance_rate": row.attendance_rate[index],
+            }
+            for row in report.grades
+            for index, day in enumerate(report.days)
+        ]
+
+    @staticmethod
+    def student_rows(report: AttendanceReport) -> List[dict]:
+        return [row.model_dump() for row in report.students]
@@ -0,0 +1,110 @@
+from sqlalchemy import select
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+from app.core.config import settings
+from app.core.database import UnitOfWork
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.pagination import paginate, split_page
+from app.models.attendance import AttendanceResponse, AttendanceStatus
+import logging
+
+logger = logging.getLogger(__name__)
+
+class AttendanceService:
+    """Service class for attendance operations"""
+
+    # Newest first; id breaks ties between records of the same day
+    SORT_KEYS = {
+        "date": (AttendanceModel.date, AttendanceModel.id),
+    }
+
+    # Response columns only (no ORM entities, no re-validation)
+    RESPONSE_COLUMNS = [
+        AttendanceModel.id,
+        AttendanceModel.student_id,
+        AttendanceModel.date,
+        AttendanceModel.check_in_time,
+        AttendanceModel.check_out_time,
+        AttendanceModel.status,
+        AttendanceModel.location,
+        AttendanceModel.device_id,
+        AttendanceModel.created_at,
+        AttendanceModel.updated_at,
+    ]
+
+    EXPORT_FIELDS = [column.key for column in RESPONSE_COLUMNS]
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+
+    @staticmethod
+    def _filter(query, student_id: Optional[int], date_from: Optional[date], date_to: Optional[date]):
+        if student_id is not None:
+            query = query.where(AttendanceModel.student_id == student_id)
+        if date_from:
+            query = query.where(AttendanceModel.date >= datetime.combine(date_from, time.min))
+        if date_to:
+            query = query.where(AttendanceModel.date < datetime.combine(date_to + timedelta(days=1), time.min))
+        return query
+
+    async def get_attendance_records_page(
+        self,
+        student_id: Optional[int] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        sort: str = "date"
+    ) -> Tuple[List[AttendanceResponse], Optional[str]]:
+        """Get one page of attendance records (newest first) and the next page cursor"""
+        db = self.db
+        try:
+            query = self._filter(select(*self.RESPONSE_COLUMNS), student_id, date_from, date_to)
+
+            columns = self.SORT_KEYS[sort]
+            rows = (await db.execute(
+                paginate(query, sort, columns, limit, cursor=cursor, skip=skip, descending=True)
+            )).all()
+            records, next_cursor = split_page(rows, sort, [column.key for column in columns], limit)
+
+            return [
+                AttendanceResponse.model_construct(
+                    id=row.id,
+                    student_id=row.student_id,
+                    date=row.date.date(),
+                    check_in_time=row.check_in_time,
+                    check_out_time=row.check_out_time,
+                    status=AttendanceStatus(row.status),
+                    location=row.location,
+                    device_id=row.device_id,
+                    created_at=row.created_at,
+                    updated_at=row.updated_at,
+                )
+                for row in records
+            ], next_cursor
+
+        except Exception as e:
+            logger.error(f"Error fetching attendance records: {e}")
+            raise
+
+    async def stream_attendance_records(
+        self,
+        student_id: Optional[int] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        batch_size: int = settings.EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[List[dict]]:
+        """Stream attendance records theo (date, id) qua server-side cursor, từng batch"""
+        query = self._filter(select(*self.RESPONSE_COLUMNS), student_id, date_from, date_to)
+        query = query.order_by(AttendanceModel.date, AttendanceModel.id)
+
+        result = await self.db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.mappings().partitions():
+            batch = []
+            for row in partition:
+                record = dict(row)
+                record["date"] = row["date"].date()
+                batch.append(record)
+            yield batch
@@ -0,0 +1,167 @@
+from sqlalchemy import and_, delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from app.core.database import UnitOfWork
+from app.core.database import AttendanceDailyStats as DailyStatsModel
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.database import Student as StudentModel
+from app.models.attendance import AttendanceStats, AttendanceStatus
+from app.services.attendance_partitions import archived_before
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cột đếm của attendance_daily_stats, trùng tên với giá trị status
+STATUS_COLUMNS = [status.value for status in AttendanceStatus]
+
+# (student_id, ngày, status cũ hoặc None nếu dòng mới, status mới)
+StatusChange = Tuple[int, date, Optional[str], str]
+
+class AttendanceStatsService:
+    """Thống kê điểm danh từ bảng tổng hợp attendance_daily_stats.
+
+    Mỗi khi attendance_records được ghi, apply_changes() cộng/trừ số đếm
+    của (ngày, grade) trong cùng transaction, nên thống kê một khoảng ngày
+    chỉ là SUM trên vài dòng theo primary key. rebuild() tính lại từ đầu
+    khi số liệu bị lệch (vd. học sinh đổi grade).
+    """
+
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+
+    async def apply_changes(self, changes: Iterable[StatusChange]) -> List[dict]:
+        """Cập nhật bảng tổng hợp theo các thay đổi status.
+
+        Trả về delta đã cộng vào bảng: mỗi (ngày, grade) bị ảnh hưởng một dict
+        {"date", "grade", <status>: số thay đổi}.
+        """
+        changes = [change for change in changes if change[2] != change[3]]
+        if not changes:
+            return []
+
+        student_ids = {student_id for student_id, _, _, _ in changes}
+        grades = dict((await self.db.execute(
+            select(StudentModel.id, StudentModel.grade).where(StudentModel.id.in_(student_ids))
+        )).all())
+
+        deltas: Dict[Tuple[date, str], Dict[str, int]] = {}
+        for student_id, day, old_status, new_status in changes:
+            grade = grades.get(student_id)
+            if grade is None:
+                continue
+            counts = deltas.setdefault((day, grade), dict.fromkeys(STATUS_COLUMNS, 0))
+            if old_status in counts:
+                counts[old_status] -= 1
+            if new_status in counts:
+                counts[new_status] += 1
+
+        if not deltas:
+            return []
+
+        # Sắp xếp theo khoá để các transaction đồng thời khoá dòng theo cùng thứ tự
+        rows = [{"date": day, "grade": grade, **counts} for (day, grade), counts in sorted(deltas.items())]
+        stmt = pg_insert(DailyStatsModel).values(rows)
+        existing = DailyStatsModel.__table__.c
+        await self.db.execute(stmt.on_conflict_do_update(
+            index_elements=[DailyStatsModel.date, DailyStatsModel.grade],
+            set_={
+                **{column: existing[column] + stmt.excluded[column] for column in STATUS_COLUMNS},
+                "updated_at": func.now(),
+            },
+        ))
+        return rows
+
+    async def get_day_counts(self, day: date) -> Dict[str, Dict[str, int]]:
+        """Số bản ghi theo status của từng grade trong một ngày"""
+        result = await self.db.execute(
+            select(DailyStatsModel.grade, *[DailyStatsModel.__table__.c[column] for column in STATUS_COLUMNS])
+            .where(DailyStatsModel.date == day)
+            .order_by(DailyStatsModel.grade)
+        )
+        return {row[0]: dict(zip(STATUS_COLUMNS, row[1:])) for row in result}
+
+    async def rebuild(self, date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+        """Tính lại bảng tổng hợp từ attendance_records (cả bảng hoặc một khoảng ngày).
+
+        Tháng đã lưu trữ (scripts/archive_attendance.py) không còn bản ghi chi tiết,
+        nên mặc định bắt đầu từ partition cũ nhất còn gắn và báo lỗi nếu
+        date_from rơi vào tháng đã lưu trữ, để không xoá mất tổng của các tháng đó.
+        """
+        archived = await archived_before(self.db)
+        if archived:
+            if date_from is None:
+                date_from = archived
+            elif date_from < archived:
+                raise ValueError(
+                    f"Months before {archived} are archived; their totals cannot be rebuilt from attendance_records"
+                )
+
+        day = func.date(AttendanceModel.date)
+        query = (
+            select(
+                day,
+                StudentModel.grade,
+                *[func.count().filter(AttendanceModel.status == column) for column in STATUS_COLUMNS],
+            )
+            .join(StudentModel, StudentModel.id == AttendanceModel.student_id)
+            .group_by(day, StudentModel.grade)
+        )
+        clear = delete(DailyStatsModel)
+        if date_from:
+            query = query.where(AttendanceModel.date >= datetime.combine(date_from, time.min))
+            clear = clear.where(DailyStatsModel.date >= date_from)
+        if date_to:
+            query = query.where(AttendanceModel.date < datetime.combine(date_to + timedelta(days=1), time.min))
+            clear = clear.where(DailyStatsModel.date <= date_to)
+
+        await self.db.execute(clear)
+        result = await self.db.execute(
+            insert(DailyStatsModel).from_select(["date", "grade", *STATUS_COLUMNS], query)
+        )
+        return result.rowcount
+
+    async def get_stats(
+        self,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        grade: Optional[str] = None
+    ) -> AttendanceStats:
+        """Thống kê cho một khoảng ngày (mặc định hôm nay), có thể lọc theo grade.
+
+        Số vắng = max(số bản ghi vắng, số lượt dự kiến - có mặt - đi muộn - có phép),
+        với số lượt dự kiến = số học sinh đang học x số ngày có dữ liệu, để
+        học sinh chưa check-in trong ngày cũng được tính là vắng.
+        """
+        date_from = date_from or date.today()
+        date_to = date_to or date_from
+
+        conditions = [DailyStatsModel.date >= date_from, DailyStatsModel.date <= date_to]
+        if grade:
+            conditions.append(DailyStatsModel.grade == grade)
+        totals = (await self.db.execute(
+            select(
+                func.coalesce(func.sum(DailyStatsModel.present + DailyStatsModel.early_leave), 0),
+                func.coalesce(func.sum(DailyStatsModel.late), 0),
+                func.coalesce(func.sum(DailyStatsModel.absent), 0),
+                func.coalesce(func.sum(DailyStatsModel.excused), 0),
+                func.count(func.distinct(DailyStatsModel.date)),
+            ).where(and_(*conditions))
+        )).one()
+        present, late, absent, excused, days = (int(value) for value in totals)
+
+        students = select(func.count()).select_from(StudentModel).where(StudentModel.is_active == True)
+        if grade:
+            students = students.where(StudentModel.grade == grade)
+        total_students = (await self.db.execute(students)).scalar() or 0
+
+        expected = total_students * max(days, 1)
+        absent = max(absent, expected - present - late - excused)
+        return AttendanceStats(
+            total_students=total_students,
+            present_today=present,
+            absent_today=absent,
+            late_today=late,
+            attendance_rate=round((present + late) / expected, 4) if expected else 0.0,
+        )
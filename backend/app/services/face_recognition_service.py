@@ -1,18 +1,24 @@
 import cv2
 import numpy as np
 import os
+import uuid
 import logging
-from typing import Optional, List
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional, List, Dict, Tuple, Iterator
+from sqlalchemy.orm import Session
 from app.models.face_recognition import FaceRegistrationRequest, FaceRegistrationResponse
 from app.core.config import settings
+from app.core.database import FaceEmbedding, Student
+from app.core.model_pool import ModelPool, resolve_pool_size
 
 logger = logging.getLogger(__name__)
 
-class FaceRecognitionService:
-    """Service cho face recognition và ML sử dụng real models"""
+class FaceModels:
+    """Một bộ detector + recognizer; OpenCV models không an toàn khi dùng chung giữa các thread"""
     
     def __init__(self):
-        self.logger = logging.getLogger(__name__)
         self.face_detector = None
         self.face_recognizer = None
         self._initialize_models()
@@ -31,10 +37,10 @@ class FaceRecognitionService:
             # if os.path.exists(settings.FACE_RECOGNITION_MODEL_PATH):
             #     self.face_recognizer = cv2.dnn.readNetFromONNX(settings.FACE_RECOGNITION_MODEL_PATH)
             
-            self.logger.info("ML models initialized successfully")
+            logger.info("ML models initialized successfully")
             
         except Exception as e:
-            self.logger.error(f"Failed to initialize ML models: {e}")
+            logger.error(f"Failed to initialize ML models: {e}")
             # Fallback to basic OpenCV
             self._initialize_fallback_models()
     
@@ -44,9 +50,73 @@ class FaceRecognitionService:
             self.face_detector = cv2.CascadeClassifier(
                 cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
             )
-            self.logger.info("Fallback models initialized")
+            logger.info("Fallback models initialized")
         except Exception as e:
-            self.logger.error(f"Failed to initialize fallback models: {e}")
+            logger.error(f"Failed to initialize fallback models: {e}")
+
+# Pool dùng chung trong process: mỗi task detect/embedding mượn một bộ model riêng
+face_model_pool = ModelPool(
+    FaceModels,
+    size=resolve_pool_size(settings.FACE_MODEL_POOL_SIZE),
+    timeout=settings.FACE_MODEL_POOL_TIMEOUT_SECONDS
+)
+
+class FaceGallery:
+    """Ma trận template của mọi học sinh đã đăng ký, dùng chung trong process.
+
+    Template (trung bình embedding đã chuẩn hóa, chuẩn hóa lại) được xây một
+    lần theo từng số chiều embedding, nên mỗi lần nhận diện chỉ còn một phép
+    nhân ma trận. invalidate() được gọi sau khi enroll/xóa/dedupe commit;
+    thay đổi từ process khác được thấy sau tối đa `ttl` giây.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()  # Service chạy trong thread pool
+        self._index: Optional[Dict[int, Tuple[np.ndarray, np.ndarray]]] = None
+        self._built_at = 0.0
+        self._builds = 0
+        self._invalidations = 0
+
+    def get(self, build: Callable[[], Dict[int, Tuple[np.ndarray, np.ndarray]]]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """{số chiều: (student_ids, templates)}; build() chạy khi chưa có hoặc đã hết hạn"""
+        with self._lock:
+            if self._index is None or time.monotonic() - self._built_at > self.ttl:
+                self._index = build()
+                self._built_at = time.monotonic()
+                self._builds += 1
+            return self._index
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+            self._invalidations += 1
+
+    def stats(self) -> dict:
+        index = self._index or {}
+        return {
+            "students": sum(len(student_ids) for student_ids, _ in index.values()),
+            "builds": self._builds,
+            "invalidations": self._invalidations,
+            "age_seconds": round(time.monotonic() - self._built_at, 1) if self._index is not None else None,
+        }
+
+face_gallery = FaceGallery(ttl=settings.FACE_GALLERY_CACHE_TTL_SECONDS)
+
+_HASH_MASK = (1 << 64) - 1
+
+def _signed_hash(value: int) -> int:
+    """Hash 64 bit unsigned -> signed để lưu vào cột BIGINT (đọc lại bằng `& _HASH_MASK`)"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+class FaceRecognitionService:
+    """Service cho face recognition và ML sử dụng real models"""
+    
+    def __init__(self, db: Optional[Session] = None):
+        self.logger = logging.getLogger(__name__)
+        self.db = db
+        self.model_pool = face_model_pool
+        self.gallery = face_gallery
     
     async def register_face(self, request: FaceRegistrationRequest, image_path: str) -> FaceRegistrationResponse:
         """Đăng ký khuôn mặt cho student với real ML"""
@@ -154,17 +224,366 @@ class FaceRecognitionService:
             self.logger.error(f"Face comparison failed: {e}")
             raise Exception(f"Face comparison failed: {str(e)}")
     
-    def _detect_faces(self, image: np.ndarray) -> List[dict]:
+    def enroll_faces(self, student_id: int, uploads: List[Tuple[str, bytes]], save_dir: str) -> dict:
+        """Đăng ký nhiều ảnh khuôn mặt, bỏ qua ảnh gần trùng lặp.
+
+        Ảnh trùng perceptual hash (với gallery hoặc ảnh khác trong batch) bị
+        loại trước khi detect/embedding; ảnh có embedding quá gần embedding đã
+        có cũng bị loại. Chỉ ảnh được chấp nhận mới được lưu file và ghi
+        vào face_embeddings.
+        """
+        gallery = self.get_student_embeddings(student_id)
+        known_hashes = [image_hash for image_hash in self._gallery_hashes(gallery) if image_hash is not None]
+        known_vectors = [
+            self._normalize_rows(np.asarray([emb.embedding_vector], dtype=np.float32))[0]
+            for emb in gallery
+        ]
+
+        os.makedirs(save_dir, exist_ok=True)
+        saved_embeddings = []
+        confidence_scores = []
+        image_paths = []
+        skipped: Dict[str, str] = {}
+
+        for name, data in uploads:
+            image = self._decode_image(data)
+            if image is None:
+                skipped[name] = "Failed to decode image"
+                continue
+
+            # 1. Perceptual hash: loại ảnh gần trùng trước khi tốn công embedding
+            image_hash = self._perceptual_hash(image)
+            if any((image_hash ^ known).bit_count() <= settings.FACE_DEDUP_HASH_DISTANCE for known in known_hashes):
+                skipped[name] = "Near-duplicate image"
+                continue
+            known_hashes.append(image_hash)
+
+            faces = self._detect_faces(image)
+            if not faces:
+                skipped[name] = "No face detected"
+                continue
+            embedding = self._extract_face_embedding(image, faces[0])
+            if embedding is None:
+                skipped[name] = "Failed to extract face features"
+                continue
+
+            # 2. Khoảng cách embedding: loại ảnh không thêm thông tin nhận diện
+            normalized = self._normalize_rows(embedding[np.newaxis, :].astype(np.float32))[0]
+            same_dimension = [v for v in known_vectors if v.shape == normalized.shape]
+            if same_dimension and float(np.max(np.stack(same_dimension) @ normalized)) >= settings.FACE_DEDUP_EMBEDDING_SIMILARITY:
+                skipped[name] = "Near-duplicate face embedding"
+                continue
+            known_vectors.append(normalized)
+
+            ext = os.path.splitext(name)[1].lower() or ".jpg"
+            image_path = os.path.join(save_dir, f"student_{student_id}_{uuid.uuid4().hex}{ext}")
+            with open(image_path, "wb") as buffer:
+                buffer.write(data)
+
+            confidence_score = self._validate_face_quality(image, faces[0])
+            saved_embeddings.append(
+                self._store_face_embedding(student_id, embedding, confidence_score, image_path, image_hash)
+            )
+            confidence_scores.append(confidence_score)
+            image_paths.append(image_path)
+
+        # Commit cả các hash vừa được backfill cho embedding cũ
+        self.db.commit()
+        if saved_embeddings:
+            self.gallery.invalidate()
+        self.logger.info(
+            f"Enrolled {len(saved_embeddings)} faces for student {student_id}, skipped {len(skipped)}"
+        )
+
+        return {
+            "embeddings": saved_embeddings,
+            "confidence_scores": confidence_scores,
+            "image_paths": image_paths,
+            "skipped": skipped
+        }
+
+    def dedupe_gallery(self, student_id: Optional[int] = None, apply: bool = False) -> dict:
+        """Báo cáo (và tùy chọn xóa) embedding gần trùng trong gallery hiện có.
+
+        Với mỗi học sinh, giữ embedding có confidence cao nhất trong mỗi nhóm
+        gần trùng (theo perceptual hash của file ảnh hoặc cosine similarity).
+        """
+        query = self.db.query(FaceEmbedding)
+        if student_id is not None:
+            query = query.filter(FaceEmbedding.student_id == student_id)
+        embeddings = query.order_by(FaceEmbedding.student_id, FaceEmbedding.id).all()
+
+        galleries: Dict[int, List[FaceEmbedding]] = {}
+        for emb in embeddings:
+            galleries.setdefault(emb.student_id, []).append(emb)
+
+        duplicates = []
+        for gallery_student_id, gallery in galleries.items():
+            gallery.sort(key=lambda emb: (-(emb.confidence_score or 0.0), emb.id))
+            hashes = self._gallery_hashes(gallery)
+
+            dimension = Counter(len(emb.embedding_vector) for emb in gallery).most_common(1)[0][0]
+            comparable = [i for i, emb in enumerate(gallery) if len(emb.embedding_vector) == dimension]
+            vectors = self._normalize_rows(
+                np.asarray([gallery[i].embedding_vector for i in comparable], dtype=np.float32)
+            )
+            similarities = np.full((len(gallery), len(gallery)), -1.0, dtype=np.float32)
+            similarities[np.ix_(comparable, comparable)] = vectors @ vectors.T
+
+            kept: List[int] = []
+            for i, emb in enumerate(gallery):
+                match = None
+                for k in kept:
+                    if hashes[i] is not None and hashes[k] is not None and \
+                            (hashes[i] ^ hashes[k]).bit_count() <= settings.FACE_DEDUP_HASH_DISTANCE:
+                        match = (k, "Near-duplicate image")
+                        break
+                    if similarities[i, k] >= settings.FACE_DEDUP_EMBEDDING_SIMILARITY:
+                        match = (k, "Near-duplicate face embedding")
+                        break
+                if match is None:
+                    kept.append(i)
+                    continue
+                k, reason = match
+                duplicates.append({
+                    "embedding_id": emb.id,
+                    "student_id": gallery_student_id,
+                    "duplicate_of": gallery[k].id,
+                    "reason": reason,
+                    "similarity": float(similarities[i, k])
+                })
+
+        removed = 0
+        if apply and duplicates:
+            removed = self.db.query(FaceEmbedding).filter(
+                FaceEmbedding.id.in_([d["embedding_id"] for d in duplicates])
+            ).delete(synchronize_session=False)
+        self.db.commit()
+        if removed:
+            self.gallery.invalidate()
+
+        return {
+            "students_scanned": len(galleries),
+            "embeddings_scanned": len(embeddings),
+            "duplicates": duplicates,
+            "removed": removed
+        }
+
+    def get_student_embeddings(self, student_id: int) -> List[FaceEmbedding]:
+        """Lấy các face embedding đã lưu của học sinh"""
+        if self.db is None:
+            return []
+        return self.db.query(FaceEmbedding).filter(
+            FaceEmbedding.student_id == student_id
+        ).order_by(FaceEmbedding.id).all()
+
+    def delete_embedding(self, embedding_id: int) -> bool:
+        """Xóa một face embedding"""
+        deleted = self.db.query(FaceEmbedding).filter(FaceEmbedding.id == embedding_id).delete()
+        self.db.commit()
+        if deleted:
+            self.gallery.invalidate()
+        return deleted > 0
+
+    def build_similarity_inputs(
+        self,
+        uploads: List[Tuple[str, bytes]],
+        student_ids: List[int],
+        target_student_ids: Optional[List[int]] = None
+    ) -> Tuple[List[str], np.ndarray, List[str], np.ndarray, Dict[str, str]]:
+        """Chuẩn bị ma trận embedding cho so sánh 1:N / N:M.
+
+        Ảnh upload được decode trong bộ nhớ; học sinh dùng embedding đã lưu
+        (fallback sang photo_path nếu chưa có). Khi không truyền
+        target_student_ids, tập target chính là tập query (so sánh N:N).
+        """
+        skipped: Dict[str, str] = {}
+        vectors: Dict[str, np.ndarray] = {}
+
+        for name, data in uploads:
+            label = f"upload:{name}"
+            image = self._decode_image(data)
+            if image is None:
+                skipped[label] = "Failed to decode image"
+                continue
+            embedding = self._embed_image(image)
+            if embedding is None:
+                skipped[label] = "No face detected"
+                continue
+            vectors[label] = embedding
+
+        all_student_ids = list(dict.fromkeys(student_ids + (target_student_ids or [])))
+        templates = self._load_student_templates(all_student_ids)
+        for student_id in all_student_ids:
+            label = f"student:{student_id}"
+            if student_id in templates:
+                vectors[label] = templates[student_id]
+            else:
+                skipped[label] = "No stored embedding or usable photo"
+
+        # Loại các vector khác số chiều (embedding cũ từ model khác)
+        if vectors:
+            dimension = Counter(v.shape[0] for v in vectors.values()).most_common(1)[0][0]
+            for label in [label for label, v in vectors.items() if v.shape[0] != dimension]:
+                skipped[label] = "Embedding dimension mismatch"
+                del vectors[label]
+
+        row_labels = [f"upload:{name}" for name, _ in uploads]
+        row_labels += [f"student:{student_id}" for student_id in student_ids]
+        row_labels = [label for label in dict.fromkeys(row_labels) if label in vectors]
+        if target_student_ids is None:
+            column_labels = row_labels
+        else:
+            column_labels = [
+                f"student:{student_id}" for student_id in dict.fromkeys(target_student_ids)
+                if f"student:{student_id}" in vectors
+            ]
+
+        rows = self._stack(vectors, row_labels)
+        columns = self._stack(vectors, column_labels)
+        return row_labels, rows, column_labels, columns, skipped
+
+    def similarity_matrix(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """Cosine similarity của mọi cặp (row, column) trong một phép nhân ma trận"""
+        return self._normalize_rows(rows) @ self._normalize_rows(columns).T
+
+    def iter_similarity_rows(
+        self,
+        rows: np.ndarray,
+        columns: np.ndarray,
+        block_size: int = 256
+    ) -> Iterator[np.ndarray]:
+        """Tính ma trận similarity theo từng block hàng để stream kết quả lớn"""
+        normalized_columns = self._normalize_rows(columns).T
+        for start in range(0, rows.shape[0], block_size):
+            block = self._normalize_rows(rows[start:start + block_size]) @ normalized_columns
+            for row in block:
+                yield row
+
+    def _perceptual_hash(self, image: np.ndarray) -> int:
+        """Difference hash 64 bit: ảnh gần giống nhau có Hamming distance nhỏ"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+    def _gallery_hashes(self, gallery: List[FaceEmbedding]) -> List[Optional[int]]:
+        """Perceptual hash đã lưu của từng embedding (unsigned).
+
+        Embedding cũ chưa có image_hash được tính một lần từ image_path và gán
+        vào row (caller commit); ảnh không đọc được cho None.
+        """
+        hashes: List[Optional[int]] = []
+        for emb in gallery:
+            if emb.image_hash is None:
+                image = cv2.imread(emb.image_path) if emb.image_path and os.path.exists(emb.image_path) else None
+                if image is None:
+                    hashes.append(None)
+                    continue
+                emb.image_hash = _signed_hash(self._perceptual_hash(image))
+            hashes.append(emb.image_hash & _HASH_MASK)
+        return hashes
+
+    def _decode_image(self, data: bytes) -> Optional[np.ndarray]:
+        """Decode ảnh từ bytes upload (không ghi ra đĩa)"""
+        if not data:
+            return None
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def _embed_image(self, image: np.ndarray) -> Optional[np.ndarray]:
+        """Detect khuôn mặt đầu tiên và trích xuất embedding"""
+        with self.model_pool.checkout() as models:
+            faces = self._detect_faces(image, models)
+            if not faces:
+                return None
+            return self._extract_face_embedding(image, faces[0])
+
+    def _load_student_templates(self, student_ids: List[int]) -> Dict[int, np.ndarray]:
+        """Lấy embedding đại diện cho mỗi học sinh.
+
+        Dùng trung bình các embedding đã lưu trong face_embeddings (một query
+        cho cả danh sách); học sinh chưa có embedding thì tính từ photo_path.
+        """
+        if not student_ids or self.db is None:
+            return {}
+
+        templates = self._stored_templates(student_ids)
+
+        missing = [student_id for student_id in student_ids if student_id not in templates]
+        if missing:
+            photos = self.db.query(Student.id, Student.photo_path).filter(
+                Student.id.in_(missing),
+                Student.photo_path.isnot(None)
+            ).all()
+            for student_id, photo_path in photos:
+                image = cv2.imread(photo_path) if os.path.exists(photo_path) else None
+                if image is None:
+                    continue
+                embedding = self._embed_image(image)
+                if embedding is not None:
+                    templates[student_id] = embedding.astype(np.float32)
+
+        return templates
+
+    def _stored_templates(self, student_ids: Optional[List[int]] = None) -> Dict[int, np.ndarray]:
+        """Trung bình các embedding đã chuẩn hóa của mỗi học sinh (None = mọi học sinh).
+
+        Học sinh có embedding khác số chiều nhau (model cũ) bị bỏ qua.
+        """
+        query = self.db.query(FaceEmbedding.student_id, FaceEmbedding.embedding_vector)
+        if student_ids is not None:
+            query = query.filter(FaceEmbedding.student_id.in_(student_ids))
+        stored: Dict[int, List[np.ndarray]] = {}
+        for student_id, vector in query.all():
+            stored.setdefault(student_id, []).append(np.asarray(vector, dtype=np.float32))
+
+        templates: Dict[int, np.ndarray] = {}
+        for student_id, student_vectors in stored.items():
+            if len({v.shape[0] for v in student_vectors}) != 1:
+                continue
+            templates[student_id] = self._normalize_rows(np.stack(student_vectors)).mean(axis=0)
+        return templates
+
+    def _build_gallery(self) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Template của cả gallery, nhóm theo số chiều, mỗi hàng đã chuẩn hóa L2"""
+        by_dimension: Dict[int, Dict[int, np.ndarray]] = {}
+        for student_id, template in self._stored_templates().items():
+            by_dimension.setdefault(template.shape[0], {})[student_id] = template
+        return {
+            dimension: (
+                np.array(list(templates), dtype=np.int64),
+                self._normalize_rows(np.stack(list(templates.values())).astype(np.float32)),
+            )
+            for dimension, templates in by_dimension.items()
+        }
+
+    def _stack(self, vectors: Dict[str, np.ndarray], labels: List[str]) -> np.ndarray:
+        """Ghép các vector theo thứ tự labels thành ma trận (n, d)"""
+        if not labels:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[label] for label in labels]).astype(np.float32)
+
+    def _normalize_rows(self, matrix: np.ndarray) -> np.ndarray:
+        """Chuẩn hóa L2 từng hàng (hàng toàn 0 giữ nguyên)"""
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def _detect_faces(self, image: np.ndarray, models: Optional[FaceModels] = None) -> List[dict]:
         """Phát hiện khuôn mặt trong ảnh"""
         try:
-            if self.face_detector is None:
+            if models is None:
+                with self.model_pool.checkout() as pooled_models:
+                    return self._detect_faces(image, pooled_models)
+            
+            if models.face_detector is None:
                 return []
             
             # Convert to grayscale
             gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
             
             # Detect faces
-            faces = self.face_detector.detectMultiScale(
+            faces = models.face_detector.detectMultiScale(
                 gray, 
                 scaleFactor=1.1, 
                 minNeighbors=5,
@@ -269,24 +688,57 @@ class FaceRecognitionService:
             self.logger.error(f"Cosine similarity calculation failed: {e}")
             return 0.0
     
-    def _store_face_embedding(self, student_id: int, embedding: np.ndarray, confidence: float):
-        """Lưu face embedding vào database"""
-        try:
-            # TODO: Implement database storage
-            # This should save to FaceEmbedding table
-            self.logger.info(f"Storing face embedding for student {student_id}")
-            
-        except Exception as e:
-            self.logger.error(f"Failed to store face embedding: {e}")
+    def _store_face_embedding(
+        self,
+        student_id: int,
+        embedding: np.ndarray,
+        confidence: float,
+        image_path: Optional[str] = None,
+        image_hash: Optional[int] = None
+    ) -> FaceEmbedding:
+        """Lưu face embedding vào database (caller chịu trách nhiệm commit)"""
+        self.logger.info(f"Storing face embedding for student {student_id}")
+        face_embedding = FaceEmbedding(
+            student_id=student_id,
+            embedding_vector=embedding.astype(float).tolist(),
+            image_path=image_path,
+            image_hash=_signed_hash(image_hash) if image_hash is not None else None,
+            confidence_score=confidence
+        )
+        self.db.add(face_embedding)
+        self.db.flush()
+        return face_embedding
     
-    def _find_best_match(self, query_embedding: np.ndarray):
-        """Tìm khuôn mặt tương đồng nhất trong database"""
-        try:
-            # TODO: Implement database search
-            # This should search FaceEmbedding table
-            self.logger.info("Searching for best face match")
-            return None
-            
-        except Exception as e:
-            self.logger.error(f"Best match search failed: {e}")
+    def identify(self, data: bytes) -> dict:
+        """Nhận diện ảnh upload (decode trong bộ nhớ) so với gallery đã đăng ký.
+
+        `student_found` chỉ True khi độ tương đồng đạt FACE_RECOGNITION_THRESHOLD;
+        confidence_score luôn là điểm của học sinh gần nhất (0 nếu không có mặt).
+        """
+        result = {"student_found": False, "student_id": None, "student_name": None, "confidence_score": 0.0}
+        image = self._decode_image(data)
+        if image is None:
+            raise ValueError("Failed to decode image")
+        embedding = self._embed_image(image)
+        if embedding is None:
+            return result
+        match = self._find_best_match(embedding)
+        if match is None:
+            return result
+        student_id, score = match
+        result["confidence_score"] = score
+        if score >= settings.FACE_RECOGNITION_THRESHOLD:
+            student = self.db.query(Student.full_name).filter(Student.id == student_id).first()
+            result.update(student_found=student is not None, student_id=student_id,
+                          student_name=student.full_name if student else None)
+        return result
+
+    def _find_best_match(self, query_embedding: np.ndarray) -> Optional[Tuple[int, float]]:
+        """(student_id, cosine similarity) của học sinh gần nhất trong gallery (cache face_gallery)"""
+        entry = self.gallery.get(self._build_gallery).get(query_embedding.shape[0])
+        if entry is None:
             return None
+        student_ids, templates = entry
+        scores = templates @ self._normalize_rows(query_embedding[np.newaxis, :].astype(np.float32))[0]
+        best = int(np.argmax(scores))
+        return int(student_ids[best]), float(scores[best])
@@ -1,27 +1,51 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from typing import List, Optional
-from app.core.database import SessionLocal
+from sqlalchemy import and_, select, func
+from typing import Any, Awaitable, Callable, Hashable, List, Optional, Tuple
+from app.core.cache import LocalCache
+from app.core.config import settings
+from app.core.database import UnitOfWork
+from app.core.pagination import paginate, split_page
 from app.models.grade import GradeCreate, GradeUpdate, GradeResponse
 from app.core.database import Grade as GradeModel
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Grades rarely change: reads are cached per process and dropped on any write
+grade_cache = LocalCache("grades", ttl=settings.GRADE_CACHE_TTL_SECONDS)
+
 class GradeService:
     """Service class for grade management operations"""
     
-    def __init__(self):
-        pass
+    # Sort keys for listing (name is unique)
+    SORT_KEYS = {
+        "name": (GradeModel.name,),
+        "id": (GradeModel.id,),
+    }
+    
+    # List queries select only the response columns (no ORM entities, no re-validation)
+    RESPONSE_COLUMNS = [getattr(GradeModel, name) for name in GradeResponse.model_fields]
+    
+    def __init__(self, uow: UnitOfWork):
+        self.uow = uow
+        self.db = uow.session
+    
+    async def _cached(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Serve read-only requests from grade_cache; writes always see the DB"""
+        if not self.uow.read_only:
+            return await loader()
+        return await grade_cache.get_or_load(key, loader)
+    
+    def _invalidate_after_commit(self):
+        self.uow.after_commit(grade_cache.invalidate)
     
     async def create_grade(self, grade_data: GradeCreate) -> GradeResponse:
         """Create a new grade"""
-        db = SessionLocal()
+        db = self.db
         try:
             # Check if grade name already exists
-            existing_grade = db.query(GradeModel).filter(
-                GradeModel.name == grade_data.name
-            ).first()
+            existing_grade = await db.scalar(
+                select(GradeModel).where(GradeModel.name == grade_data.name)
+            )
             
             if existing_grade:
                 raise ValueError(f"Grade with name '{grade_data.name}' already exists")
@@ -34,8 +58,9 @@ class GradeService:
             )
             
             db.add(db_grade)
-            db.commit()
-            db.refresh(db_grade)
+            await db.flush()
+            await db.refresh(db_grade)
+            self._invalidate_after_commit()
             
             return GradeResponse(
                 id=db_grade.id,
@@ -47,11 +72,8 @@ class GradeService:
             )
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error creating grade: {e}")
             raise
-        finally:
-            db.close()
     
     async def get_grades(
         self, 
@@ -60,41 +82,57 @@ class GradeService:
         active_only: bool = True
     ) -> List[GradeResponse]:
         """Get list of grades with pagination"""
-        db = SessionLocal()
+        grades, _ = await self.get_grades_page(limit=limit, skip=skip, active_only=active_only)
+        return grades
+    
+    async def get_grades_page(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        active_only: bool = True,
+        sort: str = "name"
+    ) -> Tuple[List[GradeResponse], Optional[str]]:
+        """Get one page of grades and the cursor of the next page (keyset or offset)"""
+        return await self._cached(
+            ("page", limit, cursor, skip, active_only, sort),
+            lambda: self._fetch_grades_page(limit, cursor, skip, active_only, sort)
+        )
+    
+    async def _fetch_grades_page(
+        self,
+        limit: int,
+        cursor: Optional[str],
+        skip: int,
+        active_only: bool,
+        sort: str
+    ) -> Tuple[List[GradeResponse], Optional[str]]:
+        db = self.db
         try:
-            query = db.query(GradeModel)
+            query = select(*self.RESPONSE_COLUMNS)
             
             if active_only:
-                query = query.filter(GradeModel.is_active == True)
+                query = query.where(GradeModel.is_active == True)
             
             # Order by name for logical sorting
-            query = query.order_by(GradeModel.name)
-            
-            grades = query.offset(skip).limit(limit).all()
-            
-            return [
-                GradeResponse(
-                    id=grade.id,
-                    name=grade.name,
-                    description=grade.description,
-                    is_active=grade.is_active,
-                    created_at=grade.created_at,
-                    updated_at=grade.updated_at,
-                )
-                for grade in grades
-            ]
+            columns = self.SORT_KEYS[sort]
+            rows = (await db.execute(paginate(query, sort, columns, limit, cursor=cursor, skip=skip))).all()
+            grades, next_cursor = split_page(rows, sort, [column.key for column in columns], limit)
+            
+            return [GradeResponse.model_construct(**row._mapping) for row in grades], next_cursor
             
         except Exception as e:
             logger.error(f"Error fetching grades: {e}")
             raise
-        finally:
-            db.close()
     
     async def get_grade(self, grade_id: int) -> Optional[GradeResponse]:
         """Get grade by ID"""
-        db = SessionLocal()
+        return await self._cached(("id", grade_id), lambda: self._fetch_grade(grade_id))
+    
+    async def _fetch_grade(self, grade_id: int) -> Optional[GradeResponse]:
+        db = self.db
         try:
-            grade = db.query(GradeModel).filter(GradeModel.id == grade_id).first()
+            grade = await db.get(GradeModel, grade_id)
             
             if not grade:
                 return None
@@ -111,14 +149,12 @@ class GradeService:
         except Exception as e:
             logger.error(f"Error fetching grade {grade_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def update_grade(self, grade_id: int, grade_data: GradeUpdate) -> Optional[GradeResponse]:
         """Update existing grade"""
-        db = SessionLocal()
+        db = self.db
         try:
-            grade = db.query(GradeModel).filter(GradeModel.id == grade_id).first()
+            grade = await db.get(GradeModel, grade_id)
             
             if not grade:
                 return None
@@ -127,12 +163,14 @@ class GradeService:
             if grade_data.name is not None:
                 # Check if new name conflicts with existing grade
                 if grade_data.name != grade.name:
-                    existing_grade = db.query(GradeModel).filter(
-                        and_(
-                            GradeModel.name == grade_data.name,
-                            GradeModel.id != grade_id
+                    existing_grade = await db.scalar(
+                        select(GradeModel).where(
+                            and_(
+                                GradeModel.name == grade_data.name,
+                                GradeModel.id != grade_id
+                            )
                         )
-                    ).first()
+                    )
                     
                     if existing_grade:
                         raise ValueError(f"Grade with name '{grade_data.name}' already exists")
@@ -147,8 +185,9 @@ class GradeService:
             if grade_data.is_active is not None:
                 grade.is_active = grade_data.is_active
             
-            db.commit()
-            db.refresh(grade)
+            await db.flush()
+            await db.refresh(grade)
+            self._invalidate_after_commit()
             
             return GradeResponse(
                 id=grade.id,
@@ -160,17 +199,14 @@ class GradeService:
             )
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error updating grade {grade_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def delete_grade(self, grade_id: int) -> bool:
         """Delete grade (soft delete by setting is_active to False)"""
-        db = SessionLocal()
+        db = self.db
         try:
-            grade = db.query(GradeModel).filter(GradeModel.id == grade_id).first()
+            grade = await db.get(GradeModel, grade_id)
             
             if not grade:
                 return False
@@ -181,22 +217,23 @@ class GradeService:
             
             # Soft delete
             grade.is_active = False
-            db.commit()
+            await db.flush()
+            self._invalidate_after_commit()
             
             return True
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error deleting grade {grade_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def get_grade_by_name(self, name: str) -> Optional[GradeResponse]:
         """Get grade by name"""
-        db = SessionLocal()
+        return await self._cached(("name", name), lambda: self._fetch_grade_by_name(name))
+    
+    async def _fetch_grade_by_name(self, name: str) -> Optional[GradeResponse]:
+        db = self.db
         try:
-            grade = db.query(GradeModel).filter(GradeModel.name == name).first()
+            grade = await db.scalar(select(GradeModel).where(GradeModel.name == name))
             
             if not grade:
                 return None
@@ -213,16 +250,17 @@ class GradeService:
         except Exception as e:
             logger.error(f"Error fetching grade by name '{name}': {e}")
             raise
-        finally:
-            db.close()
     
     async def get_active_grades_count(self) -> int:
         """Get count of active grades"""
-        db = SessionLocal()
+        return await self._cached(("active_count",), self._fetch_active_grades_count)
+    
+    async def _fetch_active_grades_count(self) -> int:
+        db = self.db
         try:
-            return db.query(GradeModel).filter(GradeModel.is_active == True).count()
+            return await db.scalar(
+                select(func.count()).select_from(GradeModel).where(GradeModel.is_active == True)
+            )
         except Exception as e:
             logger.error(f"Error counting active grades: {e}")
             raise
-        finally:
-            db.close()
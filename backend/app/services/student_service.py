@@ -1,52 +1,160 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
-from app.core.database import SessionLocal
-from app.models.student import StudentCreate, StudentUpdate, StudentResponse
-from app.core.database import Student as StudentModel
+from sqlalchemy import Float, Integer, String, case, cast, insert, literal, select, func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from app.core.cache import Cache, cache as default_cache
+from app.core.config import settings
+from app.core.database import UnitOfWork
+from app.core.pagination import paginate, split_page
+from app.services.attendance_report_service import report_cache
+from app.models.student import (
+    StudentCreate, StudentUpdate, StudentResponse, StudentImportError, StudentImportResult,
+    StudentSearchHit
+)
+from app.core.database import Student as StudentModel, StudentCodeCounter
+import csv
+import io
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Columns accepted from import files (extra columns are ignored)
+IMPORT_FIELDS = set(StudentCreate.model_fields)
+
+def iter_import_rows(file: BinaryIO, fmt: str) -> Iterator[Tuple[int, Union[dict, str]]]:
+    """Read a CSV/NDJSON upload row by row.
+
+    Yields (line number, raw fields) or (line number, error message) so rows
+    can be validated as they stream in.
+    """
+    text_file = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text_file)
+            missing = {"full_name", "grade"} - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError(f"Missing required columns: {', '.join(sorted(missing))}")
+            for row in reader:
+                yield reader.line_num, {
+                    key: value.strip()
+                    for key, value in row.items()
+                    if key in IMPORT_FIELDS and value is not None and value.strip() != ""
+                }
+        else:
+            for line_number, line in enumerate(text_file, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except ValueError as e:
+                    yield line_number, f"Invalid JSON: {e}"
+                    continue
+                if not isinstance(data, dict):
+                    yield line_number, "Expected a JSON object"
+                    continue
+                yield line_number, data
+    finally:
+        # Không đóng file của UploadFile
+        text_file.detach()
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors())
+
 class StudentService:
     """Service class for student management operations"""
     
-    def __init__(self):
-        pass
+    # Sort keys for listing; each ends with a unique column so pages are stable
+    SORT_KEYS = {
+        "id": (StudentModel.id,),
+        "full_name": (StudentModel.full_name, StudentModel.id),
+        "student_code": (StudentModel.student_code,),
+    }
     
-    def _generate_student_code(self, db: Session, grade: str) -> str:
-        """Generate unique student code based on grade"""
-        # Tìm số thứ tự lớn nhất trong grade hiện tại
-        max_student = db.query(StudentModel).filter(
-            StudentModel.grade == grade,
-            StudentModel.is_active == True
-        ).order_by(StudentModel.student_code.desc()).first()
-        
-        if max_student:
-            # Lấy số thứ tự từ mã hiện tại (ví dụ: "10A001" -> 1)
-            try:
-                current_number = int(max_student.student_code[-3:])
-                next_number = current_number + 1
-            except (ValueError, IndexError):
-                next_number = 1
-        else:
-            next_number = 1
+    # List queries select only the response columns as plain rows (no ORM
+    # entities); rows from the DB are trusted, so responses skip validation
+    RESPONSE_COLUMNS = [getattr(StudentModel, name) for name in StudentResponse.model_fields]
+    EXPORT_FIELDS = ["id", "student_code"] + [name for name in StudentResponse.model_fields if name not in ("id", "student_code")]
+    
+    def __init__(self, uow: UnitOfWork, cache: Cache = default_cache):
+        self.uow = uow
+        self.db = uow.session
+        self.cache = cache
+    
+    @staticmethod
+    def _cache_keys(student_id: int, student_code: str) -> List[str]:
+        return [f"student:id:{student_id}", f"student:code:{student_code}"]
+    
+    async def _cached_student(self, key: str) -> Optional[StudentResponse]:
+        payload = await self.cache.get(key)
+        return StudentResponse.model_validate_json(payload) if payload is not None else None
+    
+    async def _cache_student(self, student: StudentResponse):
+        # Only committed data: a write transaction may still roll back
+        if not self.uow.read_only:
+            return
+        payload = student.model_dump_json().encode()
+        for key in self._cache_keys(student.id, student.student_code):
+            await self.cache.set(key, payload)
+    
+    def _invalidate_after_commit(self, student: StudentModel):
+        """Drop cached copies once the change is committed"""
+        keys = self._cache_keys(student.id, student.student_code)
+        self.uow.after_commit(lambda: self.cache.delete(*keys))
+    
+    async def _max_code_number(self, db: AsyncSession, grade: str) -> int:
+        """Highest numeric suffix among existing codes of a grade (seeds its counter)"""
+        suffix = func.substr(StudentModel.student_code, len(grade) + 1)
+        return await db.scalar(
+            select(func.max(cast(suffix, Integer))).where(
+                StudentModel.grade == grade,
+                func.left(StudentModel.student_code, len(grade)) == grade,
+                suffix.op("~")("^[0-9]+$")
+            )
+        ) or 0
+    
+    async def _allocate_code_numbers(self, db: AsyncSession, grade: str, count: int = 1) -> int:
+        """Atomically reserve `count` sequence numbers for a grade; returns the first one.
         
+        The counter row stays locked until the transaction ends, so parallel
+        enrolments in the same grade get disjoint ranges.
+        """
+        last_number = await db.scalar(
+            update(StudentCodeCounter)
+            .where(StudentCodeCounter.grade == grade)
+            .values(last_number=StudentCodeCounter.last_number + count)
+            .returning(StudentCodeCounter.last_number)
+        )
+        if last_number is None:
+            # Grade chưa có counter: khởi tạo từ mã lớn nhất hiện có
+            seed = await self._max_code_number(db, grade)
+            stmt = pg_insert(StudentCodeCounter).values(grade=grade, last_number=seed + count)
+            last_number = await db.scalar(
+                stmt.on_conflict_do_update(
+                    index_elements=[StudentCodeCounter.grade],
+                    set_={"last_number": StudentCodeCounter.last_number + count}
+                ).returning(StudentCodeCounter.last_number)
+            )
+        return last_number - count + 1
+    
+    async def _generate_student_code(self, db: AsyncSession, grade: str) -> str:
+        """Generate unique student code based on grade"""
         # Format: {GRADE}{SEQUENCE_NUMBER:03d} (ví dụ: "10A001", "11B002")
-        student_code = f"{grade}{next_number:03d}"
+        student_code = f"{grade}{await self._allocate_code_numbers(db, grade):03d}"
         
-        # Kiểm tra xem mã có bị trùng không (để đảm bảo an toàn)
-        while db.query(StudentModel).filter(StudentModel.student_code == student_code).first():
-            next_number += 1
-            student_code = f"{grade}{next_number:03d}"
+        # Grades có tiền tố chồng nhau (vd "1" và "11") hoặc mã nhập tay có thể đã tồn tại
+        while await db.scalar(select(StudentModel.id).where(StudentModel.student_code == student_code)):
+            student_code = f"{grade}{await self._allocate_code_numbers(db, grade):03d}"
         
         return student_code
     
     async def create_student(self, student_data: StudentCreate) -> StudentResponse:
         """Create a new student"""
-        db = SessionLocal()
+        db = self.db
         try:
             # Generate unique student code
-            student_code = self._generate_student_code(db, student_data.grade)
+            student_code = await self._generate_student_code(db, student_data.grade)
             
             # Create new student
             db_student = StudentModel(
@@ -65,8 +173,8 @@ class StudentService:
             )
             
             db.add(db_student)
-            db.commit()
-            db.refresh(db_student)
+            await db.flush()
+            await db.refresh(db_student)
             
             return StudentResponse(
                 id=db_student.id,
@@ -87,11 +195,97 @@ class StudentService:
             )
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error creating student: {e}")
             raise
-        finally:
-            db.close()
+    
+    async def import_students(
+        self,
+        rows: Iterable[Tuple[int, Union[dict, str]]],
+        batch_size: int = 100,
+        dry_run: bool = False
+    ) -> StudentImportResult:
+        """Validate and insert students from `iter_import_rows` in batches.
+        
+        Invalid rows are reported and skipped. Each batch reserves one code
+        range per grade from the counter table and is one multi-row INSERT.
+        """
+        db = self.db
+        total = 0
+        imported = 0
+        errors: List[StudentImportError] = []
+        code_ranges: Dict[str, List[str]] = {}
+        batch: List[StudentCreate] = []
+        
+        try:
+            for line_number, data in rows:
+                total += 1
+                if isinstance(data, str):
+                    errors.append(StudentImportError(row=line_number, error=data))
+                    continue
+                try:
+                    batch.append(StudentCreate.model_validate(data))
+                except ValidationError as e:
+                    errors.append(StudentImportError(row=line_number, error=_format_validation_error(e)))
+                    continue
+                
+                if len(batch) >= batch_size:
+                    imported += await self._insert_import_batch(db, batch, code_ranges, dry_run)
+                    batch = []
+            
+            if batch:
+                imported += await self._insert_import_batch(db, batch, code_ranges, dry_run)
+            
+            return StudentImportResult(
+                total_rows=total,
+                imported=imported,
+                failed=len(errors),
+                dry_run=dry_run,
+                code_ranges=code_ranges,
+                errors=errors
+            )
+            
+        except Exception as e:
+            logger.error(f"Error importing students: {e}")
+            raise
+    
+    async def _insert_import_batch(
+        self,
+        db: AsyncSession,
+        batch: List[StudentCreate],
+        code_ranges: Dict[str, List[str]],
+        dry_run: bool
+    ) -> int:
+        # Một range cho mỗi grade trong batch (theo thứ tự grade để tránh deadlock)
+        counts: Dict[str, int] = {}
+        for student in batch:
+            counts[student.grade] = counts.get(student.grade, 0) + 1
+        next_numbers = {grade: await self._allocate_code_numbers(db, grade, counts[grade]) for grade in sorted(counts)}
+        
+        def next_code(grade: str) -> str:
+            number = next_numbers[grade]
+            next_numbers[grade] = number + 1
+            return f"{grade}{number:03d}"
+        
+        values = [dict(student.model_dump(), student_code=next_code(student.grade)) for student in batch]
+        
+        # Grades có tiền tố chồng nhau (vd "1" và "11") có thể sinh mã đã tồn tại
+        while True:
+            codes = [value["student_code"] for value in values]
+            taken = set(await db.scalars(select(StudentModel.student_code).where(StudentModel.student_code.in_(codes))))
+            taken |= {code for code in codes if codes.count(code) > 1}
+            if not taken:
+                break
+            for value in values:
+                if value["student_code"] in taken:
+                    value["student_code"] = f"{value['grade']}{await self._allocate_code_numbers(db, value['grade']):03d}"
+        
+        for value in values:
+            grade_range = code_ranges.setdefault(value["grade"], [value["student_code"], value["student_code"]])
+            grade_range[1] = value["student_code"]
+        
+        if not dry_run:
+            await db.execute(insert(StudentModel).values(values))
+        return len(values)
     
     async def get_students(
         self, 
@@ -100,55 +294,122 @@ class StudentService:
         grade: Optional[str] = None
     ) -> List[StudentResponse]:
         """Get list of students with pagination and filtering"""
-        db = SessionLocal()
+        students, _ = await self.get_students_page(limit=limit, skip=skip, grade=grade)
+        return students
+    
+    async def get_students_page(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        grade: Optional[str] = None,
+        sort: str = "id"
+    ) -> Tuple[List[StudentResponse], Optional[str]]:
+        """Get one page of students and the cursor of the next page (keyset or offset)"""
+        db = self.db
         try:
-            query = db.query(StudentModel)
+            query = select(*self.RESPONSE_COLUMNS)
             
             # Apply filters
             if grade:
-                query = query.filter(StudentModel.grade == grade)
+                query = query.where(StudentModel.grade == grade)
             # if section: # Removed section filter
-            #     query = query.filter(StudentModel.section == section)
-            
-            students = query.offset(skip).limit(limit).all()
-            
-            return [
-                StudentResponse(
-                    id=student.id,
-                    student_code=student.student_code,
-                    full_name=student.full_name,
-                    email=student.email,
-                    grade=student.grade,
-                    # section=student.section, # Removed section
-                    date_of_birth=student.date_of_birth,
-                    phone=student.phone,
-                    address=student.address,
-                    parent_name=student.parent_name,
-                    parent_phone=student.parent_phone,
-                    parent_email=student.parent_email,
-                    photo_path=student.photo_path,
-                    created_at=student.created_at,
-                    updated_at=student.updated_at,
-                )
-                for student in students
-            ]
+            #     query = query.where(StudentModel.section == section)
+            
+            columns = self.SORT_KEYS[sort]
+            rows = (await db.execute(paginate(query, sort, columns, limit, cursor=cursor, skip=skip))).all()
+            students, next_cursor = split_page(rows, sort, [column.key for column in columns], limit)
+            
+            return [StudentResponse.model_construct(**row._mapping) for row in students], next_cursor
             
         except Exception as e:
             logger.error(f"Error fetching students: {e}")
             raise
-        finally:
-            db.close()
+    
+    async def stream_students(
+        self,
+        grade: Optional[str] = None,
+        batch_size: int = settings.EXPORT_BATCH_SIZE
+    ) -> AsyncIterator[List[dict]]:
+        """Stream students theo id qua server-side cursor, mỗi lần `batch_size` dòng.
+
+        Chỉ giữ một batch trong bộ nhớ nên export 100 hay 1 triệu dòng tốn như nhau.
+        """
+        query = select(*self.RESPONSE_COLUMNS).order_by(StudentModel.id)
+        if grade:
+            query = query.where(StudentModel.grade == grade)
+
+        result = await self.db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.mappings().partitions():
+            yield [dict(row) for row in partition]
+    
+    async def search_students(
+        self,
+        q: str,
+        grade: Optional[str] = None,
+        skip: int = 0,
+        limit: int = 20
+    ) -> List[StudentSearchHit]:
+        """Tìm học sinh theo tên (không phân biệt dấu) hoặc mã, xếp hạng theo độ khớp.
+
+        Dùng các GIN index pg_trgm của migration 003. Thứ tự: trùng mã, mã bắt
+        đầu bằng q, tên bắt đầu bằng q, rồi theo word_similarity (khớp gần đúng,
+        gõ sai vài ký tự vẫn tìm được).
+        """
+        db = self.db
+        try:
+            # Chuẩn hoá giống biểu thức của index; hằng số nên Postgres tính một lần
+            term = func.f_unaccent(func.lower(literal(q.strip(), String)), type_=String)
+            code_term = func.lower(literal(q.strip(), String), type_=String)
+            name = func.f_unaccent(func.lower(StudentModel.full_name), type_=String)
+            code = func.lower(StudentModel.student_code, type_=String)
+
+            similarity = func.word_similarity(term, name, type_=Float)
+            exact_code = code == code_term
+            score = cast(
+                case((exact_code, 1.0), else_=func.greatest(similarity, func.similarity(code_term, code))),
+                Float
+            )
+
+            query = select(*self.RESPONSE_COLUMNS, score.label("score")).where(
+                StudentModel.is_active == True,
+                (name.like(literal("%") + term + "%"))
+                | name.op("%>")(term)
+                | code.like(code_term + "%")
+            )
+            if grade:
+                query = query.where(StudentModel.grade == grade)
+
+            query = query.order_by(
+                exact_code.desc(),
+                code.like(code_term + "%").desc(),
+                name.like(term + "%").desc(),
+                similarity.desc(),
+                StudentModel.full_name,
+                StudentModel.id,
+            ).offset(skip).limit(limit)
+
+            rows = (await db.execute(query)).all()
+            return [StudentSearchHit.model_construct(**row._mapping) for row in rows]
+
+        except Exception as e:
+            logger.error(f"Error searching students: {e}")
+            raise
     
     async def get_student(self, student_id: int) -> Optional[StudentResponse]:
-        """Get student by ID"""
-        db = SessionLocal()
+        """Get student by ID (read-through cache)"""
+        db = self.db
         try:
-            student = db.query(StudentModel).filter(StudentModel.id == student_id).first()
+            cached = await self._cached_student(f"student:id:{student_id}")
+            if cached is not None:
+                return cached
+            
+            student = await db.get(StudentModel, student_id)
             
             if not student:
                 return None
             
-            return StudentResponse(
+            response = StudentResponse(
                 id=student.id,
                 student_code=student.student_code,
                 full_name=student.full_name,
@@ -165,18 +426,18 @@ class StudentService:
                 created_at=student.created_at,
                 updated_at=student.updated_at,
             )
+            await self._cache_student(response)
+            return response
             
         except Exception as e:
             logger.error(f"Error fetching student {student_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def update_student(self, student_id: int, student_data: StudentUpdate) -> Optional[StudentResponse]:
         """Update existing student"""
-        db = SessionLocal()
+        db = self.db
         try:
-            student = db.query(StudentModel).filter(StudentModel.id == student_id).first()
+            student = await db.get(StudentModel, student_id)
             
             if not student:
                 return None
@@ -215,11 +476,16 @@ class StudentService:
             if student_data.photo_path is not None:
                 student.photo_path = student_data.photo_path
             
-            db.commit()
-            db.refresh(student)
+            await db.flush()
+            await db.refresh(student)
+            self._invalidate_after_commit(student)
+            if student_data.full_name is not None or student_data.grade is not None:
+                # Báo cáo điểm danh chứa tên và grade của học sinh
+                self.uow.after_commit(report_cache.invalidate)
             
             return StudentResponse(
                 id=student.id,
+                student_code=student.student_code,
                 full_name=student.full_name,
                 email=student.email,
                 grade=student.grade,
@@ -236,46 +502,42 @@ class StudentService:
             )
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error updating student {student_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def delete_student(self, student_id: int) -> bool:
         """Delete student (soft delete by setting is_active to False)"""
-        db = SessionLocal()
+        db = self.db
         try:
-            student = db.query(StudentModel).filter(StudentModel.id == student_id).first()
+            student = await db.get(StudentModel, student_id)
             
             if not student:
                 return False
             
             # Soft delete
             student.is_active = False
-            db.commit()
+            await db.flush()
+            self._invalidate_after_commit(student)
             
             return True
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error deleting student {student_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def update_student_photo(self, student_id: int, photo_path: str) -> Optional[StudentResponse]:
         """Update student's photo path"""
-        db = SessionLocal()
+        db = self.db
         try:
-            student = db.query(StudentModel).filter(StudentModel.id == student_id).first()
+            student = await db.get(StudentModel, student_id)
             
             if not student:
                 return None
             
             student.photo_path = photo_path
-            db.commit()
-            db.refresh(student)
+            await db.flush()
+            await db.refresh(student)
+            self._invalidate_after_commit(student)
             
             return StudentResponse(
                 id=student.id,
@@ -296,57 +558,40 @@ class StudentService:
             )
             
         except Exception as e:
-            db.rollback()
             logger.error(f"Error updating student photo {student_id}: {e}")
             raise
-        finally:
-            db.close()
     
     async def get_students_by_grade(self, grade: str) -> List[StudentResponse]:
         """Get students by grade"""
-        db = SessionLocal()
+        db = self.db
         try:
-            students = db.query(StudentModel).filter(
-                StudentModel.grade == grade,
-                StudentModel.is_active == True
-            ).all()
-            
-            return [
-                StudentResponse(
-                    id=student.id,
-                    student_code=student.student_code,
-                    full_name=student.full_name,
-                    email=student.email,
-                    grade=student.grade,
-                    date_of_birth=student.date_of_birth,
-                    phone=student.phone,
-                    address=student.address,
-                    parent_name=student.parent_name,
-                    parent_phone=student.parent_phone,
-                    parent_email=student.parent_email,
-                    photo_path=student.photo_path,
-                    created_at=student.created_at,
-                    updated_at=student.updated_at,
+            students = (await db.execute(
+                select(*self.RESPONSE_COLUMNS).where(
+                    StudentModel.grade == grade,
+                    StudentModel.is_active == True
                 )
-                for student in students
-            ]
+            )).all()
+            
+            return [StudentResponse.model_construct(**row._mapping) for row in students]
             
         except Exception as e:
             logger.error(f"Error fetching students by grade '{grade}': {e}")
             raise
-        finally:
-            db.close()
     
     async def get_student_by_code(self, student_code: str) -> Optional[StudentResponse]:
-        """Get student by student code"""
-        db = SessionLocal()
+        """Get student by student code (read-through cache)"""
+        db = self.db
         try:
-            student = db.query(StudentModel).filter(StudentModel.student_code == student_code).first()
+            cached = await self._cached_student(f"student:code:{student_code}")
+            if cached is not None:
+                return cached
+            
+            student = await db.scalar(select(StudentModel).where(StudentModel.student_code == student_code))
             
             if not student:
                 return None
             
-            return StudentResponse(
+            response = StudentResponse(
                 id=student.id,
                 student_code=student.student_code,
                 full_name=student.full_name,
@@ -363,20 +608,20 @@ class StudentService:
                 created_at=student.created_at,
                 updated_at=student.updated_at,
             )
+            await self._cache_student(response)
+            return response
             
         except Exception as e:
             logger.error(f"Error fetching student by code '{student_code}': {e}")
             raise
-        finally:
-            db.close()
 
     async def get_active_students_count(self) -> int:
         """Get count of active students"""
-        db = SessionLocal()
+        db = self.db
         try:
-            return db.query(StudentModel).filter(StudentModel.is_active == True).count()
+            return await db.scalar(
+                select(func.count()).select_from(StudentModel).where(StudentModel.is_active == True)
+            )
         except Exception as e:
             logger.error(f"Error counting active students: {e}")
             raise
-        finally:
-            db.close()
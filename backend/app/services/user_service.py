@@ -1,8 +1,10 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.database import User
 from app.core.security import get_password_hash, verify_password
-from app.models.user import UserCreate, UserUpdate
-from typing import Optional, List
+from app.models.user import UserCreate, UserUpdate, UserResponse
+from app.core.pagination import paginate, split_page
+from typing import Optional, List, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,42 +12,65 @@ logger = logging.getLogger(__name__)
 class UserService:
     """Service class để xử lý business logic cho User"""
     
-    def __init__(self, db: Session):
+    # Các kiểu sắp xếp cho danh sách (username là unique)
+    SORT_KEYS = {
+        "id": (User.id,),
+        "username": (User.username,),
+        "full_name": (User.full_name, User.id),
+    }
+    
+    # Danh sách chỉ select các cột của response (không load entity, không validate lại)
+    RESPONSE_COLUMNS = [getattr(User, name) for name in UserResponse.model_fields]
+    
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def get_user_by_id(self, user_id: int) -> Optional[User]:
+    async def get_user_by_id(self, user_id: int) -> Optional[User]:
         """Lấy user theo ID"""
         try:
-            return self.db.query(User).filter(User.id == user_id).first()
+            return await self.db.get(User, user_id)
         except Exception as e:
             logger.error(f"Error getting user by ID {user_id}: {e}")
             return None
     
-    def get_user_by_username(self, username: str) -> Optional[User]:
+    async def get_user_by_username(self, username: str) -> Optional[User]:
         """Lấy user theo username"""
         try:
-            return self.db.query(User).filter(User.username == username).first()
+            return await self.db.scalar(select(User).where(User.username == username))
         except Exception as e:
             logger.error(f"Error getting user by username {username}: {e}")
             return None
     
-    def get_user_by_email(self, email: str) -> Optional[User]:
+    async def get_user_by_email(self, email: str) -> Optional[User]:
         """Lấy user theo email"""
         try:
-            return self.db.query(User).filter(User.email == email).first()
+            return await self.db.scalar(select(User).where(User.email == email))
         except Exception as e:
             logger.error(f"Error getting user by email {email}: {e}")
             return None
     
-    def get_users(self, skip: int = 0, limit: int = 100) -> List[User]:
+    async def get_users(self, skip: int = 0, limit: int = 100) -> List[User]:
         """Lấy danh sách users với pagination"""
         try:
-            return self.db.query(User).offset(skip).limit(limit).all()
+            return list(await self.db.scalars(select(User).order_by(User.id).offset(skip).limit(limit)))
         except Exception as e:
             logger.error(f"Error getting users: {e}")
             return []
     
-    def create_user(self, user_data: UserCreate) -> User:
+    async def get_users_page(
+        self,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        sort: str = "id"
+    ) -> Tuple[List[UserResponse], Optional[str]]:
+        """Lấy một trang users và cursor của trang sau (keyset hoặc offset)"""
+        columns = self.SORT_KEYS[sort]
+        query = paginate(select(*self.RESPONSE_COLUMNS), sort, columns, limit, cursor=cursor, skip=skip)
+        rows, next_cursor = split_page((await self.db.execute(query)).all(), sort, [c.key for c in columns], limit)
+        return [UserResponse.model_construct(**row._mapping) for row in rows], next_cursor
+    
+    async def create_user(self, user_data: UserCreate) -> User:
         """Tạo user mới"""
         try:
             # Hash password
@@ -62,21 +87,21 @@ class UserService:
             
             # Lưu vào database
             self.db.add(db_user)
-            self.db.commit()
-            self.db.refresh(db_user)
+            await self.db.commit()
+            await self.db.refresh(db_user)
             
             logger.info(f"Created new user: {user_data.username}")
             return db_user
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Error creating user {user_data.username}: {e}")
             raise
     
-    def update_user(self, user_id: int, user_data: UserUpdate) -> Optional[User]:
+    async def update_user(self, user_id: int, user_data: UserUpdate) -> Optional[User]:
         """Cập nhật user"""
         try:
-            db_user = self.get_user_by_id(user_id)
+            db_user = await self.get_user_by_id(user_id)
             if not db_user:
                 return None
             
@@ -91,40 +116,40 @@ class UserService:
             for field, value in update_data.items():
                 setattr(db_user, field, value)
             
-            self.db.commit()
-            self.db.refresh(db_user)
+            await self.db.commit()
+            await self.db.refresh(db_user)
             
             logger.info(f"Updated user: {db_user.username}")
             return db_user
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Error updating user {user_id}: {e}")
             raise
     
-    def delete_user(self, user_id: int) -> bool:
+    async def delete_user(self, user_id: int) -> bool:
         """Xóa user (soft delete)"""
         try:
-            db_user = self.get_user_by_id(user_id)
+            db_user = await self.get_user_by_id(user_id)
             if not db_user:
                 return False
             
             # Soft delete - chỉ set is_active = False
             db_user.is_active = False
-            self.db.commit()
+            await self.db.commit()
             
             logger.info(f"Deleted user: {db_user.username}")
             return True
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Error deleting user {user_id}: {e}")
             return False
     
-    def authenticate_user(self, username: str, password: str) -> Optional[User]:
+    async def authenticate_user(self, username: str, password: str) -> Optional[User]:
         """Xác thực user với username và password"""
         try:
-            user = self.get_user_by_username(username)
+            user = await self.get_user_by_username(username)
             if not user:
                 return None
             
@@ -137,10 +162,10 @@ class UserService:
             logger.error(f"Error authenticating user {username}: {e}")
             return None
     
-    def change_password(self, user_id: int, old_password: str, new_password: str) -> bool:
+    async def change_password(self, user_id: int, old_password: str, new_password: str) -> bool:
         """Thay đổi password của user"""
         try:
-            user = self.get_user_by_id(user_id)
+            user = await self.get_user_by_id(user_id)
             if not user:
                 return False
             
@@ -150,28 +175,28 @@ class UserService:
             
             # Hash password mới
             user.hashed_password = get_password_hash(new_password)
-            self.db.commit()
+            await self.db.commit()
             
             logger.info(f"Changed password for user: {user.username}")
             return True
             
         except Exception as e:
-            self.db.rollback()
+            await self.db.rollback()
             logger.error(f"Error changing password for user {user_id}: {e}")
             return False
     
-    def get_active_users(self) -> List[User]:
+    async def get_active_users(self) -> List[User]:
         """Lấy danh sách users đang active"""
         try:
-            return self.db.query(User).filter(User.is_active == True).all()
+            return list(await self.db.scalars(select(User).where(User.is_active == True)))
         except Exception as e:
             logger.error(f"Error getting active users: {e}")
             return []
     
-    def get_users_by_role(self, role: str) -> List[User]:
+    async def get_users_by_role(self, role: str) -> List[User]:
         """Lấy danh sách users theo role"""
         try:
-            return self.db.query(User).filter(User.role == role, User.is_active == True).all()
+            return list(await self.db.scalars(select(User).where(User.role == role, User.is_active == True)))
         except Exception as e:
             logger.error(f"Error getting users by role {role}: {e}")
             return []
@@ -1,13 +1,21 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from contextlib import asynccontextmanager
 import uvicorn
+import time
+from sqlalchemy import text
 from typing import List, Optional
 import logging
 
 from app.core.config import settings
-from app.core.database import engine, Base
+from app.core.database import async_engine, Base
+from app.core.cache import cache
+from app.services.attendance_buffer import attendance_buffer
+from app.services.attendance_partitions import partition_maintainer
+from app.services.attendance_closeout import closeout_scheduler
+from app.core.db_metrics import checkout_stats, pool_monitor, start_request_tracking
 from app.api.v1.api import api_router
 from app.core.security import verify_token
 
@@ -23,13 +31,22 @@ async def lifespan(app: FastAPI):
     """Lifecycle events cho ứng dụng"""
     # Startup
     logger.info("Starting SchoolSmart Backend...")
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     logger.info("Database tables created successfully")
+    await partition_maintainer.start()  # Partition tháng này và các tháng tới
+    await attendance_buffer.start()
+    await closeout_scheduler.start()  # Chốt điểm danh (ghi vắng, đi muộn) cuối mỗi ngày học
     
     yield
     
     # Shutdown
     logger.info("Shutting down SchoolSmart Backend...")
+    await closeout_scheduler.stop()
+    await attendance_buffer.stop()  # Ghi nốt check-in/out còn trong buffer
+    await partition_maintainer.stop()
+    await cache.close()
+    await async_engine.dispose()
 
 def create_application() -> FastAPI:
     """Tạo FastAPI application"""
@@ -49,8 +66,18 @@ def create_application() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
     )
     
+    @app.middleware("http")
+    async def track_db_checkouts(request: Request, call_next):
+        """Đếm số lần checkout connection DB của mỗi request"""
+        context = start_request_tracking(request.method, request.scope)
+        response = await call_next(request)
+        checkout_stats.record(context.route, context.checkouts)
+        response.headers["X-DB-Checkouts"] = str(context.checkouts)
+        return response
+    
     # Include API router
     app.include_router(api_router, prefix="/api/v1")
     
@@ -66,6 +93,25 @@ def create_application() -> FastAPI:
     async def health_check():
         return {"status": "healthy", "service": "schoolsmart-backend"}
     
+    @app.get("/health/db")
+    async def database_health_check():
+        """Kiểm tra kết nối DB (SELECT 1) kèm trạng thái pool"""
+        started = time.perf_counter()
+        try:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        except Exception as e:
+            logger.error(f"Database health check failed: {e}")
+            return JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={"status": "unhealthy", "error": str(e), "pool": pool_monitor.pool_status("async")}
+            )
+        return {
+            "status": "healthy",
+            "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+            "pool": pool_monitor.pool_status("async")
+        }
+    
     return app
 
 app = create_application()
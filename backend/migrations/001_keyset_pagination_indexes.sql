@@ -0,0 +1,11 @@
+-- Indexes cho keyset (cursor) pagination: (sort key, id)
+-- grades.name, users.username và students.student_code đã có unique index
+
+CREATE INDEX IF NOT EXISTS ix_students_full_name_id ON students (full_name, id);
+CREATE INDEX IF NOT EXISTS ix_students_grade_id ON students (grade, id);
+CREATE INDEX IF NOT EXISTS ix_students_grade_full_name_id ON students (grade, full_name, id);
+
+CREATE INDEX IF NOT EXISTS ix_users_full_name_id ON users (full_name, id);
+
+CREATE INDEX IF NOT EXISTS ix_attendance_records_date_id ON attendance_records (date, id);
+CREATE INDEX IF NOT EXISTS ix_attendance_records_student_id_date_id ON attendance_records (student_id, date, id);
@@ -0,0 +1,16 @@
+-- Counter theo grade cho student_code (cấp số bằng UPDATE ... RETURNING)
+
+CREATE TABLE IF NOT EXISTS student_code_counters (
+    grade VARCHAR PRIMARY KEY,
+    last_number INTEGER NOT NULL DEFAULT 0
+);
+
+-- Khởi tạo từ mã lớn nhất hiện có của mỗi grade
+INSERT INTO student_code_counters (grade, last_number)
+SELECT grade, max(substr(student_code, length(grade) + 1)::int)
+FROM students
+WHERE left(student_code, length(grade)) = grade
+  AND substr(student_code, length(grade) + 1) ~ '^[0-9]+$'
+GROUP BY grade
+ON CONFLICT (grade) DO UPDATE
+SET last_number = GREATEST(student_code_counters.last_number, EXCLUDED.last_number);
@@ -0,0 +1,15 @@
+-- Tìm kiếm học sinh theo tên / mã: pg_trgm + unaccent (tên tiếng Việt không dấu)
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() chỉ là STABLE nên không dùng được trong index; bọc lại thành IMMUTABLE
+-- với dictionary cố định
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$;
+
+CREATE INDEX IF NOT EXISTS ix_students_full_name_trgm
+    ON students USING gin (f_unaccent(lower(full_name)) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_students_student_code_trgm
+    ON students USING gin (lower(student_code) gin_trgm_ops);
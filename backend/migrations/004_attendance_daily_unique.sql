@@ -0,0 +1,22 @@
+-- Một dòng điểm danh mỗi học sinh mỗi ngày; khoá cho upsert của write-behind buffer
+
+-- date lưu nửa đêm
+UPDATE attendance_records SET date = date_trunc('day', date) WHERE date <> date_trunc('day', date);
+
+-- Gộp các dòng trùng vào dòng id nhỏ nhất: check-in sớm nhất, check-out muộn nhất
+UPDATE attendance_records a
+SET check_in_time = d.check_in_time, check_out_time = d.check_out_time
+FROM (
+    SELECT min(id) AS id, min(check_in_time) AS check_in_time, max(check_out_time) AS check_out_time
+    FROM attendance_records
+    GROUP BY student_id, date
+    HAVING count(*) > 1
+) d
+WHERE a.id = d.id;
+
+DELETE FROM attendance_records a
+USING attendance_records b
+WHERE a.student_id = b.student_id AND a.date = b.date AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_records_student_id_date
+    ON attendance_records (student_id, date);
@@ -0,0 +1,27 @@
+-- Bảng tổng hợp điểm danh theo (ngày, grade) cho /attendance/stats
+
+CREATE TABLE IF NOT EXISTS attendance_daily_stats (
+    date DATE NOT NULL,
+    grade VARCHAR NOT NULL,
+    present INTEGER NOT NULL DEFAULT 0,
+    late INTEGER NOT NULL DEFAULT 0,
+    absent INTEGER NOT NULL DEFAULT 0,
+    excused INTEGER NOT NULL DEFAULT 0,
+    early_leave INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (date, grade)
+);
+
+-- Tính lại từ dữ liệu hiện có (giống scripts/rebuild_attendance_stats.py)
+DELETE FROM attendance_daily_stats;
+
+INSERT INTO attendance_daily_stats (date, grade, present, late, absent, excused, early_leave)
+SELECT a.date::date, s.grade,
+       count(*) FILTER (WHERE a.status = 'present'),
+       count(*) FILTER (WHERE a.status = 'late'),
+       count(*) FILTER (WHERE a.status = 'absent'),
+       count(*) FILTER (WHERE a.status = 'excused'),
+       count(*) FILTER (WHERE a.status = 'early_leave')
+FROM attendance_records a
+JOIN students s ON s.id = a.student_id
+GROUP BY a.date::date, s.grade;
@@ -0,0 +1,12 @@
+-- Composite / partial indexes cho các truy vấn thường dùng
+-- Kiểm tra bằng: python scripts/check_query_plans.py
+-- (student_id, date) đã có uq_attendance_records_student_id_date (migration 004)
+
+CREATE INDEX IF NOT EXISTS ix_attendance_records_device_id_date
+    ON attendance_records (device_id, date) WHERE device_id IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS ix_attendance_records_sync_pending
+    ON attendance_records (id) WHERE sync_status = 'pending';
+
+CREATE INDEX IF NOT EXISTS ix_students_grade_active
+    ON students (grade, id) WHERE is_active;
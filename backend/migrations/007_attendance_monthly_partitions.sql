@@ -0,0 +1,56 @@
+-- Partition attendance_records theo tháng trên cột date (RANGE)
+-- Partition tương lai do app tạo khi khởi động và mỗi ngày (app/services/attendance_partitions.py);
+-- partition cũ được tách và lưu trữ bằng scripts/archive_attendance.py
+
+DO $$
+DECLARE
+    first_month date;
+    last_month date := (date_trunc('month', now()) + interval '3 months')::date;
+    m date;
+BEGIN
+    -- DB mới tạo bằng create_all đã là bảng partition
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'attendance_records' AND c.relnamespace = 'public'::regnamespace
+    ) THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE attendance_records RENAME TO attendance_records_unpartitioned;
+    CREATE TABLE attendance_records (LIKE attendance_records_unpartitioned INCLUDING DEFAULTS)
+        PARTITION BY RANGE (date);
+
+    SELECT coalesce(date_trunc('month', min(date)), date_trunc('month', now()))::date
+    INTO first_month FROM attendance_records_unpartitioned;
+    m := least(first_month, date_trunc('month', now())::date);
+    WHILE m <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF attendance_records FOR VALUES FROM (%L) TO (%L)',
+            'attendance_records_' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date
+        );
+        m := (m + interval '1 month')::date;
+    END LOOP;
+
+    INSERT INTO attendance_records SELECT * FROM attendance_records_unpartitioned;
+
+    -- Giữ sequence của id khi xoá bảng cũ
+    ALTER SEQUENCE attendance_records_id_seq OWNED BY NONE;
+    DROP TABLE attendance_records_unpartitioned;
+    ALTER SEQUENCE attendance_records_id_seq OWNED BY attendance_records.id;
+
+    -- Primary key / unique index của bảng partition phải chứa cột partition (date)
+    ALTER TABLE attendance_records ADD CONSTRAINT attendance_records_pkey PRIMARY KEY (id, date);
+    ALTER TABLE attendance_records ADD CONSTRAINT attendance_records_student_id_fkey
+        FOREIGN KEY (student_id) REFERENCES students (id);
+END $$;
+
+-- Index trên bảng cha được tạo cho mọi partition (kể cả partition tạo sau)
+CREATE INDEX IF NOT EXISTS ix_attendance_records_id ON attendance_records (id);
+CREATE INDEX IF NOT EXISTS ix_attendance_records_date_id ON attendance_records (date, id);
+CREATE INDEX IF NOT EXISTS ix_attendance_records_student_id_date_id ON attendance_records (student_id, date, id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_records_student_id_date ON attendance_records (student_id, date);
+CREATE INDEX IF NOT EXISTS ix_attendance_records_device_id_date
+    ON attendance_records (device_id, date) WHERE device_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_attendance_records_sync_pending
+    ON attendance_records (id) WHERE sync_status = 'pending';
@@ -0,0 +1,13 @@
+-- Bitmap điểm danh theo (học sinh, học kỳ) cho lịch sử và tỷ lệ chuyên cần
+-- Bit i của mỗi cột ứng với ngày term_start + i (byte 0 chứa bit 0-7, bit thấp trước)
+
+CREATE TABLE IF NOT EXISTS attendance_term_bitmaps (
+    student_id INTEGER NOT NULL REFERENCES students (id) ON DELETE CASCADE,
+    term_start DATE NOT NULL,
+    present BYTEA NOT NULL,
+    late BYTEA NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (student_id, term_start)
+);
+
+-- Dữ liệu cũ: chạy scripts/rebuild_attendance_bitmaps.py sau migration này
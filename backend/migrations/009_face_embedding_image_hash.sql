@@ -0,0 +1,6 @@
+-- Perceptual hash (dHash 64 bit, lưu dạng signed) của ảnh gốc mỗi embedding,
+-- để dedupe khi đăng ký không phải đọc lại toàn bộ ảnh gallery từ đĩa
+
+ALTER TABLE face_embeddings ADD COLUMN IF NOT EXISTS image_hash BIGINT;
+
+-- Dòng cũ (NULL) được tính từ image_path và lưu lại ở lần đăng ký / dedupe-gallery kế tiếp
@@ -1,16 +1,49 @@
 #!/usr/bin/env python3
 """
-Script to run database migration for adding student_code field
+Script to run database migrations.
+
+Applies the SQL files in migrations/ in filename order. Applied files are
+recorded in the schema_migrations table so each one runs only once.
 """
 import sys
 import os
+import glob
+
+# Add the backend directory to Python path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import text
+
+from app.core.database import engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+def run_migrations():
+    """Apply pending migrations, each in its own transaction"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " name VARCHAR(255) PRIMARY KEY,"
+            " applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        ))
+        applied = set(conn.execute(text("SELECT name FROM schema_migrations")).scalars())
 
-# Add the app directory to Python path
-sys.path.append(os.path.join(os.path.dirname(__file__), 'app'))
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        name = os.path.basename(path)
+        if name in applied:
+            continue
+        print(f"Applying {name}...")
+        with open(path, encoding="utf-8") as f:
+            sql = f.read()
+        with engine.begin() as conn:
+            # no_parameters: gửi SQL nguyên văn (không xử lý ký tự % như placeholder)
+            conn.exec_driver_sql(sql, execution_options={"no_parameters": True})
+            conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
 
 if __name__ == "__main__":
     print("Starting migration...")
     try:
+        run_migrations()
         print("Migration completed successfully!")
     except Exception as e:
         print(f"Migration failed: {e}")
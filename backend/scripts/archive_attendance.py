@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Archive old monthly partitions of attendance_records.
+
+Partitions older than --keep-months (default ATTENDANCE_RETENTION_MONTHS)
+are written to <archive-dir>/attendance_records_YYYY_MM.csv.gz, then
+detached and dropped. Only the final detach locks attendance_records, for a
+few milliseconds; a month whose detach times out is skipped and retried on the
+next run. Daily totals stay in attendance_daily_stats, so /attendance/stats
+still covers archived months, and the rebuild scripts leave them alone.
+Run it from cron, e.g. monthly:
+
+    cd backend
+    python scripts/archive_attendance.py --dry-run
+    python scripts/archive_attendance.py --keep-months 24
+
+To restore a month, recreate its partition and load the file:
+
+    CREATE TABLE attendance_records_2024_01 PARTITION OF attendance_records
+        FOR VALUES FROM ('2024-01-01') TO ('2024-02-01');
+    gunzip -c attendance_records_2024_01.csv.gz | psql -c "\\copy attendance_records FROM STDIN WITH (FORMAT csv, HEADER)"
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.services.attendance_partitions import archive_partitions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keep-months", type=int, default=settings.ATTENDANCE_RETENTION_MONTHS)
+    parser.add_argument("--archive-dir", default=settings.ATTENDANCE_ARCHIVE_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be archived")
+    args = parser.parse_args()
+
+    if args.keep_months <= 0:
+        print("Retention disabled (keep-months <= 0), nothing to do")
+        return
+
+    archived = archive_partitions(args.keep_months, args.archive_dir, dry_run=args.dry_run)
+    for name, rows, path in archived:
+        print(f"{'Would archive' if args.dry_run else 'Archived'} {name}" + ("" if args.dry_run else f": {rows} rows -> {path}"))
+    if not archived:
+        print("No partitions older than the retention period")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark mapping + serialization of one page of students.
+
+Compares the previous path (full ORM entities -> StudentResponse(...) ->
+FastAPI-style validate + jsonable dump + json.dumps) with the column-only
+path used by StudentService (row tuples -> model_construct -> pydantic-core
+dump_json). Runs against the configured DATABASE_URL; the students table
+should hold at least --limit rows.
+
+    cd backend
+    python scripts/benchmark_list_mapping.py --limit 1000 --rounds 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+
+from app.core.database import AsyncSessionLocal, UnitOfWork, async_engine
+from app.core.database import Student as StudentModel
+from app.models.student import StudentResponse, StudentListAdapter
+from app.services.student_service import StudentService
+
+# FastAPI (pydantic v2) validates the returned objects against response_model,
+# dumps them in JSON mode and then encodes with json.dumps
+_response_field = TypeAdapter(List[StudentResponse])
+
+async def entity_path(limit: int) -> bytes:
+    async with AsyncSessionLocal() as db:
+        students = (await db.scalars(select(StudentModel).order_by(StudentModel.id).limit(limit))).all()
+        items = [
+            StudentResponse(
+                id=student.id,
+                student_code=student.student_code,
+                full_name=student.full_name,
+                email=student.email,
+                grade=student.grade,
+                date_of_birth=student.date_of_birth,
+                phone=student.phone,
+                address=student.address,
+                parent_name=student.parent_name,
+                parent_phone=student.parent_phone,
+                parent_email=student.parent_email,
+                photo_path=student.photo_path,
+                created_at=student.created_at,
+                updated_at=student.updated_at,
+            )
+            for student in students
+        ]
+    content = _response_field.dump_python(_response_field.validate_python(items), mode="json")
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+async def column_path(limit: int) -> bytes:
+    async with AsyncSessionLocal() as db:
+        items, _ = await StudentService(UnitOfWork(db, read_only=True)).get_students_page(limit=limit)
+    return StudentListAdapter.dump_json(items)
+
+async def measure(name: str, func, limit: int, rounds: int):
+    await func(limit)  # warm up (connections, statement cache)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        body = await func(limit)
+    elapsed = (time.perf_counter() - started) / rounds
+    rows = len(json.loads(body))
+    print(f"{name:8s} {rows} rows: {elapsed * 1000:8.2f} ms/page  {rows / elapsed:10.0f} rows/s")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    await measure("entity", entity_path, args.limit, args.rounds)
+    await measure("columns", column_path, args.limit, args.rounds)
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
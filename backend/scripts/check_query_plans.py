@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Check that the hot attendance/student queries use their indexes.
+
+Each check runs EXPLAIN (FORMAT JSON) on a query shaped like the one the
+services issue and fails if the expected index does not appear in the
+plan, or if a date-range query scans more monthly partitions than its
+range covers. The exit code is non-zero when any check fails. On small
+tables Postgres rightly prefers sequential scans, so run it against
+production-sized data or use --seed.
+
+This is a script to run by hand, not a test: the repository has no test
+suite or CI job, and the checks need a migrated database with realistic
+row counts. Run it after adding or changing a migration, or after
+changing the shape of one of the queries below.
+
+With --seed the checks run against a synthetic copy of the tables in a
+separate schema (default `bench`; the indexes of the real tables are
+recreated there under the same names) instead of the real data:
+
+    cd backend
+    python run_migration.py
+    python scripts/check_query_plans.py --seed --students 50000 --days 200 --analyze
+    python scripts/check_query_plans.py --schema bench --analyze   # re-run without reseeding
+    python scripts/check_query_plans.py --schema bench --drop
+
+50,000 students x 200 days = 10M attendance rows. --analyze also executes
+each query and prints its time.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Set
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, text
+
+from app.core.database import engine
+from app.core.database import AttendanceRecord as AttendanceModel
+from app.core.database import Student as StudentModel
+from app.services.attendance_partitions import add_months, month_start, partition_name
+from app.services.attendance_service import AttendanceService
+
+START_DAY = datetime(2024, 1, 1)
+DEVICES = 20
+
+def seed(conn, schema: str, students: int, days: int):
+    """Tạo schema benchmark với cùng cột và index như bảng thật rồi sinh dữ liệu"""
+    conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+    conn.execute(text(f"CREATE SCHEMA {schema}"))
+    conn.execute(text(f"CREATE TABLE {schema}.students (LIKE public.students INCLUDING DEFAULTS)"))
+    # attendance_records partition theo tháng giống bảng thật (migration 007)
+    conn.execute(text(
+        f"CREATE TABLE {schema}.attendance_records (LIKE public.attendance_records INCLUDING DEFAULTS)"
+        " PARTITION BY RANGE (date)"
+    ))
+    month = month_start(START_DAY.date())
+    while month <= (START_DAY + timedelta(days=days)).date():
+        conn.execute(text(
+            f"CREATE TABLE {schema}.{partition_name(month)} PARTITION OF {schema}.attendance_records"
+            f" FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+        month = add_months(month, 1)
+
+    started = time.perf_counter()
+    # 1/4 học sinh đã nghỉ/ra trường (is_active = false)
+    conn.execute(text(f"""
+        INSERT INTO {schema}.students (id, student_code, full_name, grade, is_active, created_at)
+        SELECT g, 'S' || lpad(g::text, 8, '0'), 'Student ' || g, 'G' || (g % 12 + 1), g % 4 <> 0, now()
+        FROM generate_series(1, :students) g
+    """), {"students": students})
+    # Mỗi học sinh một dòng mỗi ngày; 1% chưa đồng bộ, 10% không có thiết bị
+    conn.execute(text(f"""
+        INSERT INTO {schema}.attendance_records
+            (id, student_id, date, check_in_time, status, device_id, sync_status, created_at)
+        SELECT d * :students + s, s, :start + d * interval '1 day', :start + d * interval '1 day' + interval '7 hours',
+               CASE WHEN (s + d) % 17 = 0 THEN 'absent' WHEN (s + d) % 11 = 0 THEN 'late' ELSE 'present' END,
+               CASE WHEN (s * 7 + d) % 10 = 0 THEN NULL ELSE 'gate-' || ((s + d) % :devices) END,
+               CASE WHEN (s * 31 + d) % 100 = 0 THEN 'pending' ELSE 'synced' END,
+               now()
+        FROM generate_series(0, :days - 1) d, generate_series(1, :students) s
+    """), {"students": students, "days": days, "start": START_DAY, "devices": DEVICES})
+    # Index tạo sau khi nạp dữ liệu (nhanh hơn), cùng tên và định nghĩa như bảng thật
+    for table in ("students", "attendance_records"):
+        definitions = conn.execute(
+            text("SELECT indexdef FROM pg_indexes WHERE schemaname = 'public' AND tablename = :table"),
+            {"table": table},
+        ).scalars().all()
+        for definition in definitions:
+            definition = definition.replace(f" ON ONLY public.{table} ", f" ON public.{table} ")
+            conn.execute(text(definition.replace(f" ON public.{table} ", f" ON {schema}.{table} ")))
+    print(f"Seeded {students} students x {days} days in {time.perf_counter() - started:.1f}s")
+
+def plan_indexes(plan: dict) -> Set[str]:
+    """Tên các index xuất hiện trong cây plan"""
+    found = set()
+    if "Index Name" in plan:
+        found.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        found |= plan_indexes(child)
+    return found
+
+def plan_relations(plan: dict) -> Set[str]:
+    """Các bảng/partition được quét trong cây plan"""
+    found = {plan["Relation Name"]} if "Relation Name" in plan else set()
+    for child in plan.get("Plans", []):
+        found |= plan_relations(child)
+    return found
+
+def checks(days: int) -> List[tuple]:
+    """(tên, query, các index chấp nhận được, số partition tối đa được quét)"""
+    last_day = START_DAY + timedelta(days=max(days - 1, 0))
+    columns = AttendanceService.RESPONSE_COLUMNS
+    return [
+        (
+            "attendance of one student in a date range",
+            select(*columns).where(
+                AttendanceModel.student_id == 42,
+                AttendanceModel.date >= last_day - timedelta(days=30),
+                AttendanceModel.date < last_day,
+            ),
+            {"uq_attendance_records_student_id_date", "ix_attendance_records_student_id_date_id"},
+            2,  # 30 ngày: tối đa 2 partition tháng
+        ),
+        (
+            "latest attendance page (keyset, date desc)",
+            select(*columns).order_by(AttendanceModel.date.desc(), AttendanceModel.id.desc()).limit(101),
+            {"ix_attendance_records_date_id"},
+            None,
+        ),
+        (
+            "records of one device since a date (sync download)",
+            select(*columns).where(
+                AttendanceModel.device_id == "gate-3",
+                AttendanceModel.date >= last_day - timedelta(days=7),
+            ),
+            {"ix_attendance_records_device_id_date"},
+            2,
+        ),
+        (
+            "pending sync queue",
+            select(*columns).where(AttendanceModel.sync_status == "pending").order_by(AttendanceModel.id).limit(1000),
+            {"ix_attendance_records_sync_pending"},
+            None,
+        ),
+        (
+            "active students of a grade",
+            select(StudentModel.id, StudentModel.full_name).where(
+                StudentModel.grade == "G3", StudentModel.is_active == True
+            ),
+            {"ix_students_grade_active"},
+            None,
+        ),
+        (
+            "active student count of a grade",
+            select(func.count()).select_from(StudentModel).where(
+                StudentModel.grade == "G3", StudentModel.is_active == True
+            ),
+            {"ix_students_grade_active"},
+            None,
+        ),
+    ]
+
+def parent_indexes(conn) -> dict:
+    """Index của từng partition -> index tương ứng trên bảng cha"""
+    return dict(conn.execute(text("""
+        SELECT child.relname, parent.relname
+        FROM pg_inherits i
+        JOIN pg_class child ON child.oid = i.inhrelid
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        WHERE child.relkind = 'i'
+    """)).all())
+
+def run_checks(conn, days: int, analyze: bool) -> int:
+    failures = 0
+    parents = parent_indexes(conn)
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    for name, query, expected, max_partitions in checks(days):
+        compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+        result = conn.execute(text(f"EXPLAIN ({options}) {compiled}")).scalar()
+        plan = (json.loads(result) if isinstance(result, str) else result)[0]
+        used = {parents.get(name, name) for name in plan_indexes(plan["Plan"])}
+        scanned = plan_relations(plan["Plan"])
+        index_ok = bool(used & expected)
+        pruning_ok = max_partitions is None or len(scanned) <= max_partitions
+        ok = index_ok and pruning_ok
+        failures += not ok
+        timing = f" {plan['Execution Time']:8.2f} ms" if analyze else ""
+        print(f"{'PASS' if ok else 'FAIL'}{timing}  {name}: {', '.join(sorted(used)) or 'no index'}"
+              f" ({len(scanned)} relation(s))")
+        if not index_ok:
+            print(f"      expected one of: {', '.join(sorted(expected))}")
+        if not pruning_ok:
+            print(f"      scanned {', '.join(sorted(scanned))}; expected at most {max_partitions} partition(s)")
+    return failures
+
+def main(argv: Iterable[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--schema", default=None, help="Schema to check (default: public, or bench with --seed)")
+    parser.add_argument("--seed", action="store_true", help="(Re)create the schema with synthetic data first")
+    parser.add_argument("--students", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=200)
+    parser.add_argument("--analyze", action="store_true", help="Execute the queries and report timings")
+    parser.add_argument("--drop", action="store_true", help="Drop the benchmark schema and exit")
+    args = parser.parse_args(argv)
+    schema = args.schema or ("bench" if args.seed else "public")
+
+    if args.drop:
+        if schema == "public":
+            parser.error("refusing to drop the public schema")
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        return 0
+
+    if args.seed:
+        if schema == "public":
+            parser.error("--seed needs a separate schema")
+        with engine.begin() as conn:
+            seed(conn, schema, args.students, args.days)
+        # VACUUM cập nhật visibility map (cho index-only scan) như bảng thật sau autovacuum
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            for table in ("students", "attendance_records"):
+                conn.execute(text(f"VACUUM ANALYZE {schema}.{table}"))
+
+    with engine.connect() as conn:
+        conn.execute(text(f"SET search_path TO {schema}"))
+        failures = run_checks(conn, args.days, args.analyze)
+        conn.rollback()
+    print(f"{failures} failing check(s)" if failures else "All queries use their indexes")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
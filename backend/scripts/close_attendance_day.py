@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Close out a day of attendance: record `absent` for every active student
+without a check-in and mark check-ins after ATTENDANCE_LATE_CUTOFF as late.
+
+The server runs this every school day at ATTENDANCE_CLOSEOUT_TIME. Use the
+script to backfill missed days or re-run a day after fixing data; running
+it again for the same day changes nothing. Days without any check-in
+(holidays) are skipped unless --force is given.
+
+    cd backend
+    python scripts/close_attendance_day.py --date 2024-09-05
+    python scripts/close_attendance_day.py --from 2024-09-01 --to 2024-09-30
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.core.database import async_engine
+from app.services.attendance_closeout import close_attendance_day
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Single day (default: today)")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None)
+    parser.add_argument("--grade", default=None, help="Only close out one grade")
+    parser.add_argument("--force", action="store_true", help="Also close days without check-ins or outside school weekdays")
+    args = parser.parse_args()
+
+    if args.date_from:
+        day, last = args.date_from, args.date_to or date.today()
+    else:
+        day = last = args.date or date.today()
+
+    while day <= last:
+        if args.force or day.weekday() in settings.ATTENDANCE_SCHOOL_WEEKDAYS:
+            summary = await close_attendance_day(day, grade=args.grade, force=args.force, flush_buffer=False)
+            if summary["skipped"]:
+                print(f"{day}: skipped ({summary['skipped']})")
+            else:
+                print(f"{day}: {summary['absent']} absent, {summary['late']} late, {summary['on_time']} back to present")
+        day += timedelta(days=1)
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
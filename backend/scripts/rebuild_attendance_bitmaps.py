@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Rebuild the per-term attendance bitmaps (attendance_term_bitmaps) from attendance_records.
+
+Bitmaps are updated as check-ins are flushed; run this once after migration
+008 to fill in existing history, and after bulk edits made outside the API.
+Every term overlapping the date range is rebuilt in full. Without dates all
+terms from the first attendance record up to today are rebuilt. Terms that
+include archived months (scripts/archive_attendance.py) are skipped by default
+and refused when --from falls inside them.
+
+    cd backend
+    python scripts/rebuild_attendance_bitmaps.py
+    python scripts/rebuild_attendance_bitmaps.py --from 2024-09-01 --to 2025-01-14
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import AsyncSessionLocal, UnitOfWork, async_engine
+from app.services.attendance_bitmap_service import AttendanceBitmapService
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    async with AsyncSessionLocal() as session:
+        uow = UnitOfWork(session)
+        try:
+            rows = await AttendanceBitmapService(uow).rebuild(args.date_from, args.date_to)
+        except ValueError as e:
+            await async_engine.dispose()
+            sys.exit(str(e))
+        await uow.commit()
+    print(f"Rebuilt {rows} (student, term) bitmaps")
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
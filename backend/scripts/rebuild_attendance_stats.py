@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Rebuild the attendance_daily_stats aggregate table from attendance_records.
+
+The table is kept up to date as check-ins are flushed; run this after bulk
+edits made outside the API, after students change grade, or whenever the
+numbers look off. Without dates the whole table is rebuilt, starting at the
+oldest month still in attendance_records: totals of archived months
+(scripts/archive_attendance.py) are kept, and a --from inside them is refused.
+
+    cd backend
+    python scripts/rebuild_attendance_stats.py --from 2024-09-01 --to 2024-09-30
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import date
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import AsyncSessionLocal, UnitOfWork, async_engine
+from app.services.attendance_stats_service import AttendanceStatsService
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, default=None)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    async with AsyncSessionLocal() as session:
+        uow = UnitOfWork(session)
+        try:
+            rows = await AttendanceStatsService(uow).rebuild(args.date_from, args.date_to)
+        except ValueError as e:
+            await async_engine.dispose()
+            sys.exit(str(e))
+        await uow.commit()
+    print(f"Rebuilt {rows} (date, grade) rows")
+    await async_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())